@@ -1,162 +1,253 @@
+from concurrent.futures import ThreadPoolExecutor
 from os.path import join
 import json
 import pandas as pd
-import ast
 import pickle
 
-from utils.nlp import extract_primary_diagnosis
-from dataset.utils import write_hadm_to_file
+from dataset.utils import (
+    write_hadm_to_file,
+    load_lab_test_mapping,
+    write_lab_test_mapping,
+)
 
 base_new = ""
-
-# Process lab test mapping
-lab_test_mapping_df = pd.read_csv(join(base_new, "lab_test_mapping.csv"))
-lab_test_mapping_df["corresponding_ids"] = lab_test_mapping_df[
-    "corresponding_ids"
-].apply(ast.literal_eval)
-lab_test_mapping_df["corresponding_ids"] = lab_test_mapping_df[
-    "corresponding_ids"
-].apply(lambda x: [int(i) for i in x])
-pickle.dump(lab_test_mapping_df, open(join(base_new, "lab_test_mapping.pkl"), "wb"))
+write_lab_test_mapping_pickle = True
+# Set > 1 to read the csv files concurrently in threads
+n_workers = 1
 
 
-def update_hadm(base_new, filename, hadm_info, key, hadm_name, _list=False):
-    df = pd.read_csv(join(base_new, filename))
-    for _, row in df.iterrows():
-        _id = row["hadm_id"]
+# Process lab test mapping. The parquet file is loaded with dataset.utils.load_lab_test_mapping, the pickle is only
+# written for consumers that still expect it
+def convert_lab_test_mapping(base_new, write_pickle=True):
+    lab_test_mapping_df = load_lab_test_mapping(join(base_new, "lab_test_mapping.csv"))
+    write_lab_test_mapping(
+        lab_test_mapping_df, join(base_new, "lab_test_mapping.parquet")
+    )
+    if write_pickle:
+        pickle.dump(
+            lab_test_mapping_df, open(join(base_new, "lab_test_mapping.pkl"), "wb")
+        )
+
+
+def column_values(df, columns):
+    # Values of columns exactly as iterrows would return them, i.e. taken from the interleaved df.values array so that
+    # numeric columns of mixed frames become python objects and the types in the written pickles do not change
+    values = df.values
+    if values.dtype == object:
+        return [values[:, df.columns.get_loc(column)].tolist() for column in columns]
+    return [list(values[:, df.columns.get_loc(column)]) for column in columns]
+
+
+# The conversion is split into reading and grouping every csv into partial results of hadm_id to sections, and merging
+# the partial results into hadm_info in a fixed order. Files can thus be processed concurrently while the merged hadm_info
+# is the same as when processing them one after another
+def group_hadm(df, key, hadm_name, _list=False):
+    partial = {}
+    for _id, value in zip(*column_values(df, ["hadm_id", key])):
+        if _id not in partial:
+            partial[_id] = {}
         if _list:
-            if hadm_name not in hadm_info[_id]:
-                hadm_info[_id][hadm_name] = []
-            hadm_info[_id][hadm_name].append(row[key])
+            if hadm_name not in partial[_id]:
+                partial[_id][hadm_name] = []
+            partial[_id][hadm_name].append(value)
         # For single value fields
         else:
-            hadm_info[_id][hadm_name] = row[key]
-    return hadm_info
-
-
-hadm_info = {}
-
-# Create entries for all hadm_ids
-hpi_df = pd.read_csv(join(base_new, "history_of_present_illness.csv"))
-hadm_ids = hpi_df["hadm_id"].to_list()
-for _id in hadm_ids:
-    hadm_info[_id] = {}
-
-hadm_info = update_hadm(
-    base_new, "history_of_present_illness.csv", hadm_info, "hpi", "Patient History"
-)
-
-hadm_info = update_hadm(
-    base_new, "physical_examination.csv", hadm_info, "pe", "Physical Examination"
-)
-
-lab_events_df = pd.read_csv(join(base_new, "laboratory_tests.csv"))
-for _, row in lab_events_df.iterrows():
-    _id = row["hadm_id"]
-    if "Laboratory Tests" not in hadm_info[_id]:
-        hadm_info[_id]["Laboratory Tests"] = {}
-        hadm_info[_id]["Reference Range Lower"] = {}
-        hadm_info[_id]["Reference Range Upper"] = {}
-    hadm_info[_id]["Laboratory Tests"][row["itemid"]] = row["valuestr"]
-    hadm_info[_id]["Reference Range Lower"][row["itemid"]] = row["ref_range_lower"]
-    hadm_info[_id]["Reference Range Upper"][row["itemid"]] = row["ref_range_upper"]
-
-microbiology_df = pd.read_csv(join(base_new, "microbiology.csv"))
-for _, row in microbiology_df.iterrows():
-    _id = row["hadm_id"]
-    if "Microbiology" not in hadm_info[_id]:
-        hadm_info[_id]["Microbiology"] = {}
-        hadm_info[_id]["Microbiology Spec"] = {}
-    hadm_info[_id]["Microbiology"][row["test_itemid"]] = row["valuestr"]
-    hadm_info[_id]["Microbiology Spec"][row["test_itemid"]] = row["spec_itemid"]
-
-radiology_df = pd.read_csv(join(base_new, "radiology_reports.csv"))
-for _, row in radiology_df.iterrows():
-    _id = row["hadm_id"]
-    if "Radiology" not in hadm_info[_id]:
-        hadm_info[_id]["Radiology"] = []
-    hadm_info[_id]["Radiology"].append(
-        {
-            "Note ID": row["note_id"],
-            "Modality": row["modality"],
-            "Region": row["region"],
-            "Exam Name": row["exam_name"],
-            "Report": row["text"],
-        }
-    )
+            partial[_id][hadm_name] = value
+    return partial
+
+
+def group_lab_tests(lab_events_df):
+    partial = {}
+    for _id, itemid, valuestr, ref_range_lower, ref_range_upper in zip(
+        *column_values(
+            lab_events_df,
+            [
+                "hadm_id",
+                "itemid",
+                "valuestr",
+                "ref_range_lower",
+                "ref_range_upper",
+            ],
+        )
+    ):
+        if _id not in partial:
+            partial[_id] = {
+                "Laboratory Tests": {},
+                "Reference Range Lower": {},
+                "Reference Range Upper": {},
+            }
+        partial[_id]["Laboratory Tests"][itemid] = valuestr
+        partial[_id]["Reference Range Lower"][itemid] = ref_range_lower
+        partial[_id]["Reference Range Upper"][itemid] = ref_range_upper
+    return partial
+
+
+def group_microbiology(microbiology_df):
+    partial = {}
+    for _id, test_itemid, valuestr, spec_itemid in zip(
+        *column_values(
+            microbiology_df, ["hadm_id", "test_itemid", "valuestr", "spec_itemid"]
+        )
+    ):
+        if _id not in partial:
+            partial[_id] = {"Microbiology": {}, "Microbiology Spec": {}}
+        partial[_id]["Microbiology"][test_itemid] = valuestr
+        partial[_id]["Microbiology Spec"][test_itemid] = spec_itemid
+    return partial
+
+
+def group_radiology(radiology_df):
+    partial = {}
+    for _id, note_id, modality, region, exam_name, text in zip(
+        *column_values(
+            radiology_df,
+            ["hadm_id", "note_id", "modality", "region", "exam_name", "text"],
+        )
+    ):
+        if _id not in partial:
+            partial[_id] = {"Radiology": []}
+        partial[_id]["Radiology"].append(
+            {
+                "Note ID": note_id,
+                "Modality": modality,
+                "Region": region,
+                "Exam Name": exam_name,
+                "Report": text,
+            }
+        )
+    return partial
+
+
+def group_icd_procedures(icd_procedures_df):
+    partial = {}
+    for _id, icd_version, icd_code, icd_title in zip(
+        *column_values(
+            icd_procedures_df, ["hadm_id", "icd_version", "icd_code", "icd_title"]
+        )
+    ):
+        if _id not in partial:
+            partial[_id] = {
+                "Procedures ICD9": [],
+                "Procedures ICD9 Title": [],
+                "Procedures ICD10": [],
+                "Procedures ICD10 Title": [],
+            }
+        if icd_version == 9:
+            partial[_id]["Procedures ICD9"].append(icd_code)
+            partial[_id]["Procedures ICD9 Title"].append(icd_title)
+        else:
+            partial[_id]["Procedures ICD10"].append(icd_code)
+            partial[_id]["Procedures ICD10 Title"].append(icd_title)
+    return partial
 
-hadm_info = update_hadm(
-    base_new,
-    "discharge_diagnosis.csv",
-    hadm_info,
-    "discharge_diagnosis",
-    "Discharge Diagnosis",
-)
 
-hadm_info = update_hadm(
-    base_new,
-    "icd_diagnosis.csv",
-    hadm_info,
-    "icd_diagnosis",
-    "ICD Diagnosis",
-    _list=True,
-)
+def merge_partial(hadm_info, partial):
+    for _id, sections in partial.items():
+        hadm_info[_id].update(sections)
+    return hadm_info
 
-hadm_info = update_hadm(
-    base_new,
-    "discharge_procedures.csv",
-    hadm_info,
-    "discharge_procedure",
-    "Procedures Discharge",
-    _list=True,
-)
 
-icd_procedures_df = pd.read_csv(join(base_new, "icd_procedures.csv"))
-for _, row in icd_procedures_df.iterrows():
-    _id = row["hadm_id"]
-    if "Procedures ICD9" not in hadm_info[_id]:
-        hadm_info[_id]["Procedures ICD9"] = []
-        hadm_info[_id]["Procedures ICD9 Title"] = []
-        hadm_info[_id]["Procedures ICD10"] = []
-        hadm_info[_id]["Procedures ICD10 Title"] = []
-    if row["icd_version"] == 9:
-        hadm_info[_id]["Procedures ICD9"].append(row["icd_code"])
-        hadm_info[_id]["Procedures ICD9 Title"].append(row["icd_title"])
+def update_hadm(base_new, filename, hadm_info, key, hadm_name, _list=False):
+    df = pd.read_csv(join(base_new, filename))
+    return merge_partial(hadm_info, group_hadm(df, key, hadm_name, _list))
+
+
+# Files in the order in which they are merged into hadm_info and the function that groups them
+CSV_GROUPERS = [
+    (
+        "history_of_present_illness.csv",
+        lambda df: group_hadm(df, "hpi", "Patient History"),
+    ),
+    (
+        "physical_examination.csv",
+        lambda df: group_hadm(df, "pe", "Physical Examination"),
+    ),
+    ("laboratory_tests.csv", group_lab_tests),
+    ("microbiology.csv", group_microbiology),
+    ("radiology_reports.csv", group_radiology),
+    (
+        "discharge_diagnosis.csv",
+        lambda df: group_hadm(df, "discharge_diagnosis", "Discharge Diagnosis"),
+    ),
+    (
+        "icd_diagnosis.csv",
+        lambda df: group_hadm(df, "icd_diagnosis", "ICD Diagnosis", _list=True),
+    ),
+    (
+        "discharge_procedures.csv",
+        lambda df: group_hadm(
+            df, "discharge_procedure", "Procedures Discharge", _list=True
+        ),
+    ),
+    ("icd_procedures.csv", group_icd_procedures),
+]
+
+
+def read_and_group(base_new, filename, grouper):
+    df = pd.read_csv(join(base_new, filename))
+    return df["hadm_id"].to_list(), grouper(df)
+
+
+def create_hadm_info(base_new, n_workers=1):
+    """
+    Create hadm_info from the MIMIC-IV-Ext-CDM csv files.
+
+    Args:
+        base_new (str): Folder of the MIMIC-IV-Ext-CDM dataset
+        n_workers (int): Number of threads reading and grouping the csv files concurrently. pandas releases the GIL
+            while parsing, so the reads overlap. With 1 all files are processed one after another
+
+    Returns:
+        hadm_info (dict): hadm_id to admission dict
+    """
+    if n_workers > 1:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = [
+                executor.submit(read_and_group, base_new, filename, grouper)
+                for filename, grouper in CSV_GROUPERS
+            ]
+            results = [future.result() for future in futures]
     else:
-        hadm_info[_id]["Procedures ICD10"].append(row["icd_code"])
-        hadm_info[_id]["Procedures ICD10 Title"].append(row["icd_title"])
+        results = [
+            read_and_group(base_new, filename, grouper)
+            for filename, grouper in CSV_GROUPERS
+        ]
+
+    # Create entries for all hadm_ids
+    hadm_ids = results[0][0]
+    hadm_info = {}
+    for _id in hadm_ids:
+        hadm_info[_id] = {}
+
+    for _, partial in results:
+        hadm_info = merge_partial(hadm_info, partial)
+    return hadm_info
 
 
 # Parse patient case files
-with open(join(base_new, "pathology_ids.json")) as f:
-    patho_ids = json.load(f)
-
-app_hadm_info_firstdiag = {}
-cholec_hadm_info_firstdiag = {}
-pancr_hadm_info_firstdiag = {}
-divert_hadm_info_firstdiag = {}
-
-for _id in patho_ids["appendicitis"]:
-    app_hadm_info_firstdiag[_id] = hadm_info[_id]
-
-for _id in patho_ids["cholecystitis"]:
-    cholec_hadm_info_firstdiag[_id] = hadm_info[_id]
-
-for _id in patho_ids["diverticulitis"]:
-    divert_hadm_info_firstdiag[_id] = hadm_info[_id]
-
-for _id in patho_ids["pancreatitis"]:
-    pancr_hadm_info_firstdiag[_id] = hadm_info[_id]
-
-write_hadm_to_file(
-    app_hadm_info_firstdiag, "appendicitis_hadm_info_first_diag", base_new
-)
-write_hadm_to_file(
-    cholec_hadm_info_firstdiag, "cholecystitis_hadm_info_first_diag", base_new
-)
-write_hadm_to_file(
-    pancr_hadm_info_firstdiag, "pancreatitis_hadm_info_first_diag", base_new
-)
-write_hadm_to_file(
-    divert_hadm_info_firstdiag, "diverticulitis_hadm_info_first_diag", base_new
-)
+def write_pathology_files(base_new, hadm_info):
+    with open(join(base_new, "pathology_ids.json")) as f:
+        patho_ids = json.load(f)
+
+    for pathology in [
+        "appendicitis",
+        "cholecystitis",
+        "pancreatitis",
+        "diverticulitis",
+    ]:
+        hadm_info_firstdiag = {}
+        for _id in patho_ids[pathology]:
+            hadm_info_firstdiag[_id] = hadm_info[_id]
+        write_hadm_to_file(
+            hadm_info_firstdiag, "{}_hadm_info_first_diag".format(pathology), base_new
+        )
+
+
+def convert(base_new, write_pickle=True, n_workers=1):
+    convert_lab_test_mapping(base_new, write_pickle)
+    hadm_info = create_hadm_info(base_new, n_workers)
+    write_pathology_files(base_new, hadm_info)
+
+
+if __name__ == "__main__":
+    convert(base_new, write_lab_test_mapping_pickle, n_workers)
@@ -1,15 +1,43 @@
 from os.path import join
 import pickle
 
-from dataset.dataset import load_data, extract_info, extract_hadm_ids
-from dataset.utils import load_hadm_from_file
-from utils.nlp import extract_primary_diagnosis
+from dataset.dataset import load_data, extract_info, extract_hadm_ids, SOURCE_FILES
+from dataset.diagnosis import ICDTitleIndex
+from dataset.utils import load_hadm_from_file, write_lab_test_mapping
+from utils.nlp import extract_primary_diagnosis_batch, enable_doc_cache
 from dataset.labs import generate_lab_test_mapping
+from dataset.text_store import externalize_texts, text_store_writer
+from dataset.query_index import build_query_index, write_query_index
+from dataset.provenance import Provenance
 
 base_mimic = ""
 base_new = ""
 MIMIC_hosp_base = join(base_mimic, "hosp")
 
+# Number of processes used for spacy parsing. Values above 1 rely on the fork start method (Linux) since this script has
+# no main guard, with spawn (macOS and Windows) the worker processes would re-run the script
+n_process = 1
+
+# Parsed spacy docs are cached here so that rebuilding the dataset does not re-parse the same texts
+doc_cache = enable_doc_cache(join(base_new, "doc_cache"))
+
+# Store discharge and radiology texts once in the shared texts.txtstore instead of in every case file. Load the case
+# files with dataset.text_store.resolve_texts then
+use_text_store = False
+text_store = text_store_writer("texts", base_new) if use_text_store else None
+
+# Additionally write the cases to <pathology>_hadm_info.jsonl and <pathology>_hadm_info_clean.jsonl, one admission per
+# line, e.g. to inspect them or load them without pickle. The files are written after the cohort is complete, so this
+# does not lower the memory use of the build
+write_jsonl = False
+
+# Record source fingerprints, code hashes and stage outputs in provenance.json, so that a rebuild only recomputes the
+# stages and admissions whose inputs changed, e.g. only the sanitization of one pathology after changing its terms
+use_provenance = False
+provenance = Provenance(base_new) if use_provenance else None
+if provenance is not None:
+    provenance.record_sources([join(base_mimic, f) for f in SOURCE_FILES])
+
 
 (
     admissions_df,
@@ -18,13 +46,26 @@ MIMIC_hosp_base = join(base_mimic, "hosp")
     procedures_df,
     discharge_df,
     radiology_report_df,
-    radiology_report_details_df,
+    radiology_report_details,
     lab_events_df,
     microbiology_df,
 ) = load_data(base_mimic)
 
+# Match the ICD titles of all pathologies in one pass over the diagnosis table
+icd_index = ICDTitleIndex(diag_icd)
+icd_index.match(
+    [
+        "acute appendicitis",
+        "acute cholecystitis",
+        "acute pancreatitis",
+        "diverticulitis",
+    ]
+)
+
 # Appendicitis
-app_hadm_ids = extract_hadm_ids("acute appendicitis", diag_icd, discharge_df)
+app_hadm_ids = extract_hadm_ids(
+    "acute appendicitis", diag_icd, discharge_df, icd_index=icd_index
+)
 
 app_hadm_info, app_hadm_info_clean = extract_info(
     app_hadm_ids,
@@ -36,13 +77,18 @@ app_hadm_info, app_hadm_info_clean = extract_info(
     lab_events_df,
     microbiology_df,
     radiology_report_df,
-    radiology_report_details_df,
+    radiology_report_details,
     diag_icd,
     procedures_df,
+    text_store=text_store,
+    provenance=provenance,
+    jsonl=write_jsonl,
 )
 
 # Cholecystitis
-cholec_hadm_ids = extract_hadm_ids("acute cholecystitis", diag_icd, discharge_df)
+cholec_hadm_ids = extract_hadm_ids(
+    "acute cholecystitis", diag_icd, discharge_df, icd_index=icd_index
+)
 
 cholec_hadm_info, cholec_hadm_info_clean = extract_info(
     cholec_hadm_ids,
@@ -54,13 +100,18 @@ cholec_hadm_info, cholec_hadm_info_clean = extract_info(
     lab_events_df,
     microbiology_df,
     radiology_report_df,
-    radiology_report_details_df,
+    radiology_report_details,
     diag_icd,
     procedures_df,
+    text_store=text_store,
+    provenance=provenance,
+    jsonl=write_jsonl,
 )
 
 # Pancreatitis
-pancr_hadm_ids = extract_hadm_ids("acute pancreatitis", diag_icd, discharge_df)
+pancr_hadm_ids = extract_hadm_ids(
+    "acute pancreatitis", diag_icd, discharge_df, icd_index=icd_index
+)
 
 pancr_hadm_info, pancr_hadm_info_clean = extract_info(
     pancr_hadm_ids,
@@ -72,14 +123,17 @@ pancr_hadm_info, pancr_hadm_info_clean = extract_info(
     lab_events_df,
     microbiology_df,
     radiology_report_df,
-    radiology_report_details_df,
+    radiology_report_details,
     diag_icd,
     procedures_df,
+    text_store=text_store,
+    provenance=provenance,
+    jsonl=write_jsonl,
 )
 
 # Diverticulitis
 divert_hadm_ids = extract_hadm_ids(
-    "diverticulitis", diag_icd, discharge_df, diag_counts=30, cc=10
+    "diverticulitis", diag_icd, discharge_df, diag_counts=30, cc=10, icd_index=icd_index
 )
 
 divert_hadm_info, divert_hadm_info_clean = extract_info(
@@ -92,9 +146,12 @@ divert_hadm_info, divert_hadm_info_clean = extract_info(
     lab_events_df,
     microbiology_df,
     radiology_report_df,
-    radiology_report_details_df,
+    radiology_report_details,
     diag_icd,
     procedures_df,
+    text_store=text_store,
+    provenance=provenance,
+    jsonl=write_jsonl,
 )
 
 
@@ -210,13 +267,15 @@ for patho, hadm_info in zip(
         divert_hadm_info_clean,
     ],
 ):
+    # Parse all discharge diagnoses of the pathology in one batch
+    ids = [p for p in hadm_info if p not in multi_diag_ids]
+    first_diags = extract_primary_diagnosis_batch(
+        [hadm_info[p]["Discharge Diagnosis"].lower() for p in ids],
+        n_process=n_process,
+    )
+
     first_diag_ids = []
-    for p in hadm_info:
-        if p in multi_diag_ids:
-            continue
-        dd = hadm_info[p]["Discharge Diagnosis"]
-        dd = dd.lower()
-        first_diag = extract_primary_diagnosis(dd)
+    for p, first_diag in zip(ids, first_diags):
         if first_diag and patho in first_diag.lower():
             first_diag_ids.append(p)
 
@@ -226,6 +285,8 @@ for patho, hadm_info in zip(
     )
     print()
 
+doc_cache.report()
+
 id_difficulty["gastritis"] = {}
 id_difficulty["gastritis"]["dr_eval"] = dr_eval["gastritis"]
 
@@ -248,10 +309,29 @@ for patho, hadm_info in zip(
     hadm_info_firstdiag = {}
     for _id in id_difficulty[patho]["first_diag"]:
         hadm_info_firstdiag[_id] = hadm_info[_id]
+    if text_store is not None:
+        hadm_info_firstdiag = externalize_texts(hadm_info_firstdiag, text_store)
     pickle.dump(
         hadm_info_firstdiag,
         open(join(base_new, f"{patho}_hadm_info_first_diag.pkl"), "wb"),
     )
+if text_store is not None:
+    text_store.close()
+
+# Index itemids, imaging, procedures and difficulties of all cases for dataset.query_index.load_query_index
+query_index = build_query_index(
+    {
+        "appendicitis": app_hadm_info,
+        "cholecystitis": cholec_hadm_info,
+        "pancreatitis": pancr_hadm_info,
+        "diverticulitis": divert_hadm_info,
+    },
+    id_difficulty,
+)
+write_query_index(query_index, "query_index", base_new)
+
+if provenance is not None:
+    print(provenance.report().to_string(index=False))
 
 
 # Generate lab test mapping files
@@ -261,3 +341,4 @@ lab_test_mapping_df = pickle.load(
     open(join(MIMIC_hosp_base, "lab_test_mapping.pkl"), "rb")
 )
 lab_test_mapping_df.to_csv(join(base_new, "lab_test_mapping.csv"), index=False)
+write_lab_test_mapping(lab_test_mapping_df, join(base_new, "lab_test_mapping.parquet"))
@@ -0,0 +1,262 @@
+# Benchmark hadm_info assembly of ConvertPhysionet on synthetic MIMIC-IV-Ext-CDM csv files and check that the written
+# pickles are byte for byte identical to the previous iterrows implementation
+# Run from the repository root with: python -m benchmarks.convert_benchmark
+import json
+import os
+import pickle
+import tempfile
+import time
+from os.path import join
+
+import numpy as np
+import pandas as pd
+
+from ConvertPhysionet import create_hadm_info, write_pathology_files
+
+n_admissions = 2000
+labs_per_admission = 100
+n_workers = 4
+
+
+# Previous implementation which iterates over the rows of every csv with iterrows
+def create_hadm_info_iterrows(base_new):
+    def update_hadm(base_new, filename, hadm_info, key, hadm_name, _list=False):
+        df = pd.read_csv(join(base_new, filename))
+        for _, row in df.iterrows():
+            _id = row["hadm_id"]
+            if _list:
+                if hadm_name not in hadm_info[_id]:
+                    hadm_info[_id][hadm_name] = []
+                hadm_info[_id][hadm_name].append(row[key])
+            else:
+                hadm_info[_id][hadm_name] = row[key]
+        return hadm_info
+
+    hadm_info = {}
+    hpi_df = pd.read_csv(join(base_new, "history_of_present_illness.csv"))
+    for _id in hpi_df["hadm_id"].to_list():
+        hadm_info[_id] = {}
+    hadm_info = update_hadm(
+        base_new, "history_of_present_illness.csv", hadm_info, "hpi", "Patient History"
+    )
+    hadm_info = update_hadm(
+        base_new, "physical_examination.csv", hadm_info, "pe", "Physical Examination"
+    )
+    lab_events_df = pd.read_csv(join(base_new, "laboratory_tests.csv"))
+    for _, row in lab_events_df.iterrows():
+        _id = row["hadm_id"]
+        if "Laboratory Tests" not in hadm_info[_id]:
+            hadm_info[_id]["Laboratory Tests"] = {}
+            hadm_info[_id]["Reference Range Lower"] = {}
+            hadm_info[_id]["Reference Range Upper"] = {}
+        hadm_info[_id]["Laboratory Tests"][row["itemid"]] = row["valuestr"]
+        hadm_info[_id]["Reference Range Lower"][row["itemid"]] = row["ref_range_lower"]
+        hadm_info[_id]["Reference Range Upper"][row["itemid"]] = row["ref_range_upper"]
+    microbiology_df = pd.read_csv(join(base_new, "microbiology.csv"))
+    for _, row in microbiology_df.iterrows():
+        _id = row["hadm_id"]
+        if "Microbiology" not in hadm_info[_id]:
+            hadm_info[_id]["Microbiology"] = {}
+            hadm_info[_id]["Microbiology Spec"] = {}
+        hadm_info[_id]["Microbiology"][row["test_itemid"]] = row["valuestr"]
+        hadm_info[_id]["Microbiology Spec"][row["test_itemid"]] = row["spec_itemid"]
+    radiology_df = pd.read_csv(join(base_new, "radiology_reports.csv"))
+    for _, row in radiology_df.iterrows():
+        _id = row["hadm_id"]
+        if "Radiology" not in hadm_info[_id]:
+            hadm_info[_id]["Radiology"] = []
+        hadm_info[_id]["Radiology"].append(
+            {
+                "Note ID": row["note_id"],
+                "Modality": row["modality"],
+                "Region": row["region"],
+                "Exam Name": row["exam_name"],
+                "Report": row["text"],
+            }
+        )
+    hadm_info = update_hadm(
+        base_new,
+        "discharge_diagnosis.csv",
+        hadm_info,
+        "discharge_diagnosis",
+        "Discharge Diagnosis",
+    )
+    hadm_info = update_hadm(
+        base_new,
+        "icd_diagnosis.csv",
+        hadm_info,
+        "icd_diagnosis",
+        "ICD Diagnosis",
+        _list=True,
+    )
+    hadm_info = update_hadm(
+        base_new,
+        "discharge_procedures.csv",
+        hadm_info,
+        "discharge_procedure",
+        "Procedures Discharge",
+        _list=True,
+    )
+    icd_procedures_df = pd.read_csv(join(base_new, "icd_procedures.csv"))
+    for _, row in icd_procedures_df.iterrows():
+        _id = row["hadm_id"]
+        if "Procedures ICD9" not in hadm_info[_id]:
+            hadm_info[_id]["Procedures ICD9"] = []
+            hadm_info[_id]["Procedures ICD9 Title"] = []
+            hadm_info[_id]["Procedures ICD10"] = []
+            hadm_info[_id]["Procedures ICD10 Title"] = []
+        if row["icd_version"] == 9:
+            hadm_info[_id]["Procedures ICD9"].append(row["icd_code"])
+            hadm_info[_id]["Procedures ICD9 Title"].append(row["icd_title"])
+        else:
+            hadm_info[_id]["Procedures ICD10"].append(row["icd_code"])
+            hadm_info[_id]["Procedures ICD10 Title"].append(row["icd_title"])
+    return hadm_info
+
+
+def write_synthetic_csvs(base_new):
+    rng = np.random.default_rng(0)
+    hadm_ids = 20000000 + rng.choice(10 * n_admissions, n_admissions, replace=False)
+
+    def choice(values, n):
+        return np.array(values, dtype=object)[rng.integers(0, len(values), n)]
+
+    def nan_some(values, p=0.2):
+        values = values.astype(float)
+        values[rng.random(len(values)) < p] = np.nan
+        return values
+
+    pd.DataFrame(
+        {"hadm_id": hadm_ids, "hpi": ["History {}".format(i) for i in hadm_ids]}
+    ).to_csv(join(base_new, "history_of_present_illness.csv"), index=False)
+    pd.DataFrame(
+        {"hadm_id": hadm_ids, "pe": ["Exam {}".format(i) for i in hadm_ids]}
+    ).to_csv(join(base_new, "physical_examination.csv"), index=False)
+
+    n = n_admissions * labs_per_admission
+    pd.DataFrame(
+        {
+            "hadm_id": np.repeat(hadm_ids, labs_per_admission),
+            "itemid": rng.integers(50800, 53000, n),
+            "valuestr": choice(["1.1 mg/dL", "14.2 K/uL", "NEGATIVE", "35 %"], n),
+            "ref_range_lower": nan_some(rng.integers(0, 50, n)),
+            "ref_range_upper": nan_some(rng.integers(50, 500, n)),
+        }
+    ).to_csv(join(base_new, "laboratory_tests.csv"), index=False)
+
+    n = n_admissions * 2
+    pd.DataFrame(
+        {
+            "hadm_id": np.repeat(hadm_ids, 2),
+            "test_itemid": rng.integers(90000, 90300, n),
+            "valuestr": choice(["NEGATIVE", "ESCHERICHIA COLI"], n),
+            "spec_itemid": nan_some(rng.integers(70000, 70100, n), 0.05),
+        }
+    ).to_csv(join(base_new, "microbiology.csv"), index=False)
+
+    n = n_admissions * 3
+    pd.DataFrame(
+        {
+            "hadm_id": np.repeat(hadm_ids, 3),
+            "note_id": ["{}-RR-{}".format(i, k) for i in hadm_ids for k in range(3)],
+            "modality": choice(["CT", "Ultrasound", None], n),
+            "region": choice(["Abdomen", "Chest", None], n),
+            "exam_name": choice(["CT ABD & PELVIS", "US ABD LIMIT"], n),
+            "text": choice(["Report text", "Other report"], n),
+        }
+    ).to_csv(join(base_new, "radiology_reports.csv"), index=False)
+
+    pd.DataFrame(
+        {
+            "hadm_id": hadm_ids,
+            "discharge_diagnosis": choice(["Appendicitis", None], n_admissions),
+        }
+    ).to_csv(join(base_new, "discharge_diagnosis.csv"), index=False)
+    pd.DataFrame(
+        {
+            "hadm_id": np.repeat(hadm_ids, 4),
+            "icd_diagnosis": choice(
+                ["Acute appendicitis", "Hypertension"], 4 * n_admissions
+            ),
+        }
+    ).to_csv(join(base_new, "icd_diagnosis.csv"), index=False)
+    pd.DataFrame(
+        {
+            "hadm_id": hadm_ids,
+            "discharge_procedure": choice(["Appendectomy", "ERCP"], n_admissions),
+        }
+    ).to_csv(join(base_new, "discharge_procedures.csv"), index=False)
+    pd.DataFrame(
+        {
+            "hadm_id": np.repeat(hadm_ids, 2),
+            "icd_version": choice([9, 10], 2 * n_admissions),
+            "icd_code": choice(["4701", "0DTJ4ZZ"], 2 * n_admissions),
+            "icd_title": choice(
+                ["Laparoscopic appendectomy", "Resection"], 2 * n_admissions
+            ),
+        }
+    ).to_csv(join(base_new, "icd_procedures.csv"), index=False)
+
+    ids = hadm_ids.tolist()
+    with open(join(base_new, "pathology_ids.json"), "w") as f:
+        json.dump(
+            {
+                "appendicitis": ids[0::4],
+                "cholecystitis": ids[1::4],
+                "pancreatitis": ids[2::4],
+                "diverticulitis": ids[3::4],
+            },
+            f,
+        )
+
+
+def pickled_files(base):
+    files = {}
+    for filename in sorted(os.listdir(base)):
+        if filename.endswith("_hadm_info_first_diag.pkl"):
+            with open(join(base, filename), "rb") as f:
+                files[filename] = f.read()
+    return files
+
+
+# The lab grouping processes are spawned and import this module, so the benchmark only runs when executed as main
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as base_new:
+        write_synthetic_csvs(base_new)
+        print(
+            "{} admissions, {} lab rows".format(
+                n_admissions, n_admissions * labs_per_admission
+            )
+        )
+
+        start = time.perf_counter()
+        hadm_info_iterrows = create_hadm_info_iterrows(base_new)
+        iterrows_time = time.perf_counter() - start
+        print("iterrows: {:.2f}s".format(iterrows_time))
+        write_pathology_files(base_new, hadm_info_iterrows)
+        expected = pickled_files(base_new)
+
+        start = time.perf_counter()
+        hadm_info = create_hadm_info(base_new)
+        vectorized_time = time.perf_counter() - start
+        print(
+            "Column values: {:.2f}s ({:.0f}x)".format(
+                vectorized_time, iterrows_time / vectorized_time
+            )
+        )
+        write_pathology_files(base_new, hadm_info)
+
+        assert pickle.dumps(hadm_info) == pickle.dumps(hadm_info_iterrows)
+        assert pickled_files(base_new) == expected
+        print("Pickles identical")
+
+        start = time.perf_counter()
+        hadm_info_threaded = create_hadm_info(base_new, n_workers=n_workers)
+        threaded_time = time.perf_counter() - start
+        print(
+            "Column values with {} reader threads: {:.2f}s ({:.0f}x)".format(
+                n_workers, threaded_time, iterrows_time / threaded_time
+            )
+        )
+        assert pickle.dumps(hadm_info_threaded) == pickle.dumps(hadm_info_iterrows)
+        print("Threaded hadm_info identical")
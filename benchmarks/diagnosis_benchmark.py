@@ -0,0 +1,56 @@
+# Benchmark ICD diagnosis attachment of extract_diagnosis_from_diag_df on a synthetic 10k admission cohort
+# Run from the repository root with: python -m benchmarks.diagnosis_benchmark
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset.diagnosis import extract_diagnosis_from_diag_df
+
+n_admissions = 500000
+n_cohort = 10000
+diagnoses_per_admission = 10
+
+
+# Previous implementation which filters the full diagnosis table once per admission
+def extract_diagnosis_from_diag_df_per_admission(hadm_info, diag_df):
+    for _id in hadm_info:
+        diagnoses = diag_df[diag_df["hadm_id"] == _id]["long_title"].values
+        hadm_info[_id]["ICD Diagnosis"] = diagnoses.tolist()
+    return hadm_info
+
+
+rng = np.random.default_rng(0)
+titles = np.array(["Diagnosis {}".format(i) for i in range(20000)], dtype=object)
+diag_df = pd.DataFrame(
+    {
+        "hadm_id": np.repeat(np.arange(n_admissions), diagnoses_per_admission),
+        "long_title": titles[
+            rng.integers(0, len(titles), n_admissions * diagnoses_per_admission)
+        ],
+    }
+).sample(frac=1, random_state=0)
+cohort_ids = rng.choice(n_admissions, n_cohort, replace=False).tolist()
+print(
+    "{} diagnosis rows, {} admissions in cohort".format(len(diag_df), len(cohort_ids))
+)
+
+start = time.perf_counter()
+grouped = extract_diagnosis_from_diag_df({_id: {} for _id in cohort_ids}, diag_df)
+grouped_time = time.perf_counter() - start
+print("Grouped: {:.2f}s".format(grouped_time))
+
+# The per admission version is timed on a subset and extrapolated since it takes very long on the full cohort
+subset_ids = cohort_ids[:200]
+start = time.perf_counter()
+per_admission = extract_diagnosis_from_diag_df_per_admission(
+    {_id: {} for _id in subset_ids}, diag_df
+)
+per_admission_time = (time.perf_counter() - start) * len(cohort_ids) / len(subset_ids)
+print(
+    "Per admission (extrapolated from {} admissions): {:.2f}s ({:.0f}x)".format(
+        len(subset_ids), per_admission_time, per_admission_time / grouped_time
+    )
+)
+
+assert all(per_admission[_id] == grouped[_id] for _id in subset_ids)
@@ -0,0 +1,79 @@
+# Compare throughput and agreement of the spacy and the rule based negation engines of keyword_positive
+# Run from the repository root with: python -m benchmarks.negation_benchmark
+# Without the scispacy model the spacy engine runs negspacy on a blank pipeline in which the keywords are the entities.
+# This checks the negation scopes but not the scispacy entity boundaries
+import time
+
+import spacy
+from negspacy.negation import Negex  # noqa: F401
+
+from utils.negation import keyword_positive_negex
+from utils.negation_cases import NEGATION_REGRESSION_CASES
+
+repeats = 50
+
+
+def keyword_entity_pipeline(keywords):
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    ruler = nlp.add_pipe("entity_ruler", config={"phrase_matcher_attr": "LOWER"})
+    ruler.add_patterns([{"label": "ENTITY", "pattern": k} for k in set(keywords)])
+    nlp.add_pipe("negex", config={"chunk_prefix": ["no"]}, last=True)
+    return nlp
+
+
+try:
+    from utils.nlp import keyword_positive
+except (ImportError, OSError):
+    print(
+        "scispacy model not available, the spacy engine uses the keywords as entities"
+    )
+    nlp = keyword_entity_pipeline(k for _, k, _ in NEGATION_REGRESSION_CASES)
+
+    # Same decision as utils.nlp.keyword_positive with the spacy engine
+    def keyword_positive(sentence, keyword, negation_engine):
+        if negation_engine == "negex":
+            return keyword_positive_negex(sentence, keyword)
+        for e in nlp(sentence).ents:
+            if keyword.lower() in e.text.lower():
+                return not e._.negex
+        return keyword.lower() in sentence.lower()
+
+
+def run_engine(negation_engine):
+    results = []
+    start = time.perf_counter()
+    for _ in range(repeats):
+        results = [
+            keyword_positive(text, keyword, negation_engine)
+            for text, keyword, _ in NEGATION_REGRESSION_CASES
+        ]
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+labels = [expected for _, _, expected in NEGATION_REGRESSION_CASES]
+n_calls = repeats * len(NEGATION_REGRESSION_CASES)
+
+engine_results = {}
+for negation_engine in ["spacy", "negex"]:
+    results, elapsed = run_engine(negation_engine)
+    engine_results[negation_engine] = results
+    accuracy = sum(r == label for r, label in zip(results, labels)) / len(labels)
+    print(
+        "{:<6} | {:>10.0f} calls/s | {:.1%} agreement with labels".format(
+            negation_engine, n_calls / elapsed, accuracy
+        )
+    )
+
+agreement = sum(
+    s == n for s, n in zip(engine_results["spacy"], engine_results["negex"])
+) / len(labels)
+print("Agreement between engines: {:.1%}".format(agreement))
+for (text, keyword, _), s, n in zip(
+    NEGATION_REGRESSION_CASES, engine_results["spacy"], engine_results["negex"]
+):
+    if s != n:
+        print(
+            "Disagreement: {!r} / {!r}: spacy={} negex={}".format(text, keyword, s, n)
+        )
@@ -0,0 +1,51 @@
+# Benchmark the line based radiology report parser against the previous regex parser on the full radiology.csv
+# Set base_mimic to the parent folder of your MIMIC-IV download and run from the repository root with:
+# python -m benchmarks.radiology_benchmark
+import re
+import time
+from os.path import join
+
+import pandas as pd
+
+from dataset.radiology import parse_report, extract_rad_events_batch
+
+base_mimic = ""
+
+
+# Previous implementation with a tempered greedy regex that rechecks the header lookahead at every character
+def parse_report_regex(report):
+    lines = report.strip().split("\n")
+    report_dict = {}
+    if lines[0].isupper() and lines[0].strip()[-1] != ":":
+        lines[0] = lines[0].strip() + ":"
+    for i, line in enumerate(lines):
+        if line.isupper() and ":" not in line:
+            lines[i] = line.strip() + ":"
+    report = "\n".join(lines)
+    pattern = r"(?m)^([A-Z \t,._-]+):((?:(?!^[A-Z \t,._-]+:).)*)"
+    sections = re.findall(pattern, report, re.DOTALL)
+    for section in sections:
+        report_dict[section[0].strip()] = section[1].strip()
+    return report_dict
+
+
+radiology_report_df = pd.read_csv(join(base_mimic, "note", "radiology.csv"))
+texts = radiology_report_df["text"].dropna()
+print("Parsing {} radiology reports".format(len(texts)))
+
+start = time.perf_counter()
+regex_sections = [parse_report_regex(text) for text in texts]
+regex_time = time.perf_counter() - start
+print("Regex parser: {:.1f}s".format(regex_time))
+
+start = time.perf_counter()
+line_sections = [parse_report(text) for text in texts]
+line_time = time.perf_counter() - start
+print("Line parser: {:.1f}s ({:.1f}x)".format(line_time, regex_time / line_time))
+
+mismatches = sum(a != b for a, b in zip(regex_sections, line_sections))
+print("Reports with different sections: {}".format(mismatches))
+
+start = time.perf_counter()
+extract_rad_events_batch(texts)
+print("extract_rad_events_batch: {:.1f}s".format(time.perf_counter() - start))
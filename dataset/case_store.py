@@ -0,0 +1,139 @@
+from collections.abc import Mapping
+import mmap
+import os
+from os.path import join
+import pickle
+import struct
+
+import numpy as np
+
+from dataset.case_view import CaseView, dump_case
+
+###
+# Random access store of hadm_info on disk. Every admission is pickled into its own blob and a fixed-size index sorted
+# by hadm_id maps to the blobs. The file is memory mapped so that reading a case only deserializes that case and
+# processes on the same host share the page cache. In a sectioned store the blobs are written with dump_case and read as
+# CaseViews, so that only the sections of an admission that are accessed are deserialized
+###
+
+MAGIC = b"HADMSTR1"
+SECTIONED_MAGIC = b"HADMSTR2"
+HEADER = struct.Struct("<8sQ")
+INDEX_DTYPE = np.dtype(
+    [
+        ("hadm_id", "<i8"),
+        ("position", "<i8"),
+        ("offset", "<u8"),
+        ("length", "<u8"),
+    ]
+)
+
+
+def write_case_store(hadm_info, filename, base, sectioned=False):
+    """
+    Write hadm_info as a case store. The file is written to a temporary file first and then moved into place, so a
+    failed write keeps the previous store.
+
+    Args:
+        hadm_info (dict): hadm_id (int) to admission dict
+        filename (str): Name of the store without extension
+        base (str): Directory of the store
+        sectioned (bool): Write admissions in sections which are loaded lazily as CaseViews
+    """
+    path = join(base, filename + ".store")
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+
+    index = np.zeros(len(hadm_info), dtype=INDEX_DTYPE)
+    offset = HEADER.size + index.nbytes
+    try:
+        with open(tmp_path, "wb") as f:
+            f.seek(offset)
+            for position, (_id, hadm) in enumerate(hadm_info.items()):
+                # Keys of a dict are unique, but e.g. "1" and 1 would be the same hadm_id in the index
+                if not isinstance(_id, (int, np.integer)) or isinstance(_id, bool):
+                    raise TypeError("hadm_id {!r} is not an integer".format(_id))
+                if sectioned:
+                    blob = dump_case(hadm)
+                else:
+                    blob = pickle.dumps(hadm, protocol=pickle.HIGHEST_PROTOCOL)
+                f.write(blob)
+                index[position] = (_id, position, offset, len(blob))
+                offset += len(blob)
+
+            index.sort(order="hadm_id")
+            f.seek(0)
+            f.write(HEADER.pack(SECTIONED_MAGIC if sectioned else MAGIC, len(index)))
+            f.write(index.tobytes())
+        os.replace(tmp_path, path)
+    finally:
+        # Only left over if writing failed
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class CaseStore(Mapping):
+    """
+    Read-only dict of hadm_id to admission backed by a memory mapped case store. Iterates in the order in which the
+    admissions were written. Admissions of a sectioned store are CaseViews, which can only be used until the store is
+    closed.
+
+    Args:
+        path (str): Path to the .store file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(self.mm, 0)
+        if magic not in (MAGIC, SECTIONED_MAGIC):
+            self.mm.close()
+            raise ValueError("{} is not a case store".format(path))
+        self.sectioned = magic == SECTIONED_MAGIC
+        self.index = np.frombuffer(
+            self.mm, dtype=INDEX_DTYPE, count=count, offset=HEADER.size
+        )
+        self.hadm_ids = self.index["hadm_id"]
+
+    def _find(self, hadm_id):
+        if not isinstance(hadm_id, (int, np.integer)) or isinstance(hadm_id, bool):
+            return None
+        i = np.searchsorted(self.hadm_ids, hadm_id)
+        if i < len(self.hadm_ids) and self.hadm_ids[i] == hadm_id:
+            return self.index[i]
+        return None
+
+    def __getitem__(self, hadm_id):
+        entry = self._find(hadm_id)
+        if entry is None:
+            raise KeyError(hadm_id)
+        offset, length = int(entry["offset"]), int(entry["length"])
+        if self.sectioned:
+            return CaseView(self.mm, offset)
+        return pickle.loads(self.mm[offset : offset + length])
+
+    def __contains__(self, hadm_id):
+        return self._find(hadm_id) is not None
+
+    def __iter__(self):
+        order = np.argsort(self.index["position"])
+        return iter(self.hadm_ids[order].tolist())
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        # The index is a view on the mapping and has to be released first
+        self.index = None
+        self.hadm_ids = None
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_case_store(filename, base):
+    return CaseStore(join(base, filename + ".store"))
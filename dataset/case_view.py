@@ -0,0 +1,83 @@
+from collections.abc import Mapping
+import pickle
+import struct
+
+###
+# Lazy view of a single admission. An admission is serialized as a table of its keys and section lengths followed by
+# one pickle per section, so that a section such as the laboratory tests or the radiology reports is only deserialized
+# when it is accessed
+###
+
+TABLE_HEADER = struct.Struct("<Q")
+
+
+def dump_case(hadm):
+    """
+    Serialize an admission into sections that CaseView can load one by one.
+
+    Args:
+        hadm (dict): Admission dict
+
+    Returns:
+        blob (bytes): Length of the section table, the pickled table of keys and section lengths and the sections
+    """
+    sections = [
+        pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL) for v in hadm.values()
+    ]
+    table = pickle.dumps(
+        (tuple(hadm.keys()), [len(section) for section in sections]),
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    return TABLE_HEADER.pack(len(table)) + table + b"".join(sections)
+
+
+class CaseView(Mapping):
+    """
+    Read-only dict of an admission serialized with dump_case. Only the section table is read on creation, every section
+    is deserialized on first access and cached afterwards. The buffer has to stay open while the view is used.
+
+    Args:
+        buffer (bytes or mmap.mmap): Buffer containing the serialized admission
+        offset (int): Offset of the admission in buffer
+    """
+
+    __slots__ = ("_buffer", "_sections", "_cache")
+
+    def __init__(self, buffer, offset=0):
+        self._buffer = buffer
+        (table_length,) = TABLE_HEADER.unpack_from(buffer, offset)
+        start = offset + TABLE_HEADER.size
+        keys, lengths = pickle.loads(buffer[start : start + table_length])
+        start += table_length
+        self._sections = {}
+        for key, length in zip(keys, lengths):
+            self._sections[key] = (start, start + length)
+            start += length
+        self._cache = {}
+
+    def __getitem__(self, key):
+        if key in self._cache:
+            return self._cache[key]
+        start, end = self._sections[key]
+        value = pickle.loads(self._buffer[start:end])
+        self._cache[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self._sections
+
+    def __iter__(self):
+        return iter(self._sections)
+
+    def __len__(self):
+        return len(self._sections)
+
+    def __repr__(self):
+        return "CaseView({!r})".format(list(self._sections))
+
+    def loaded(self):
+        # Keys of the sections that have been deserialized
+        return list(self._cache)
+
+    def to_dict(self):
+        return {key: self[key] for key in self._sections}
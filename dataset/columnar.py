@@ -0,0 +1,417 @@
+import os
+from os.path import join
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+###
+# Columnar export of hadm_info. A cohort is written as a directory of Parquet tables keyed by hadm_id, so that single
+# admissions or fields can be read without deserializing the whole cohort
+###
+
+LAB_KEYS = ["Laboratory Tests", "Reference Range Lower", "Reference Range Upper"]
+MICROBIOLOGY_KEYS = ["Microbiology", "Microbiology Spec"]
+RADIOLOGY_KEYS = ["Radiology"]
+PROCEDURE_KEYS = [
+    "Procedures Discharge",
+    "Procedures ICD9",
+    "Procedures ICD9 Title",
+    "Procedures ICD10",
+    "Procedures ICD10 Title",
+]
+
+
+def table_of_key(key):
+    if key in LAB_KEYS:
+        return "labs"
+    if key in MICROBIOLOGY_KEYS:
+        return "microbiology"
+    if key in RADIOLOGY_KEYS:
+        return "radiology"
+    if key in PROCEDURE_KEYS:
+        return "procedures"
+    return "cases"
+
+
+# Scalars of the lab and microbiology maps are stored as text with their type, so that numbers and NaN come back
+# unchanged. repr of a float parses back to the same float
+SCALAR_TYPES = {"str": str, "int": int, "float": float}
+
+
+def encode_scalar(value):
+    if value is None:
+        return None, None
+    if isinstance(value, str):
+        return value, "str"
+    # bool is an int but would not parse back from its text. numpy scalars are converted by their dtype
+    kind = getattr(value, "dtype", None)
+    kind = kind.kind if kind is not None else None
+    if (isinstance(value, int) and not isinstance(value, bool)) or kind in ("i", "u"):
+        return str(int(value)), "int"
+    if isinstance(value, float) or kind == "f":
+        return repr(float(value)), "float"
+    raise TypeError("Can not store value {!r} of type {}".format(value, type(value)))
+
+
+def decode_scalar(text, kind):
+    if kind is None:
+        return None
+    return SCALAR_TYPES[kind](text)
+
+
+def nan_to_null(value):
+    # NaN becomes null in Arrow, also inside lists
+    if isinstance(value, float) and value != value:
+        return None
+    if isinstance(value, list):
+        return [nan_to_null(v) for v in value]
+    return value
+
+
+def null_to_nan(value):
+    if value is None:
+        return float("nan")
+    if isinstance(value, list):
+        return [null_to_nan(v) for v in value]
+    return value
+
+
+def hadm_info_to_tables(hadm_info):
+    """
+    Split hadm_info into one table per data source. Fields without a dedicated table are columns of the cases table,
+    which also stores the keys of every admission in their original order. Missing values (NaN) of the case columns and
+    procedure titles, also inside lists, are stored as null and read back as NaN.
+
+    Args:
+        hadm_info (dict): hadm_id to admission dict
+
+    Returns:
+        tables (dict): Table name to pa.Table
+    """
+    case_columns = {}
+    for hadm in hadm_info.values():
+        for key in hadm:
+            if table_of_key(key) == "cases":
+                case_columns.setdefault(key, None)
+
+    cases = {"hadm_id": [], "keys": []}
+    cases.update({key: [] for key in case_columns})
+    labs = {
+        "hadm_id": [],
+        "itemid": [],
+        "value": [],
+        "value_type": [],
+        "ref_range_lower": [],
+        "ref_range_upper": [],
+    }
+    microbiology = {
+        "hadm_id": [],
+        "test_itemid": [],
+        "value": [],
+        "value_type": [],
+        "spec_itemid": [],
+        "spec_itemid_type": [],
+    }
+    # Fields of every report in their order and the fields that are NaN, so that reports round trip exactly
+    radiology = {"hadm_id": [], "_fields": [], "_nan_fields": []}
+    procedures = {
+        "hadm_id": [],
+        "source": [],
+        "code": [],
+        "code_type": [],
+        "has_code": [],
+        "title": [],
+        "has_title": [],
+    }
+
+    for _id, hadm in hadm_info.items():
+        cases["hadm_id"].append(_id)
+        cases["keys"].append(list(hadm.keys()))
+        for key in case_columns:
+            cases[key].append(nan_to_null(hadm.get(key)))
+
+        # Reference ranges are keyed like the laboratory tests
+        lab_tests = hadm.get("Laboratory Tests", {})
+        lower = hadm.get("Reference Range Lower", {})
+        upper = hadm.get("Reference Range Upper", {})
+        for itemid, value in lab_tests.items():
+            labs["hadm_id"].append(_id)
+            labs["itemid"].append(itemid)
+            value, value_type = encode_scalar(value)
+            labs["value"].append(value)
+            labs["value_type"].append(value_type)
+            # null if the lab test has no reference range, NaN is kept as NaN
+            labs["ref_range_lower"].append(lower.get(itemid))
+            labs["ref_range_upper"].append(upper.get(itemid))
+
+        microbio = hadm.get("Microbiology", {})
+        microbio_spec = hadm.get("Microbiology Spec", {})
+        for itemid, value in microbio.items():
+            microbiology["hadm_id"].append(_id)
+            microbiology["test_itemid"].append(itemid)
+            value, value_type = encode_scalar(value)
+            microbiology["value"].append(value)
+            microbiology["value_type"].append(value_type)
+            spec_itemid, spec_itemid_type = encode_scalar(microbio_spec.get(itemid))
+            microbiology["spec_itemid"].append(spec_itemid)
+            microbiology["spec_itemid_type"].append(spec_itemid_type)
+
+        for rad in hadm.get("Radiology", []):
+            radiology["hadm_id"].append(_id)
+            radiology["_fields"].append(list(rad.keys()))
+            radiology["_nan_fields"].append(
+                [
+                    field
+                    for field, value in rad.items()
+                    if isinstance(value, float) and value != value
+                ]
+            )
+            for field, value in rad.items():
+                column = radiology.setdefault(
+                    field, [None] * (len(radiology["hadm_id"]) - 1)
+                )
+                column.append(nan_to_null(value))
+            for column in radiology.values():
+                if len(column) < len(radiology["hadm_id"]):
+                    column.append(None)
+
+        for source, code_key, title_key in [
+            ("Discharge", None, "Procedures Discharge"),
+            ("ICD9", "Procedures ICD9", "Procedures ICD9 Title"),
+            ("ICD10", "Procedures ICD10", "Procedures ICD10 Title"),
+        ]:
+            # Codes and titles are stored side by side, missing ones are null and marked as such
+            codes = hadm.get(code_key, [])
+            titles = hadm.get(title_key, [])
+            for i in range(max(len(codes), len(titles))):
+                code, code_type = (
+                    encode_scalar(codes[i]) if i < len(codes) else (None, None)
+                )
+                procedures["hadm_id"].append(_id)
+                procedures["source"].append(source)
+                procedures["code"].append(code)
+                procedures["code_type"].append(code_type)
+                procedures["has_code"].append(i < len(codes))
+                procedures["title"].append(
+                    nan_to_null(titles[i]) if i < len(titles) else None
+                )
+                procedures["has_title"].append(i < len(titles))
+
+    return {
+        "cases": pa.table(
+            {
+                "hadm_id": pa.array(cases.pop("hadm_id"), pa.int64()),
+                "keys": pa.array(cases.pop("keys"), pa.list_(pa.string())),
+                **cases,
+            }
+        ),
+        "labs": pa.table(
+            labs,
+            schema=pa.schema(
+                [
+                    ("hadm_id", pa.int64()),
+                    ("itemid", pa.int64()),
+                    ("value", pa.string()),
+                    ("value_type", pa.string()),
+                    ("ref_range_lower", pa.float64()),
+                    ("ref_range_upper", pa.float64()),
+                ]
+            ),
+        ),
+        "microbiology": pa.table(
+            microbiology,
+            schema=pa.schema(
+                [
+                    ("hadm_id", pa.int64()),
+                    ("test_itemid", pa.int64()),
+                    ("value", pa.string()),
+                    ("value_type", pa.string()),
+                    ("spec_itemid", pa.string()),
+                    ("spec_itemid_type", pa.string()),
+                ]
+            ),
+        ),
+        "radiology": pa.table(
+            {
+                "hadm_id": pa.array(radiology.pop("hadm_id"), pa.int64()),
+                "_fields": pa.array(radiology.pop("_fields"), pa.list_(pa.string())),
+                "_nan_fields": pa.array(
+                    radiology.pop("_nan_fields"), pa.list_(pa.string())
+                ),
+                **{
+                    field: pa.array(values, pa.string())
+                    for field, values in radiology.items()
+                },
+            }
+        ),
+        "procedures": pa.table(
+            procedures,
+            schema=pa.schema(
+                [
+                    ("hadm_id", pa.int64()),
+                    ("source", pa.string()),
+                    ("code", pa.string()),
+                    ("code_type", pa.string()),
+                    ("has_code", pa.bool_()),
+                    ("title", pa.string()),
+                    ("has_title", pa.bool_()),
+                ]
+            ),
+        ),
+    }
+
+
+def write_hadm_to_parquet(hadm_info, filename, base):
+    """
+    Write hadm_info as a directory of Parquet tables (cases, labs, microbiology, radiology and procedures).
+
+    Args:
+        hadm_info (dict): hadm_id to admission dict
+        filename (str): Name of the directory
+        base (str): Parent directory
+    """
+    path = join(base, filename)
+    os.makedirs(path, exist_ok=True)
+    for name, table in hadm_info_to_tables(hadm_info).items():
+        pq.write_table(table, join(path, name + ".parquet"), compression="zstd")
+
+
+def read_table(path, name, hadm_ids=None, columns=None):
+    filters = None
+    if hadm_ids is not None:
+        filters = [("hadm_id", "in", list(hadm_ids))]
+    if columns is not None:
+        columns = ["hadm_id"] + [
+            c
+            for c in pq.read_schema(join(path, name + ".parquet")).names
+            if c in columns and c != "hadm_id"
+        ]
+    return pq.read_table(
+        join(path, name + ".parquet"), columns=columns, filters=filters
+    ).to_pydict()
+
+
+def load_hadm_from_parquet(filename, base, hadm_ids=None, columns=None):
+    """
+    Load hadm_info written by write_hadm_to_parquet. Only the tables and admissions that are requested are read.
+
+    Args:
+        filename (str): Name of the directory
+        base (str): Parent directory
+        hadm_ids (list): hadm_ids to load. All if None
+        columns (list): hadm_info keys to load, e.g. ["Patient History", "Laboratory Tests"]. All if None
+
+    Returns:
+        hadm_info (dict): hadm_id to admission dict
+    """
+    path = join(base, filename)
+
+    case_columns = None
+    if columns is not None:
+        case_columns = ["keys"] + [c for c in columns if table_of_key(c) == "cases"]
+    cases = read_table(path, "cases", hadm_ids, case_columns)
+
+    hadm_info = {}
+    sections = {}
+    for i, _id in enumerate(cases["hadm_id"]):
+        keys = cases["keys"][i]
+        if columns is not None:
+            keys = [key for key in keys if key in columns]
+        hadm_info[_id] = {key: None for key in keys}
+        for key in keys:
+            if table_of_key(key) == "cases":
+                hadm_info[_id][key] = null_to_nan(cases[key][i])
+            else:
+                sections.setdefault(table_of_key(key), True)
+
+    def present(_id, key):
+        return _id in hadm_info and key in hadm_info[_id]
+
+    if "labs" in sections:
+        for key in LAB_KEYS:
+            for _id in hadm_info:
+                if present(_id, key):
+                    hadm_info[_id][key] = {}
+        labs = read_table(path, "labs", hadm_ids)
+        for _id, itemid, value, value_type, lower, upper in zip(
+            labs["hadm_id"],
+            labs["itemid"],
+            labs["value"],
+            labs["value_type"],
+            labs["ref_range_lower"],
+            labs["ref_range_upper"],
+        ):
+            if present(_id, "Laboratory Tests"):
+                hadm_info[_id]["Laboratory Tests"][itemid] = decode_scalar(
+                    value, value_type
+                )
+            if present(_id, "Reference Range Lower") and lower is not None:
+                hadm_info[_id]["Reference Range Lower"][itemid] = lower
+            if present(_id, "Reference Range Upper") and upper is not None:
+                hadm_info[_id]["Reference Range Upper"][itemid] = upper
+
+    if "microbiology" in sections:
+        for key in MICROBIOLOGY_KEYS:
+            for _id in hadm_info:
+                if present(_id, key):
+                    hadm_info[_id][key] = {}
+        microbiology = read_table(path, "microbiology", hadm_ids)
+        for _id, itemid, value, value_type, spec_itemid, spec_itemid_type in zip(
+            microbiology["hadm_id"],
+            microbiology["test_itemid"],
+            microbiology["value"],
+            microbiology["value_type"],
+            microbiology["spec_itemid"],
+            microbiology["spec_itemid_type"],
+        ):
+            if present(_id, "Microbiology"):
+                hadm_info[_id]["Microbiology"][itemid] = decode_scalar(
+                    value, value_type
+                )
+            if present(_id, "Microbiology Spec"):
+                hadm_info[_id]["Microbiology Spec"][itemid] = decode_scalar(
+                    spec_itemid, spec_itemid_type
+                )
+
+    if "radiology" in sections:
+        for _id in hadm_info:
+            if present(_id, "Radiology"):
+                hadm_info[_id]["Radiology"] = []
+        radiology = read_table(path, "radiology", hadm_ids)
+        for i, _id in enumerate(radiology["hadm_id"]):
+            if present(_id, "Radiology"):
+                nan_fields = radiology["_nan_fields"][i]
+                hadm_info[_id]["Radiology"].append(
+                    {
+                        field: (
+                            float("nan") if field in nan_fields else radiology[field][i]
+                        )
+                        for field in radiology["_fields"][i]
+                    }
+                )
+
+    if "procedures" in sections:
+        for key in PROCEDURE_KEYS:
+            for _id in hadm_info:
+                if present(_id, key):
+                    hadm_info[_id][key] = []
+        procedures = read_table(path, "procedures", hadm_ids)
+        for _id, source, code, code_type, has_code, title, has_title in zip(
+            procedures["hadm_id"],
+            procedures["source"],
+            procedures["code"],
+            procedures["code_type"],
+            procedures["has_code"],
+            procedures["title"],
+            procedures["has_title"],
+        ):
+            code_key, title_key = None, "Procedures Discharge"
+            if source != "Discharge":
+                code_key = "Procedures {}".format(source)
+                title_key = "Procedures {} Title".format(source)
+            if has_code and present(_id, code_key):
+                hadm_info[_id][code_key].append(decode_scalar(code, code_type))
+            if has_title and present(_id, title_key):
+                hadm_info[_id][title_key].append(null_to_nan(title))
+
+    return hadm_info
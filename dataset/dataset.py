@@ -1,3 +1,4 @@
+import sys
 import warnings
 from os.path import join
 import re
@@ -10,38 +11,44 @@ import pandas as pd
 from dataset.discharge import (
     extract_history,
     extract_physical_examination,
-    extract_diagnosis_from_discharge,
+    extract_diagnoses_from_discharge,
     extract_chief_complaints,
 )
 from dataset.radiology import (
-    extract_rad_events,
+    extract_rad_events_batch,
+    radiology_detail_maps,
+    load_radiology_detail_maps,
+    resolve_exam_names,
+    classify_exam_names,
     sanitize_rad,
 )
 from dataset.labs import parse_lab_events, parse_microbio
 from dataset.procedures import extract_procedures
-from dataset.diagnosis import extract_diagnosis_from_diag_df
-from dataset.utils import write_hadm_to_file, print_value_counts
-from tools.utils import count_radiology_modality_and_organ_matches
+from dataset.diagnosis import extract_diagnosis_from_diag_df, ICDTitleIndex
+from dataset.utils import (
+    write_hadm_to_file,
+    print_value_counts,
+    HadmJSONLWriter,
+    JSONL_EXTENSIONS,
+)
+from dataset.text_store import externalize_texts
+from dataset import diagnosis, discharge, labs, procedures, radiology
+import tools.utils
 
 
 warnings.filterwarnings("default", category=UserWarning)
 
 
-def extract_hadm_ids(pathology, diag_icd, discharge_df, diag_counts=20, cc=10):
-    # Grab all hadm_ids with appendicitis
-    hadm_ids = (
-        diag_icd[diag_icd["long_title"].str.contains(pathology, case=False)][
-            ["hadm_id"]
-        ]
-        .drop_duplicates()["hadm_id"]
-        .values
-    )
+def extract_hadm_ids(
+    pathology, diag_icd, discharge_df, diag_counts=20, cc=10, icd_index=None
+):
+    # Grab all hadm_ids with appendicitis and the counts of the matching diagnoses. Pass a shared icd_index to select multiple pathologies without rescanning diag_icd
+    if icd_index is None:
+        icd_index = ICDTitleIndex(diag_icd)
+    hadm_ids, v_counts = icd_index.lookup(pathology)
     print("There are {} hadm_ids with {}".format(len(hadm_ids), pathology))
 
     # Get appendicitis diagnoses counts
-    v_counts = diag_icd[diag_icd["long_title"].str.contains(pathology, case=False)][
-        "long_title"
-    ].value_counts()
     print_value_counts(v_counts, diag_counts)
     print("---")
 
@@ -75,21 +82,15 @@ def extract_hadm_ids_filter_cc(
     chief_complaint="abdominal pain",
     diag_counts=20,
     cc=10,
+    icd_index=None,
 ):
-    # Grab all hadm_ids with patho
-    hadm_ids = (
-        diag_icd[diag_icd["long_title"].str.contains(pathology, case=False)][
-            ["hadm_id"]
-        ]
-        .drop_duplicates()["hadm_id"]
-        .values
-    )
+    # Grab all hadm_ids with patho and the counts of the matching diagnoses
+    if icd_index is None:
+        icd_index = ICDTitleIndex(diag_icd)
+    hadm_ids, v_counts = icd_index.lookup(pathology)
     print("There are {} hadm_ids with {}".format(len(hadm_ids), pathology))
 
     # Get appendicitis diagnoses counts
-    v_counts = diag_icd[diag_icd["long_title"].str.contains(pathology, case=False)][
-        "long_title"
-    ].value_counts()
     print_value_counts(v_counts, diag_counts)
     print("---")
 
@@ -123,27 +124,31 @@ def extract_info(
     lab_events_df,
     microbiology_df,
     radiology_report_df,
-    radiology_report_details_df,
+    radiology_report_details,
     diag_df,
     procedures_df,
+    text_store=None,
+    provenance=None,
+    jsonl=False,
+    jsonl_compression=None,
 ):
-    # Extract the discharge, history, pe, le and radiology report for hadm_ids
-    hadm_info = extract_hadm_info(
-        hadm_ids,
-        discharge_df,
-        admissions_df,
-        transfers_df,
-        lab_events_df,
-        microbiology_df,
-        radiology_report_df,
-        radiology_report_details_df,
-    )
-    print("--")
-
-    hadm_info_clean = None
-    try:
-        # Fill extracted reports into app_hadm_info
+    # Extract the discharge, history, pe, le and radiology report for hadm_ids. If a TextStoreWriter is passed as
+    # text_store, the written files reference the discharge and radiology texts in the store instead of containing them.
+    # If a dataset.provenance.Provenance is passed, every stage only recomputes the admissions whose inputs changed.
+    # With jsonl, the finished cohort is additionally written to JSONL files (compression None, "gzip" or "zstd")
+    def extract_stage(ids):
+        return extract_hadm_info(
+            list(ids),
+            discharge_df,
+            admissions_df,
+            transfers_df,
+            lab_events_df,
+            microbiology_df,
+            radiology_report_df,
+            radiology_report_details,
+        )
 
+    def sanitize_stage(hadm_info):
         # Remove rad reports where no rad_modality was found
         hadm_info = sanitize_rad(hadm_info)
         print("--")
@@ -151,23 +156,55 @@ def extract_info(
         # Remove mentions of target
         hadm_info = sanitize_hadm_texts(hadm_info, sanitize_list)
         print("--")
+        return hadm_info
+
+    def diagnosis_stage(hadm_info):
+        return extract_diagnoses_and_procedures(hadm_info, diag_df, procedures_df)
+
+    def run_stage(stage, function, inputs, code, params=None):
+        if provenance is None:
+            return function(inputs)
+        return provenance.run_stage(
+            "{}_{}".format("_".join(pathology.split()), stage),
+            function,
+            inputs,
+            code,
+            params,
+        )
+
+    # The code of a stage is hashed by module, so that helpers such as fill_nan_hadm or the modality keywords of
+    # tools.utils can not be missed. This module also contains load_data, the loaded DataFrames are not hashed. They
+    # depend on the source files, which are part of the parameters, and on the code of load_data
+    this_module = sys.modules[__name__]
+
+    # The raw admissions only depend on the source files and the code that loads them
+    hadm_info = run_stage(
+        "extract",
+        extract_stage,
+        dict.fromkeys(hadm_ids),
+        [this_module, discharge, labs, radiology, tools.utils],
+        provenance.sources_hash() if provenance is not None else None,
+    )
+    print("--")
 
-        # Extract diagnoses
-        for _id in hadm_info:
-            try:
-                hadm_info[_id][
-                    "Discharge Diagnosis"
-                ] = extract_diagnosis_from_discharge(hadm_info[_id]["Discharge"])
-            except Exception as e:
-                print("ID: {}, Error: {}".format(_id, e))
-                hadm_info[_id]["Discharge Diagnosis"] = ""
-        hadm_info = extract_diagnosis_from_diag_df(hadm_info, diag_df)
-
-        # Extract procedures
-        procedures_df_icd9 = procedures_df[procedures_df["icd_version"] == 9]
-        procedures_df_icd10 = procedures_df[procedures_df["icd_version"] == 10]
-        hadm_info = extract_procedures(
-            hadm_info, procedures_df_icd9, procedures_df_icd10
+    hadm_info_clean = None
+    try:
+        # Fill extracted reports into app_hadm_info
+        hadm_info = run_stage(
+            "sanitize",
+            sanitize_stage,
+            hadm_info,
+            [this_module, radiology, tools.utils],
+            sanitize_list,
+        )
+
+        # Extract diagnoses and procedures. diag_df and procedures_df are read from the source files
+        hadm_info = run_stage(
+            "diagnosis",
+            diagnosis_stage,
+            hadm_info,
+            [this_module, discharge, diagnosis, procedures],
+            provenance.sources_hash() if provenance is not None else None,
         )
 
         # Examine data completeness
@@ -175,14 +212,22 @@ def extract_info(
         print("--")
 
         # Write human readable and pickle files
+        hadm_info_file, hadm_info_clean_file = hadm_info, hadm_info_clean
+        if text_store is not None:
+            hadm_info_file = externalize_texts(hadm_info, text_store)
+            hadm_info_clean_file = {_id: hadm_info_file[_id] for _id in hadm_info_clean}
         write_hadm_to_file(
-            hadm_info, "{}_hadm_info".format("_".join(pathology.split())), "./"
+            hadm_info_file, "{}_hadm_info".format("_".join(pathology.split())), "./"
         )
         write_hadm_to_file(
-            hadm_info_clean,
+            hadm_info_clean_file,
             "{}_hadm_info_clean".format("_".join(pathology.split())),
             "./",
         )
+        if jsonl:
+            write_hadm_info_jsonl(
+                hadm_info_file, hadm_info_clean_file, pathology, jsonl_compression
+            )
         print("Finished writing files")
 
     except Exception as e:
@@ -194,6 +239,43 @@ def extract_info(
     return hadm_info, hadm_info_clean
 
 
+def write_hadm_info_jsonl(hadm_info, hadm_info_clean, pathology, compression=None):
+    # Write both files line by line in a single pass over the finished cohort, an admission is written to the clean
+    # file if it is part of hadm_info_clean. Lines are encoded one at a time, never the whole cohort at once
+    name = "_".join(pathology.split())
+    extension = JSONL_EXTENSIONS[compression]
+    with HadmJSONLWriter(
+        join("./", "{}_hadm_info{}".format(name, extension)), compression
+    ) as writer, HadmJSONLWriter(
+        join("./", "{}_hadm_info_clean{}".format(name, extension)), compression
+    ) as clean_writer:
+        for _id, hadm in hadm_info.items():
+            writer.write(_id, hadm)
+            if _id in hadm_info_clean:
+                clean_writer.write(_id, hadm)
+
+
+def extract_diagnoses_and_procedures(hadm_info, diag_df, procedures_df):
+    # Extract diagnoses
+    discharge_diagnoses, failures = extract_diagnoses_from_discharge(
+        pd.Series({_id: hadm_info[_id]["Discharge"] for _id in hadm_info})
+    )
+    for _id, discharge_diagnosis in discharge_diagnoses.items():
+        hadm_info[_id]["Discharge Diagnosis"] = discharge_diagnosis
+    if len(failures):
+        print(
+            "Could not extract discharge diagnosis of {} of {} hadm_ids".format(
+                len(failures), len(hadm_info)
+            )
+        )
+        print(failures["error"].value_counts().to_string())
+    hadm_info = extract_diagnosis_from_diag_df(hadm_info, diag_df)
+
+    # Extract procedures
+    hadm_info = extract_procedures(hadm_info, procedures_df)
+    return hadm_info
+
+
 def create_valuestr_lab(row):
     valuenum = row["valuenum"]
     value = row["value"]
@@ -232,6 +314,23 @@ def create_valuestr_microbio(row):
         return comment
 
 
+# Files of MIMIC-IV read by load_data, relative to base_mimic
+SOURCE_FILES = [
+    join("hosp", "admissions.csv"),
+    join("hosp", "transfers.csv"),
+    join("hosp", "diagnoses_icd.csv"),
+    join("hosp", "d_icd_diagnoses.csv"),
+    join("hosp", "procedures_icd.csv"),
+    join("hosp", "d_icd_procedures.csv"),
+    join("note", "discharge.csv"),
+    join("note", "radiology.csv"),
+    join("note", "radiology_detail.csv"),
+    join("hosp", "microbiologyevents.csv"),
+    join("hosp", "labevents.csv"),
+    join("hosp", "d_labitems.csv"),
+]
+
+
 def load_data(base_mimic: str):
     base_hosp = join(base_mimic, "hosp")
     base_notes = join(base_mimic, "note")
@@ -287,8 +386,10 @@ def load_data(base_mimic: str):
     # Load radiology reports
     radiology_report_df = pd.read_csv(join(base_notes, "radiology.csv"))
 
-    # Load radiology report details
-    radiology_report_details_df = pd.read_csv(join(base_notes, "radiology_detail.csv"))
+    # Load exam names and parent notes from the radiology report details. Only these fields are kept while reading
+    radiology_report_details = load_radiology_detail_maps(
+        join(base_notes, "radiology_detail.csv")
+    )
 
     # Load microbiology events
     microbiology_df = pd.read_csv(join(base_hosp, "microbiologyevents.csv"))
@@ -332,7 +433,7 @@ def load_data(base_mimic: str):
         procedures_df,
         discharge_df,
         radiology_report_df,
-        radiology_report_details_df,
+        radiology_report_details,
         lab_events_df,
         microbiology_df,
     )
@@ -395,7 +496,7 @@ def extract_hadm_info(
     lab_events_df,
     microbiology_df,
     radiology_report_df,
-    radiology_report_details_df,
+    radiology_report_details,
 ):
     skipped = 0
     lab_events_df["charttime"] = pd.to_datetime(lab_events_df["charttime"])
@@ -405,33 +506,13 @@ def extract_hadm_info(
     admissions_df["dischtime"] = pd.to_datetime(admissions_df["dischtime"])
     radiology_report_df["charttime"] = pd.to_datetime(radiology_report_df["charttime"])
 
-    # Create a DataFrame to hold only relevant fields with field_ordinal == 1
-    filtered_radiology_report_details_df = radiology_report_details_df[
-        (
-            radiology_report_details_df["field_name"].isin(
-                ["exam_name", "parent_note_id"]
-            )
+    # Dictionaries to map note_id to exam_name and parent_note_id. Either loaded directly or created from the full details table
+    if isinstance(radiology_report_details, pd.DataFrame):
+        exam_name_map, parent_note_map = radiology_detail_maps(
+            radiology_report_details
         )
-        & (radiology_report_details_df["field_ordinal"] == 1)
-    ]
-
-    # Create a dictionary to map note_id to parent_note_id
-    parent_note_map = (
-        filtered_radiology_report_details_df[
-            filtered_radiology_report_details_df["field_name"] == "parent_note_id"
-        ]
-        .set_index("note_id")["field_value"]
-        .to_dict()
-    )
-
-    # Create a dictionary to map note_id to exam_name
-    exam_name_map = (
-        filtered_radiology_report_details_df[
-            filtered_radiology_report_details_df["field_name"] == "exam_name"
-        ]
-        .set_index("note_id")["field_value"]
-        .to_dict()
-    )
+    else:
+        exam_name_map, parent_note_map = radiology_report_details
 
     # Create a mask to filter out relevant rows upfront
     mask_discharge = discharge_df["hadm_id"].isin(disease_ids)
@@ -506,6 +587,39 @@ def extract_hadm_info(
         hadm_to_subject_id,
     )
 
+    # Process the radiology reports of the whole cohort at once. Clean reports, resolve exam names and classify modality and region
+    radiology_report_df_sf = radiology_report_df_sf[
+        radiology_report_df_sf["hadm_id"].isin(disease_ids)
+    ].copy()
+    radiology_report_df_sf["text_clean"] = extract_rad_events_batch(
+        radiology_report_df_sf["text"]
+    )
+    radiology_report_df_sf["exam_name"] = resolve_exam_names(
+        radiology_report_df_sf["note_id"], exam_name_map, parent_note_map
+    )
+    rad_classification = classify_exam_names(radiology_report_df_sf["exam_name"])
+    radiology_report_df_sf["modality"] = rad_classification["Modality"]
+    radiology_report_df_sf["region"] = rad_classification["Region"]
+
+    rad_data_by_hadm = {}
+    for _id, rad_df in radiology_report_df_sf.groupby("hadm_id", sort=False):
+        rad_data_by_hadm[_id] = [
+            {
+                "Report": report,
+                "Modality": modality,
+                "Region": region,
+                "Exam Name": exam_name,
+                "Note ID": note_id,
+            }
+            for report, modality, region, exam_name, note_id in zip(
+                rad_df["text_clean"].tolist(),
+                rad_df["modality"].tolist(),
+                rad_df["region"].tolist(),
+                rad_df["exam_name"].tolist(),
+                rad_df["note_id"].tolist(),
+            )
+        ]
+
     hadm_info = {}
 
     for _id in disease_ids:
@@ -528,62 +642,7 @@ def extract_hadm_info(
 
             microbio, microbio_spec = parse_microbio(microbiology_df_sf, _id)
 
-            rad = extract_rad_events(
-                radiology_report_df_sf[radiology_report_df_sf["hadm_id"] == _id][
-                    "text"
-                ].values
-            )
-
-            note_ids = radiology_report_df_sf[radiology_report_df_sf["hadm_id"] == _id][
-                "note_id"
-            ].values
-
-            note_names = []
-            for note_id in note_ids:
-                name = exam_name_map.get(note_id, None)
-                if name is None:
-                    parent_note_id = parent_note_map.get(note_id, None)
-                    if parent_note_id:
-                        name = exam_name_map.get(parent_note_id, "Unknown")
-                    else:
-                        warnings.warn(
-                            "Note ID {} has no exam name and no parent_note_id".format(
-                                note_id
-                            )
-                        )
-                        name = ""
-                note_names.append(name)
-
-            rad_regions = []
-            rad_modalities = []
-            for exam_name in note_names:
-                # Count matches of each modality and region and get most frequent plus counts
-                (
-                    frequent_modality,
-                    frequent_modality_count,
-                    frequent_region,
-                    frequent_region_count,
-                ) = count_radiology_modality_and_organ_matches(exam_name)
-
-                if frequent_modality_count == 0:
-                    frequent_modality = None
-                if frequent_region_count == 0:
-                    frequent_region = None
-
-                rad_modalities.append(frequent_modality)
-                rad_regions.append(frequent_region)
-
-            rad_data = []
-            for i in range(len(rad)):
-                rad_data.append(
-                    {
-                        "Report": rad[i],
-                        "Modality": rad_modalities[i],
-                        "Region": rad_regions[i],
-                        "Exam Name": note_names[i],
-                        "Note ID": note_ids[i],
-                    }
-                )
+            rad_data = rad_data_by_hadm.get(_id, [])
 
             hadm_info[_id] = {
                 "Discharge": discharge_text,
@@ -1,5 +1,82 @@
+import numpy as np
+import pandas as pd
+
+
+class ICDTitleIndex:
+    """
+    Index to select hadm_ids by ICD diagnosis title. Matching runs over the distinct ICD titles instead of every row of the
+    diagnosis table and the matched codes are joined back to the hadm_ids, once for all requested pathologies.
+
+    Args:
+        diag_icd (pd.DataFrame): Diagnoses with hadm_id, icd_code, icd_version and long_title
+    """
+
+    def __init__(self, diag_icd):
+        self.diag_icd = diag_icd[["hadm_id", "icd_code", "icd_version", "long_title"]]
+        self.titles = self.diag_icd[
+            ["icd_code", "icd_version", "long_title"]
+        ].drop_duplicates()
+        self.matches = {}
+
+    def match(self, pathologies):
+        """
+        Match pathologies (case insensitive regex as in str.contains) against the ICD titles in a single pass.
+
+        Args:
+            pathologies (list): Pathology terms to look up. Terms that were already matched are not matched again
+        """
+        pathologies = [p for p in dict.fromkeys(pathologies) if p not in self.matches]
+        if not pathologies:
+            return
+
+        matched_codes = []
+        for pathology in pathologies:
+            mask = self.titles["long_title"].str.contains(
+                pathology, case=False, na=False
+            )
+            matched_codes.append(
+                self.titles.loc[mask, ["icd_code", "icd_version"]].assign(
+                    pathology=pathology
+                )
+            )
+        matched_codes = pd.concat(matched_codes)
+
+        # Join back to the diagnosis rows and restore their order so hadm_ids come out in order of first appearance
+        rows = (
+            self.diag_icd.assign(row=np.arange(len(self.diag_icd)))
+            .merge(matched_codes, on=["icd_code", "icd_version"], how="inner")
+            .sort_values("row", kind="stable")
+        )
+        rows_by_pathology = dict(list(rows.groupby("pathology", sort=False)))
+
+        for pathology in pathologies:
+            pathology_rows = rows_by_pathology.get(pathology, rows.iloc[:0])
+            hadm_ids = pathology_rows["hadm_id"].drop_duplicates().values
+            self.matches[pathology] = (
+                hadm_ids,
+                pathology_rows["long_title"].value_counts(),
+            )
+
+    def lookup(self, pathology):
+        """
+        Get the hadm_ids and ICD title counts of a pathology.
+
+        Args:
+            pathology (str): Pathology term
+
+        Returns:
+            hadm_ids (np.ndarray): hadm_ids with an ICD title matching pathology in order of first appearance
+            v_counts (pd.Series): Counts of matching ICD titles
+        """
+        self.match([pathology])
+        return self.matches[pathology]
+
+
 def extract_diagnosis_from_diag_df(hadm_info, diag_df):
+    # Semi-join the diagnoses to the cohort and collect the titles of all admissions with one groupby. Row order within an admission is kept
+    cohort_diag_df = diag_df[diag_df["hadm_id"].isin(list(hadm_info.keys()))]
+    diagnoses = cohort_diag_df.groupby("hadm_id", sort=False)["long_title"].agg(list)
+    diagnoses = diagnoses.to_dict()
     for _id in hadm_info:
-        diagnoses = diag_df[diag_df["hadm_id"] == _id]["long_title"].values
-        hadm_info[_id]["ICD Diagnosis"] = diagnoses.tolist()
+        hadm_info[_id]["ICD Diagnosis"] = diagnoses.get(_id, [])
     return hadm_info
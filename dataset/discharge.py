@@ -1,11 +1,16 @@
 import re
 
-from dataset.utils import regex_extracter, last_substring_index
+import pandas as pd
+
+CHIEF_COMPLAINT_REGEX = re.compile(
+    "(?:chief|___) complaint:(.*)major (?:surgical|___)",
+    re.IGNORECASE | re.DOTALL,
+)
 
 
 def extract_chief_complaints(hadm_ids, discharge_df):
     """
-    Loops over patients and extracts chief complaints from discharge summaries. Extracts from chief complaint field to major surgical field.
+    Extracts chief complaints from discharge summaries. Extracts from chief complaint field to major surgical field. The discharge notes are joined to the hadm_ids once and the regex is applied to all notes at once.
 
     Args:
         hadm_ids (list): List of hadm_ids of patients to extract chief complaints from
@@ -16,28 +21,117 @@ def extract_chief_complaints(hadm_ids, discharge_df):
         cc_ids (list): List of hadm_ids with valid chief complaints
         discharge_cntr (int): Number of valid discharge summaries that were looped over (i.e. without empty discharge that were skipped)
     """
-    ccs = []
-    discharge_cntr = 0
-    cc_ids = []
-    for _id in hadm_ids:
-        if len(discharge_df[discharge_df["hadm_id"] == _id]) == 0:
-            continue
-        discharge_cntr += 1
-        discharge = discharge_df[discharge_df["hadm_id"] == _id]["text"].values[0]
-        cc = extract_cc(discharge)
-        if len(cc) > 0:
-            ccs.append(cc[0].strip())
-            cc_ids.append(_id)
+    # Semi-join of the first discharge note of every hadm_id, keeping the order of hadm_ids
+    discharge = discharge_df[discharge_df["hadm_id"].isin(hadm_ids)]
+    discharge = discharge.drop_duplicates(subset="hadm_id", keep="first")
+    discharge = pd.DataFrame({"hadm_id": hadm_ids}).merge(
+        discharge[["hadm_id", "text"]], on="hadm_id", how="inner"
+    )
+    discharge_cntr = len(discharge)
+
+    cc = discharge["text"].str.extract(CHIEF_COMPLAINT_REGEX, expand=False)
+    found = cc.notna()
+    ccs = cc[found].str.strip().tolist()
+    cc_ids = discharge.loc[found, "hadm_id"].tolist()
     return ccs, cc_ids, discharge_cntr
 
 
 def extract_cc(text):
-    regex = re.compile(
-        "(?:chief|___) complaint:(.*)major (?:surgical|___)",
+    cc = CHIEF_COMPLAINT_REGEX.findall(text)
+    return cc
+
+
+# Headers that end the patient history section, in order of priority
+HISTORY_END_STRINGS = [
+    "physical exam:",
+    "physical examination:",
+    "physical ___:",
+    "pe:",
+    "pe ___:",
+    "(?:pertinent|___) results:",
+    "hospital course:",
+]
+HISTORY_START_REGEX = re.compile(
+    "(?:history|___) of present(?:ing)? illness:", re.IGNORECASE | re.DOTALL
+)
+HISTORY_HEADER_REGEX = re.compile("history of present(?:ing)? illness:", re.IGNORECASE)
+HISTORY_END_REGEXES = [
+    re.compile(end_string, re.IGNORECASE | re.DOTALL)
+    for end_string in HISTORY_END_STRINGS
+]
+
+
+def header_alternation(header_strings):
+    # One regex for all headers. Alternative i is captured in group i + 1 inside a lookahead, so a scan also reports
+    # headers overlapping each other and at a shared position the alternative with higher priority wins
+    return re.compile(
+        "(?=(?:{}))".format("|".join("({})".format(s) for s in header_strings)),
         re.IGNORECASE | re.DOTALL,
     )
-    cc = regex.findall(text)
-    return cc
+
+
+HISTORY_END_REGEX = header_alternation(HISTORY_END_STRINGS)
+
+# Headers that start the physical examination section, in order of priority
+PE_STRINGS = [
+    "physical exam:",
+    "physical examination:",
+    "physical ___:",
+    "pe:",
+    "pe ___:",
+    "pertinent results:",
+]
+PE_START_REGEXES = [
+    re.compile(pe_string, re.IGNORECASE | re.DOTALL) for pe_string in PE_STRINGS
+]
+PE_TERMINAL_REGEXES = {
+    terminal_str: header_alternation([terminal_str])
+    for terminal_str in ["pertinent results:", "brief hospital course:"]
+}
+PE_STRIP_REGEXES = [
+    re.compile(pe_string, re.IGNORECASE)
+    for pe_string in PE_STRINGS + ["pertinent results:", "brief hospital course:"]
+]
+# Remove everything after discharge pe
+PE_DISCHARGE_REGEXES = [
+    re.compile(discharge_str, re.IGNORECASE)
+    for discharge_str in [
+        "at discharge.*",
+        "upon discharge.*",
+        "on discharge.*",
+        "discharge.*",
+    ]
+]
+
+
+def search_section(text, start_regex, end_regex):
+    """
+    Find the section from the first match of start_regex to the earliest end header after it. With several end headers
+    the one with highest priority that occurs after the start wins. Equivalent to searching for start_regex.*?end_header
+    with DOTALL for every end header in order of priority, but scans the note once without backtracking over it.
+
+    Args:
+        text (str): Text to search
+        start_regex (re.Pattern): Regex of the section header
+        end_regex (re.Pattern): Alternation of the headers following the section, see header_alternation
+
+    Returns:
+        section (str): Text from start to including end header or None if not found
+    """
+    start = start_regex.search(text)
+    if not start:
+        return None
+
+    # Matches come in order of position, so the first match of an alternative is its earliest occurrence
+    end = None
+    for match in end_regex.finditer(text, start.end()):
+        if end is None or match.lastindex < end.lastindex:
+            end = match
+            if end.lastindex == 1:
+                break
+    if end is None:
+        return None
+    return text[start.start() : end.end(end.lastindex)]
 
 
 def extract_history(text):
@@ -53,72 +147,54 @@ def extract_history(text):
     #
     text = text.replace("\n", " ")
 
-    success = False
-    i = 0
-    pe_strings = [
-        "physical exam:",
-        "physical examination:",
-        "physical ___:",
-        "pe:",
-        "pe ___:",
-        "(?:pertinent|___) results:",
-        "hospital course:",
-    ]
-    while not success and i < len(pe_strings):
-        regex = re.compile(
-            f"(?:history|___) of present(?:ing)? illness:.*?{pe_strings[i]}",
-            re.IGNORECASE | re.DOTALL,
-        )
-        text, success = regex_extracter(text, regex)
-        i += 1
-    if not success:
+    history = search_section(text, HISTORY_START_REGEX, HISTORY_END_REGEX)
+    if history is None:
         print(text)
         return ""
         # raise Warning("No history match found")
+    text = history
 
     # remove header
-    text = re.sub(
-        re.compile("history of present(?:ing)? illness:", re.IGNORECASE), "", text
-    )
+    text = HISTORY_HEADER_REGEX.sub("", text)
 
     # remove terminal string
-    for pe_str in pe_strings:
-        text = re.sub(re.compile(pe_str, re.IGNORECASE), "", text)
+    for end_regex in HISTORY_END_REGEXES:
+        text = end_regex.sub("", text)
 
     return text
 
 
+DIAGNOSIS_START_HEADERS = ["discharge diagnosis:", "___ diagnosis:"]
+# As last resort match against empty string which sometimes has diagnosis for some reason
+DIAGNOSIS_FALLBACK_START_HEADER = "\n___:"
+# Headers that end the discharge diagnosis, in order of priority
+DIAGNOSIS_END_HEADERS = [
+    "discharge condition:",
+    "___ condition:",
+    "condition:",
+    "procedure:",
+    "procedures:",
+    "invasive procedure on this admission:",
+]
+
+
 def extract_diagnosis_from_discharge(text):
-    start_headers = ["discharge diagnosis:", "___ diagnosis:"]
-    end_headers = [
-        "discharge condition:",
-        "___ condition:",
-        "condition:",
-        "procedure:",
-        "procedures:",
-        "invasive procedure on this admission:",
-    ]
+    lower = text.lower()
     start = 0
-    for start_header in start_headers:
-        if start_header in text.lower():
-            pos_start = last_substring_index(text.lower(), start_header)
-            if pos_start != -1:
-                start = max(start, pos_start + len(start_header))
+    for start_header in DIAGNOSIS_START_HEADERS:
+        pos_start = lower.rfind(start_header)
+        if pos_start != -1:
+            start = max(start, pos_start + len(start_header))
     if not start:
-        # As last resort match against empty string which sometimes has diagnosis for some reason
-        start_header = "\n___:"
-        if start_header in text.lower():
-            pos_start = last_substring_index(text.lower(), start_header)
-            if pos_start != -1:
-                start = pos_start
-        else:
+        pos_start = lower.rfind(DIAGNOSIS_FALLBACK_START_HEADER)
+        if pos_start == -1:
             raise Exception("No start header found")
+        start = pos_start
     end = 0
-    for end_header in end_headers:
-        if end_header in text.lower():
-            pos_end = last_substring_index(text.lower(), end_header)
-            if pos_end != -1:
-                end = max(end, pos_end)
+    for end_header in DIAGNOSIS_END_HEADERS:
+        pos_end = lower.rfind(end_header)
+        if pos_end != -1:
+            end = pos_end
             break
     if not end:
         raise Exception("No end header found")
@@ -126,43 +202,83 @@ def extract_diagnosis_from_discharge(text):
     return discharge_diagnosis.strip()
 
 
+def extract_diagnoses_from_discharge(discharges):
+    """
+    Extracts the discharge diagnosis of many discharge summaries at once. Header positions are searched for all summaries with vectorized string operations. Summaries without diagnosis are collected as failures instead of raising.
+
+    Args:
+        discharges (pd.Series): Discharge summaries indexed by hadm_id
+
+    Returns:
+        diagnoses (pd.Series): Discharge diagnoses indexed by hadm_id. Empty string if the extraction failed
+        failures (pd.DataFrame): hadm_id and error of every failed extraction
+    """
+    lower = discharges.str.lower()
+
+    start = pd.Series(0, index=discharges.index)
+    for start_header in DIAGNOSIS_START_HEADERS:
+        pos_start = lower.str.rfind(start_header).fillna(-1).astype(int)
+        start = start.where(
+            pos_start == -1, start.clip(lower=pos_start + len(start_header))
+        )
+    pos_fallback = (
+        lower.str.rfind(DIAGNOSIS_FALLBACK_START_HEADER).fillna(-1).astype(int)
+    )
+    no_start = (start == 0) & (pos_fallback == -1)
+    start = start.where(start != 0, pos_fallback)
+
+    end = pd.Series(0, index=discharges.index)
+    found_end = pd.Series(False, index=discharges.index)
+    for end_header in DIAGNOSIS_END_HEADERS:
+        pos_end = lower.str.rfind(end_header).fillna(-1).astype(int)
+        end = end.where(found_end | (pos_end == -1), pos_end)
+        found_end |= pos_end != -1
+    no_end = ~no_start & (end == 0)
+
+    errors = pd.Series(None, index=discharges.index, dtype=object)
+    errors[no_end] = "No end header found"
+    errors[no_start] = "No start header found"
+    errors[discharges.map(lambda text: not isinstance(text, str))] = (
+        "No discharge summary"
+    )
+    failed = errors.notna()
+
+    diagnoses = [
+        "" if fail else text[s:e].strip()
+        for text, s, e, fail in zip(discharges, start, end, failed)
+    ]
+    diagnoses = pd.Series(diagnoses, index=discharges.index, dtype=object)
+    failures = pd.DataFrame(
+        {"hadm_id": discharges.index[failed], "error": errors[failed].values}
+    )
+    return diagnoses, failures
+
+
 def extract_physical_examination(text):
     # extract from 'physical exam:' to 'pertinent results:' using regex. Case insensitive
     text = text.replace("\n", " ")
-    success = False
-    i = 0
-    pe_strings = [
-        "physical exam:",
-        "physical examination:",
-        "physical ___:",
-        "pe:",
-        "pe ___:",
-        "pertinent results:",
-    ]
-    while not success and i < len(pe_strings):
-        terminal_str = "pertinent results:"
-        if terminal_str not in text.lower():
-            terminal_str = "brief hospital course:"
-        regex = re.compile(
-            f"{pe_strings[i]}.*?{terminal_str}", re.IGNORECASE | re.DOTALL
-        )
-        text, success = regex_extracter(text, regex)
-        i += 1
-    if not success:
-        return ""
 
-    # remove header
-    for pe_str in pe_strings:
-        text = re.sub(re.compile(pe_str, re.IGNORECASE), "", text)
+    terminal_str = "pertinent results:"
+    if terminal_str not in text.lower():
+        terminal_str = "brief hospital course:"
+    terminal_regex = PE_TERMINAL_REGEXES[terminal_str]
 
-    # remove terminal string
-    text = re.sub(re.compile("pertinent results:", re.IGNORECASE), "", text)
-    text = re.sub(re.compile("brief hospital course:", re.IGNORECASE), "", text)
+    # Try headers in order of priority
+    pe = None
+    for start_regex in PE_START_REGEXES:
+        pe = search_section(text, start_regex, terminal_regex)
+        if pe is not None:
+            break
+    if pe is None:
+        return ""
+    text = pe
+
+    # remove header and terminal string
+    for strip_regex in PE_STRIP_REGEXES:
+        text = strip_regex.sub("", text)
 
     # remove everything after discharge pe
-    text = re.sub(re.compile("at discharge.*", re.IGNORECASE), "", text)
-    text = re.sub(re.compile("upon discharge.*", re.IGNORECASE), "", text)
-    text = re.sub(re.compile("on discharge.*", re.IGNORECASE), "", text)
-    text = re.sub(re.compile("discharge.*", re.IGNORECASE), "", text)
+    for discharge_regex in PE_DISCHARGE_REGEXES:
+        text = discharge_regex.sub("", text)
 
     return text
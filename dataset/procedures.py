@@ -1,24 +1,51 @@
 import re
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+# Section headers of the procedures in discharge summaries, in order of priority
+PROCEDURE_SUBSTRINGS = [
+    "Major Surgical or Invasive Procedure:",
+    "PROCEDURES:",
+    "PROCEDURE:",
+    "Major Surgical ___ Invasive Procedure:",
+    "___ Surgical or Invasive Procedure:",
+    "INVASIVE PROCEDURE ON THIS ADMISSION:",
+    "Major ___ or Invasive Procedure:",
+    "MAJOR SURGICAL AND INVASIVE PROCEDURES PERFORMED THIS DURING\nADMISSION:",
+]
+
+# Finds every header position in one scan. The lookahead also reports headers overlapping each other and at a shared position the alternative with higher priority wins
+PROCEDURE_HEADER_REGEX = re.compile(
+    "(?=(?:{}))".format(
+        "|".join("({})".format(re.escape(s)) for s in PROCEDURE_SUBSTRINGS)
+    )
+)
+
+# Procedure section ends at the next empty line
+PROCEDURE_SECTION_END_REGEX = re.compile(r"\n\s*\n")
 
 
 def extract_procedure_from_discharge_summary(discharge_summary):
     # Extracts everything after the "Major Surgical or Invasive Procedure:" line until the next empty line
     # Returns a list of procedures
-    procedure_substrings = [
-        "Major Surgical or Invasive Procedure:",
-        "PROCEDURES:",
-        "PROCEDURE:",
-        "Major Surgical ___ Invasive Procedure:",
-        "___ Surgical or Invasive Procedure:",
-        "INVASIVE PROCEDURE ON THIS ADMISSION:",
-        "Major ___ or Invasive Procedure:",
-        "MAJOR SURGICAL AND INVASIVE PROCEDURES PERFORMED THIS DURING\nADMISSION:",
-    ]
-    for substring in procedure_substrings:
-        pattern = rf"{re.escape(substring)}.*?\n\s*\n"
-        match = re.search(pattern, discharge_summary, re.DOTALL)
-        if match:
-            procedures_string = match.group(0)
+
+    # First occurrence of every header
+    header_starts = {}
+    for match in PROCEDURE_HEADER_REGEX.finditer(discharge_summary):
+        header_starts.setdefault(match.lastindex - 1, match.start())
+        if 0 in header_starts:
+            break
+
+    # Use the header with highest priority that is followed by an empty line
+    for i in sorted(header_starts):
+        substring = PROCEDURE_SUBSTRINGS[i]
+        start = header_starts[i]
+        end = PROCEDURE_SECTION_END_REGEX.search(
+            discharge_summary, start + len(substring)
+        )
+        if end:
+            procedures_string = discharge_summary[start : end.end()]
 
             # Remove section title
             procedures_string = procedures_string.replace(substring, "")
@@ -35,34 +62,57 @@ def extract_procedure_from_discharge_summary(discharge_summary):
     return []
 
 
-def extract_procedures(hadm_info, procedures_df_icd9, procedures_df_icd10):
+def extract_procedures_from_discharge_summaries(discharge_summaries, n_workers=1):
+    """
+    Extract the procedures of many discharge summaries, optionally in parallel worker processes.
+
+    Args:
+        discharge_summaries (pd.Series): Discharge summary texts
+        n_workers (int): Number of worker processes. Runs in the current process if 1
+
+    Returns:
+        procedures (pd.Series): Lists of procedures with the same index as discharge_summaries
+    """
+    if n_workers <= 1:
+        procedures = [
+            extract_procedure_from_discharge_summary(discharge_summary)
+            for discharge_summary in discharge_summaries
+        ]
+    else:
+        chunksize = max(1, len(discharge_summaries) // (n_workers * 4))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            procedures = list(
+                executor.map(
+                    extract_procedure_from_discharge_summary,
+                    discharge_summaries,
+                    chunksize=chunksize,
+                )
+            )
+    return pd.Series(procedures, index=discharge_summaries.index, dtype=object)
+
+
+def extract_procedures(hadm_info, procedures_df, n_workers=1):
+    ids = list(hadm_info.keys())
+    discharge_procedures = extract_procedures_from_discharge_summaries(
+        pd.Series([hadm_info[_id]["Discharge"] for _id in ids], index=ids),
+        n_workers=n_workers,
+    )
     for _id in hadm_info:
-        discharge_procedures = extract_procedure_from_discharge_summary(
-            hadm_info[_id]["Discharge"]
-        )
-        if len(discharge_procedures) == 0:
+        if len(discharge_procedures[_id]) == 0:
             print("No procedures found for {}".format(_id))
-        hadm_info[_id]["Procedures Discharge"] = discharge_procedures
-
-        procedures_icd9 = procedures_df_icd9[procedures_df_icd9["hadm_id"] == _id][
-            "icd_code"
-        ].values
-        hadm_info[_id]["Procedures ICD9"] = procedures_icd9.tolist()
-        hadm_info[_id]["Procedures ICD9"] = [int(p) for p in procedures_icd9]
-
-        procedures_str = procedures_df_icd9[procedures_df_icd9["hadm_id"] == _id][
-            "long_title"
-        ].values
-        hadm_info[_id]["Procedures ICD9 Title"] = procedures_str.tolist()
-
-        procedures_icd10 = procedures_df_icd10[procedures_df_icd10["hadm_id"] == _id][
-            "icd_code"
-        ].values
-        hadm_info[_id]["Procedures ICD10"] = procedures_icd10.tolist()
-        hadm_info[_id]["Procedures ICD10"] = [str(p) for p in procedures_icd10]
-
-        procedures_str = procedures_df_icd10[procedures_df_icd10["hadm_id"] == _id][
-            "long_title"
-        ].values
-        hadm_info[_id]["Procedures ICD10 Title"] = procedures_str.tolist()
+        hadm_info[_id]["Procedures Discharge"] = discharge_procedures[_id]
+
+    # Collect ICD procedure codes and titles of all admissions with one groupby over the procedures of the cohort
+    cohort_procedures_df = procedures_df[
+        procedures_df["hadm_id"].isin(list(hadm_info.keys()))
+    ]
+    grouped = cohort_procedures_df.groupby(["hadm_id", "icd_version"], sort=False)
+    codes = grouped["icd_code"].agg(list).to_dict()
+    titles = grouped["long_title"].agg(list).to_dict()
+
+    for _id in hadm_info:
+        hadm_info[_id]["Procedures ICD9"] = [int(p) for p in codes.get((_id, 9), [])]
+        hadm_info[_id]["Procedures ICD9 Title"] = titles.get((_id, 9), [])
+        hadm_info[_id]["Procedures ICD10"] = [str(p) for p in codes.get((_id, 10), [])]
+        hadm_info[_id]["Procedures ICD10 Title"] = titles.get((_id, 10), [])
     return hadm_info
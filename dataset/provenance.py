@@ -0,0 +1,233 @@
+from collections.abc import Mapping
+import hashlib
+import inspect
+import json
+import os
+from os.path import exists, join
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from dataset.utils import load_hadm_from_file, write_hadm_to_file
+
+###
+# Provenance manifest for incremental rebuilds of the dataset. The manifest records fingerprints of the source files and,
+# for every stage, the hash of its code and parameters and per admission hashes of its inputs and outputs. The outputs
+# of the last run of a stage are cached, so a stage only recomputes the admissions whose inputs, code or parameters
+# changed
+###
+
+
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def stable_default(obj):
+    # Encoding of values JSON can not encode. Unlike repr, which truncates numpy arrays and DataFrames, it covers the
+    # whole value and does not depend on the iteration order of sets
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.hasobject:
+            return ["ndarray", obj.dtype.str, list(obj.shape), obj.tolist()]
+        data = np.ascontiguousarray(obj).tobytes()
+        return [
+            "ndarray",
+            obj.dtype.str,
+            list(obj.shape),
+            hashlib.blake2b(data, digest_size=16).hexdigest(),
+        ]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, pd.DataFrame):
+        return ["DataFrame", obj.columns.tolist(), obj.index.tolist(), obj.to_numpy()]
+    if isinstance(obj, pd.Series):
+        return ["Series", obj.name, obj.index.tolist(), obj.to_numpy()]
+    if isinstance(obj, (set, frozenset)):
+        return sorted(value_hash(v) for v in obj)
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    return repr(obj)
+
+
+def value_hash(value):
+    # Hash of the JSON encoding, which does not depend on object identity like pickles do. Falls back to pickle for
+    # values JSON can not encode, e.g. dicts with numpy keys
+    try:
+        data = json.dumps(value, default=stable_default).encode("utf-8")
+    except (TypeError, ValueError):
+        data = pickle.dumps(value, protocol=4)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def code_hash(*objects):
+    """
+    Hash of the source code of functions, classes or modules. Pass modules for code that depends on module level
+    constants such as precompiled regexes.
+
+    Args:
+        objects: Functions, classes or modules
+
+    Returns:
+        hash (str): Hex digest
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for obj in objects:
+        h.update(inspect.getsource(obj).encode("utf-8"))
+    return h.hexdigest()
+
+
+class Provenance:
+    """
+    Provenance manifest and stage output cache of a dataset build. The manifest is written to <name>.json in base, the
+    stage outputs to the <name>_cache directory.
+
+    Args:
+        base (str): Directory of the manifest
+        name (str): Name of the manifest
+    """
+
+    def __init__(self, base, name="provenance"):
+        self.path = join(base, name + ".json")
+        self.cache_dir = join(base, name + "_cache")
+        self.manifest = {"sources": {}, "stages": {}}
+        if exists(self.path):
+            with open(self.path) as f:
+                self.manifest = json.load(f)
+        self.runs = []
+        # Stages may only run once the sources of this build are fingerprinted, otherwise a changed source file would
+        # still hit the cache
+        self.sources_recorded = False
+
+    def save(self):
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.path)
+
+    def record_sources(self, paths):
+        """
+        Fingerprint the source files. Files with unchanged size and modification time are not hashed again.
+
+        Args:
+            paths (list): Paths of the source files
+
+        Returns:
+            hash (str): Combined hash of the sources, see sources_hash
+        """
+        sources = {}
+        for path in paths:
+            stat = os.stat(path)
+            previous = self.manifest["sources"].get(path)
+            if (
+                previous is not None
+                and previous["size"] == stat.st_size
+                and previous["mtime_ns"] == stat.st_mtime_ns
+            ):
+                digest = previous["hash"]
+            else:
+                digest = file_hash(path)
+            sources[path] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "hash": digest,
+            }
+        self.manifest["sources"] = sources
+        self.sources_recorded = True
+        self.save()
+        return self.sources_hash()
+
+    def sources_hash(self):
+        return value_hash(
+            sorted(
+                (path, source["hash"])
+                for path, source in self.manifest["sources"].items()
+            )
+        )
+
+    def stage_filename(self, stage):
+        return "".join(c if c.isalnum() or c in "-_" else "_" for c in stage)
+
+    def run_stage(self, stage, function, inputs, code=(), params=None):
+        """
+        Run a stage on the admissions whose inputs changed since its last run and reuse the cached outputs of the others.
+        All admissions are recomputed if the code or parameters of the stage changed. record_sources must be called
+        before.
+
+        Args:
+            stage (str): Name of the stage, e.g. "appendicitis_sanitize"
+            function (callable): Called with a dict of hadm_id to input of the admissions to compute and returns a dict
+                of hadm_id to output. May modify the inputs in place like the stages of extract_info do
+            inputs (dict): hadm_id to input of the stage
+            code (list): Functions and modules the stage depends on, see code_hash
+            params: JSON serializable parameters of the stage
+
+        Returns:
+            outputs (dict): hadm_id to output in the order of inputs. Admissions the function returns no output for
+                are left out
+        """
+        if not self.sources_recorded:
+            raise RuntimeError(
+                "Call record_sources before running stage {}".format(stage)
+            )
+        key = value_hash([code_hash(*code), params])
+        previous = self.manifest["stages"].get(stage, {})
+        cache_name = self.stage_filename(stage)
+        cached = {}
+        previous_inputs = {}
+        if previous.get("key") == key and exists(
+            join(self.cache_dir, cache_name + ".pkl")
+        ):
+            cached = load_hadm_from_file(cache_name, self.cache_dir)
+            previous_inputs = previous["inputs"]
+
+        # Hash before running the function, which can modify the inputs
+        input_hashes = {_id: value_hash(value) for _id, value in inputs.items()}
+        to_compute = {
+            _id: value
+            for _id, value in inputs.items()
+            if _id not in cached or previous_inputs.get(str(_id)) != input_hashes[_id]
+        }
+        computed = function(to_compute) if to_compute else {}
+
+        outputs = {}
+        for _id in inputs:
+            if _id in to_compute:
+                if _id in computed:
+                    outputs[_id] = computed[_id]
+            else:
+                outputs[_id] = cached[_id]
+        output_hashes = {str(_id): value_hash(value) for _id, value in outputs.items()}
+        previous_outputs = previous.get("outputs", {})
+        changed = sum(
+            previous_outputs.get(_id) != digest for _id, digest in output_hashes.items()
+        )
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_hadm_to_file(outputs, cache_name, self.cache_dir)
+        self.manifest["stages"][stage] = {
+            "key": key,
+            "inputs": {str(_id): digest for _id, digest in input_hashes.items()},
+            "outputs": output_hashes,
+        }
+        self.save()
+        self.runs.append(
+            {
+                "stage": stage,
+                "admissions": len(inputs),
+                "reused": len(inputs) - len(to_compute),
+                "recomputed": len(to_compute),
+                "changed outputs": changed,
+            }
+        )
+        return outputs
+
+    def report(self):
+        # Reused and recomputed admissions of every stage run with this instance
+        return pd.DataFrame(
+            self.runs,
+            columns=["stage", "admissions", "reused", "recomputed", "changed outputs"],
+        )
@@ -0,0 +1,164 @@
+from os.path import join
+import pickle
+
+import numpy as np
+
+###
+# Bitmap index over the cohorts of the dataset. Every admission has a position and every attribute value, e.g. an itemid
+# or an imaging modality, a bitmap of the admissions that have it, stored as python int. Queries combine bitmaps with
+# &, | and ~ instead of scanning hadm_info
+###
+
+
+def case_attributes(hadm):
+    """
+    Indexed attribute values of an admission.
+
+    Args:
+        hadm (dict): Admission dict
+
+    Returns:
+        attributes (list): (attribute, value) tuples
+    """
+    attributes = []
+    for itemid in hadm.get("Laboratory Tests", {}):
+        attributes.append(("itemid", itemid))
+    for itemid in hadm.get("Microbiology", {}):
+        attributes.append(("microbiology_itemid", itemid))
+    for rad in hadm.get("Radiology", []):
+        modality, region = rad.get("Modality"), rad.get("Region")
+        if modality is not None:
+            attributes.append(("modality", modality))
+        if region is not None:
+            attributes.append(("region", region))
+        # Modality and region of the same report, e.g. an abdominal CT
+        if modality is not None and region is not None:
+            attributes.append(("imaging", (modality, region)))
+    for code in hadm.get("Procedures ICD9", []):
+        attributes.append(("icd9_procedure", code))
+    for code in hadm.get("Procedures ICD10", []):
+        attributes.append(("icd10_procedure", code))
+    return attributes
+
+
+class QueryIndex:
+    """
+    Bitmaps of attribute values over admissions. Terms are (attribute, value) tuples with the attributes itemid,
+    microbiology_itemid, modality, region, imaging ((modality, region) of a report), icd9_procedure, icd10_procedure,
+    pathology and difficulty (e.g. first_diag or dr_eval).
+
+    Args:
+        hadm_ids (list): hadm_ids in the order of the bitmap positions
+        bitmaps (dict): attribute to dict of value to bitmap
+    """
+
+    def __init__(self, hadm_ids, bitmaps):
+        self.hadm_ids = np.array(hadm_ids, dtype=np.int64)
+        self.bitmaps = bitmaps
+        self.all = (1 << len(hadm_ids)) - 1
+
+    def bitmap(self, term):
+        attribute, value = term
+        return self.bitmaps.get(attribute, {}).get(value, 0)
+
+    def values(self, attribute):
+        return list(self.bitmaps.get(attribute, {}))
+
+    def match(self, all_of=(), any_of=(), none_of=()):
+        """
+        Bitmap of the admissions that have all terms of all_of, at least one term of any_of if given and no term of
+        none_of.
+
+        Args:
+            all_of (list): Terms that must all be present
+            any_of (list): Terms of which at least one must be present. Ignored if empty
+            none_of (list): Terms that must not be present
+
+        Returns:
+            bitmap (int): Bitmap of the matching admissions
+        """
+        bitmap = self.all
+        for term in all_of:
+            bitmap &= self.bitmap(term)
+        if any_of:
+            any_bitmap = 0
+            for term in any_of:
+                any_bitmap |= self.bitmap(term)
+            bitmap &= any_bitmap
+        for term in none_of:
+            bitmap &= ~self.bitmap(term)
+        return bitmap
+
+    def ids(self, bitmap):
+        # hadm_ids of the set bits, in position order
+        n_bytes = (len(self.hadm_ids) + 7) // 8
+        bits = np.unpackbits(
+            np.frombuffer(bitmap.to_bytes(n_bytes, "little"), dtype=np.uint8),
+            bitorder="little",
+        )
+        return self.hadm_ids[np.flatnonzero(bits[: len(self.hadm_ids)])].tolist()
+
+    def query(self, all_of=(), any_of=(), none_of=()):
+        return self.ids(self.match(all_of, any_of, none_of))
+
+    def count(self, all_of=(), any_of=(), none_of=()):
+        return self.match(all_of, any_of, none_of).bit_count()
+
+    def __len__(self):
+        return len(self.hadm_ids)
+
+
+def build_query_index(cohorts, id_difficulty=None):
+    """
+    Build the query index of the cohorts. An admission that is part of several cohorts is indexed once.
+
+    Args:
+        cohorts (dict): Pathology to hadm_info
+        id_difficulty (dict): Pathology to dict of difficulty, e.g. first_diag or dr_eval, to hadm_ids
+
+    Returns:
+        index (QueryIndex): Index of all admissions of the cohorts
+    """
+    positions = {}
+    values = {}
+
+    def add(attribute, value, position):
+        # Collect positions first, setting bits one by one on a growing int would be quadratic
+        values.setdefault(attribute, {}).setdefault(value, []).append(position)
+
+    for pathology, hadm_info in cohorts.items():
+        for _id, hadm in hadm_info.items():
+            if _id not in positions:
+                positions[_id] = len(positions)
+                for attribute, value in dict.fromkeys(case_attributes(hadm)):
+                    add(attribute, value, positions[_id])
+            add("pathology", pathology, positions[_id])
+
+    for difficulties in (id_difficulty or {}).values():
+        for difficulty, hadm_ids in difficulties.items():
+            for _id in hadm_ids:
+                if _id in positions:
+                    add("difficulty", difficulty, positions[_id])
+
+    bitmaps = {}
+    n_bytes = (len(positions) + 7) // 8
+    for attribute, attribute_values in values.items():
+        bitmaps[attribute] = {}
+        for value, value_positions in attribute_values.items():
+            bits = np.zeros(n_bytes * 8, dtype=np.uint8)
+            bits[value_positions] = 1
+            bitmaps[attribute][value] = int.from_bytes(
+                np.packbits(bits, bitorder="little").tobytes(), "little"
+            )
+    return QueryIndex(list(positions), bitmaps)
+
+
+def write_query_index(index, filename, base):
+    with open(join(base, filename + ".pkl"), "wb") as f:
+        pickle.dump((index.hadm_ids.tolist(), index.bitmaps), f)
+
+
+def load_query_index(filename, base):
+    with open(join(base, filename + ".pkl"), "rb") as f:
+        hadm_ids, bitmaps = pickle.load(f)
+    return QueryIndex(hadm_ids, bitmaps)
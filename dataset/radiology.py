@@ -1,4 +1,13 @@
 import re
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from tools.utils import count_radiology_modality_and_organ_matches
+
+# A section header is a line starting with capital letters (and some separators) followed by a colon
+SECTION_HEADER_REGEX = re.compile(r"[A-Z \t,._-]+:")
 
 
 def parse_report(report):
@@ -17,14 +26,18 @@ def parse_report(report):
         if line.isupper() and ":" not in line:
             lines[i] = line.strip() + ":"
 
-    # Rejoin the remaining lines and parse the report as before
-    report = "\n".join(lines)
-    pattern = r"(?m)^([A-Z \t,._-]+):((?:(?!^[A-Z \t,._-]+:).)*)"
-    sections = re.findall(pattern, report, re.DOTALL)
+    # Split into sections in a single pass over the lines. Each header line starts a new section and all following lines up to the next header belong to its body. Text before the first header is dropped
+    sections = []
+    for line in lines:
+        match = SECTION_HEADER_REGEX.match(line)
+        if match:
+            sections.append((match.group(0)[:-1], [line[match.end() :]]))
+        elif sections:
+            sections[-1][1].append(line)
 
     # Add the sections to the dictionary
-    for section in sections:
-        report_dict[section[0].strip()] = section[1].strip()
+    for header, body in sections:
+        report_dict[header.strip()] = "\n".join(body).strip()
 
     return report_dict
 
@@ -69,6 +82,177 @@ def extract_rad_events(texts):
     return cleaned_texts
 
 
+def extract_rad_events_batch(texts):
+    """
+    Clean all radiology reports of a cohort at once. Identical reports are only parsed once.
+
+    Args:
+        texts (pd.Series): Radiology report texts
+
+    Returns:
+        cleaned_texts (pd.Series): Cleaned report texts with the same index as texts
+    """
+    unique_texts = texts.drop_duplicates()
+    cleaned = dict(zip(unique_texts, extract_rad_events(unique_texts.values)))
+    return texts.map(cleaned)
+
+
+RADIOLOGY_DETAIL_FIELDS = ["exam_name", "parent_note_id"]
+
+
+def radiology_detail_maps(radiology_report_details_df):
+    """
+    Create the note_id to exam_name and note_id to parent_note_id maps from the radiology details.
+
+    Args:
+        radiology_report_details_df (pd.DataFrame): Radiology report details with note_id, field_name, field_ordinal and field_value
+
+    Returns:
+        exam_name_map (dict): Map of note_id to exam_name
+        parent_note_map (dict): Map of note_id to parent_note_id
+    """
+    exam_name_map, parent_note_map = {}, {}
+    update_radiology_detail_maps(
+        radiology_report_details_df, exam_name_map, parent_note_map
+    )
+    return exam_name_map, parent_note_map
+
+
+def update_radiology_detail_maps(
+    radiology_report_details_df, exam_name_map, parent_note_map
+):
+    # Only relevant fields with field_ordinal == 1
+    filtered_details_df = radiology_report_details_df[
+        (radiology_report_details_df["field_name"].isin(RADIOLOGY_DETAIL_FIELDS))
+        & (radiology_report_details_df["field_ordinal"] == 1)
+    ]
+
+    # Later rows overwrite earlier ones, same as DataFrame.to_dict
+    for field_name, field_map in [
+        ("exam_name", exam_name_map),
+        ("parent_note_id", parent_note_map),
+    ]:
+        field_df = filtered_details_df[filtered_details_df["field_name"] == field_name]
+        field_map.update(
+            zip(field_df["note_id"].tolist(), field_df["field_value"].tolist())
+        )
+
+
+def load_radiology_detail_maps(path, chunksize=1000000):
+    """
+    Load the note_id to exam_name and note_id to parent_note_id maps from radiology_detail without holding the full table
+    in memory. CSV files are streamed in chunks which are filtered as they are read. Parquet files are read with row filters.
+
+    Args:
+        path (str): Path to radiology_detail.csv or a Parquet version of it
+        chunksize (int): Number of CSV rows read at once
+
+    Returns:
+        exam_name_map (dict): Map of note_id to exam_name
+        parent_note_map (dict): Map of note_id to parent_note_id
+    """
+    columns = ["note_id", "field_name", "field_ordinal", "field_value"]
+    exam_name_map, parent_note_map = {}, {}
+
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(
+            path,
+            columns=columns,
+            filters=[
+                ("field_name", "in", RADIOLOGY_DETAIL_FIELDS),
+                ("field_ordinal", "=", 1),
+            ],
+        )
+        update_radiology_detail_maps(table.to_pandas(), exam_name_map, parent_note_map)
+        return exam_name_map, parent_note_map
+
+    for chunk in pd.read_csv(
+        path,
+        usecols=columns,
+        dtype={"note_id": str, "field_name": "category", "field_value": str},
+        chunksize=chunksize,
+    ):
+        update_radiology_detail_maps(chunk, exam_name_map, parent_note_map)
+    return exam_name_map, parent_note_map
+
+
+def resolve_exam_names(note_ids, exam_name_map, parent_note_map):
+    """
+    Look up the exam names of all notes at once. Notes without an exam name fall back to the exam name of their parent note,
+    or "Unknown" if the parent has none. Notes without either get an empty exam name.
+
+    Args:
+        note_ids (pd.Series): Note ids of the radiology reports
+        exam_name_map (dict): Map of note_id to exam_name
+        parent_note_map (dict): Map of note_id to parent_note_id
+
+    Returns:
+        exam_names (pd.Series): Exam names with the same index as note_ids
+    """
+    exam_names = pd.Series(exam_name_map, dtype=object)
+    parent_notes = pd.Series(parent_note_map, dtype=object)
+
+    has_name = note_ids.isin(exam_names.index).values
+    names = note_ids.map(exam_names).values
+
+    parents = note_ids.map(parent_notes)
+    has_parent = (note_ids.isin(parent_notes.index) & parents.astype(bool)).values
+    parent_has_name = parents.isin(exam_names.index).values
+    parent_names = parents.map(exam_names).values
+
+    for note_id in note_ids[~has_name & ~has_parent]:
+        warnings.warn(
+            "Note ID {} has no exam name and no parent_note_id".format(note_id)
+        )
+
+    names = np.where(
+        has_name,
+        names,
+        np.where(
+            has_parent,
+            np.where(parent_has_name, parent_names, "Unknown"),
+            "",
+        ),
+    )
+    return pd.Series(names, index=note_ids.index, dtype=object)
+
+
+def classify_exam_names(exam_names):
+    """
+    Determine imaging modality and region from the exam names. Each distinct exam name is only classified once.
+
+    Args:
+        exam_names (pd.Series): Exam names of the radiology reports
+
+    Returns:
+        classification (pd.DataFrame): Modality and Region columns with the same index as exam_names. None if no match was found
+    """
+    classification = {}
+    for exam_name in exam_names.drop_duplicates():
+        # Count matches of each modality and region and get most frequent plus counts
+        (
+            frequent_modality,
+            frequent_modality_count,
+            frequent_region,
+            frequent_region_count,
+        ) = count_radiology_modality_and_organ_matches(exam_name)
+
+        if frequent_modality_count == 0:
+            frequent_modality = None
+        if frequent_region_count == 0:
+            frequent_region = None
+        classification[exam_name] = (frequent_modality, frequent_region)
+
+    return pd.DataFrame(
+        [classification[exam_name] for exam_name in exam_names],
+        index=exam_names.index,
+        columns=["Modality", "Region"],
+        dtype=object,
+    )
+
+
 # Extract radiology reports from those that didnt have entries in the radiology df
 def extract_section_headers(text):
     # Extract headers which is a lines of words that ends in a colon
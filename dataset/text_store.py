@@ -0,0 +1,289 @@
+from collections.abc import Mapping
+import hashlib
+import mmap
+import os
+from os.path import join
+import struct
+
+import numpy as np
+import zstandard
+
+###
+# Shared store of the long texts of hadm_info (discharge notes and radiology reports). Every distinct text is stored
+# once, keyed by its content hash and compressed with zstd on its own, so that single texts can be read from the memory
+# mapped file. Case files hold TextRefs instead of the texts, which are resolved when they are accessed
+###
+
+MAGIC = b"HADMTXT1"
+HEADER = struct.Struct("<8sQQ")
+INDEX_DTYPE = np.dtype([("key", "<i8"), ("offset", "<u8"), ("length", "<u8")])
+
+TEXT_KEYS = ["Discharge"]
+RADIOLOGY_TEXT_KEYS = ["Report"]
+
+
+def text_digest(text):
+    # 128 bit blake2b hash of the text, used to tell texts with the same key apart
+    return hashlib.blake2b(
+        text.encode("utf-8", "surrogatepass"), digest_size=16
+    ).digest()
+
+
+def digest_key(digest):
+    # Signed 64 bit prefix of the digest, so that keys are plain python ints and sort as int64
+    return int.from_bytes(digest[:8], "little", signed=True)
+
+
+def next_key(key):
+    return key + 1 if key < 2**63 - 1 else -(2**63)
+
+
+class TextRef:
+    """
+    Reference to a text in a TextStore.
+
+    Args:
+        key (int): Content hash of the text, see TextStoreWriter.add
+    """
+
+    __slots__ = ("key",)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return isinstance(other, TextRef) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return "TextRef({})".format(self.key)
+
+    def __reduce__(self):
+        return TextRef, (self.key,)
+
+
+class TextStoreWriter:
+    """
+    Writer of a text store. Texts are compressed and appended as they are added, a text that was added before is only
+    referenced. The file is written to a temporary file which is moved into place on close. Use as context manager to
+    discard the file if an exception occurs.
+
+    Args:
+        path (str): Path of the .txtstore file
+        level (int): zstd compression level
+    """
+
+    def __init__(self, path, level=3):
+        self.path = path
+        self.tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        self.f = open(self.tmp_path, "wb")
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.index = {}
+        self.digests = {}
+        self.offset = HEADER.size
+        self.f.seek(self.offset)
+
+    def add(self, text):
+        digest = text_digest(text)
+        key = digest_key(digest)
+        # Keys are truncated digests. If another text already has the key, the next free key is used
+        while key in self.digests and self.digests[key] != digest:
+            key = next_key(key)
+        if key not in self.index:
+            blob = self.compressor.compress(text.encode("utf-8", "surrogatepass"))
+            self.f.write(blob)
+            self.index[key] = (self.offset, len(blob))
+            self.digests[key] = digest
+            self.offset += len(blob)
+        return TextRef(key)
+
+    def close(self):
+        index = np.array(
+            [(key, offset, length) for key, (offset, length) in self.index.items()],
+            dtype=INDEX_DTYPE,
+        )
+        index.sort(order="key")
+        self.f.write(index.tobytes())
+        self.f.seek(0)
+        self.f.write(HEADER.pack(MAGIC, len(index), self.offset))
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class TextStore(Mapping):
+    """
+    Read-only dict of TextRef to text backed by a memory mapped text store.
+
+    Args:
+        path (str): Path to the .txtstore file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, index_offset = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError("{} is not a text store".format(path))
+        self.index = np.frombuffer(
+            self.mm, dtype=INDEX_DTYPE, count=count, offset=index_offset
+        )
+        self.keys_ = self.index["key"]
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def _find(self, ref):
+        if not isinstance(ref, TextRef):
+            return None
+        i = np.searchsorted(self.keys_, ref.key)
+        if i < len(self.keys_) and self.keys_[i] == ref.key:
+            return self.index[i]
+        return None
+
+    def __getitem__(self, ref):
+        entry = self._find(ref)
+        if entry is None:
+            raise KeyError(ref)
+        offset, length = int(entry["offset"]), int(entry["length"])
+        with memoryview(self.mm) as view:
+            data = self.decompressor.decompress(view[offset : offset + length])
+        return data.decode("utf-8", "surrogatepass")
+
+    def __contains__(self, ref):
+        return self._find(ref) is not None
+
+    def __iter__(self):
+        return (TextRef(key) for key in self.keys_.tolist())
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        # The index is a view on the mapping and has to be released first
+        self.index = None
+        self.keys_ = None
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def externalize_texts(
+    hadm_info, writer, text_keys=TEXT_KEYS, radiology_text_keys=RADIOLOGY_TEXT_KEYS
+):
+    """
+    Copy of hadm_info in which the texts are added to a text store and replaced by TextRefs. hadm_info is not modified.
+
+    Args:
+        hadm_info (dict): hadm_id to admission dict
+        writer (TextStoreWriter): Writer of the text store
+        text_keys (list): Keys of admission texts to move to the store
+        radiology_text_keys (list): Keys of radiology report texts to move to the store
+
+    Returns:
+        hadm_info (dict): hadm_id to admission dict with TextRefs
+    """
+    hadm_info_refs = {}
+    for _id, hadm in hadm_info.items():
+        hadm = dict(hadm)
+        for key in text_keys:
+            if isinstance(hadm.get(key), str):
+                hadm[key] = writer.add(hadm[key])
+        if "Radiology" in hadm:
+            radiology = []
+            for rad in hadm["Radiology"]:
+                rad = dict(rad)
+                for key in radiology_text_keys:
+                    if isinstance(rad.get(key), str):
+                        rad[key] = writer.add(rad[key])
+                radiology.append(rad)
+            hadm["Radiology"] = radiology
+        hadm_info_refs[_id] = hadm
+    return hadm_info_refs
+
+
+def resolve(value, store):
+    # Dicts in lists such as radiology reports can contain TextRefs, dicts of admissions such as the laboratory tests do not
+    if isinstance(value, TextRef):
+        return store[value]
+    if isinstance(value, list):
+        return [
+            TextDict(v, store) if isinstance(v, dict) else resolve(v, store)
+            for v in value
+        ]
+    return value
+
+
+class TextDict(Mapping):
+    """
+    Read-only view of a dict containing TextRefs. Texts are read from the store on every access and not kept in memory,
+    radiology reports are views as well.
+
+    Args:
+        data (dict): Dict containing TextRefs
+        store (TextStore): Store the TextRefs refer to
+    """
+
+    __slots__ = ("data", "store")
+
+    def __init__(self, data, store):
+        self.data = data
+        self.store = store
+
+    def __getitem__(self, key):
+        return resolve(self.data[key], self.store)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return "TextDict({!r})".format(self.data)
+
+    def to_dict(self):
+        # Plain dict with all texts resolved
+        return {key: to_plain(self[key]) for key in self.data}
+
+
+def to_plain(value):
+    if isinstance(value, TextDict):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [to_plain(v) for v in value]
+    return value
+
+
+def resolve_texts(hadm_info, store):
+    # Wrap every admission of hadm_info with TextRefs so that its texts are resolved on access
+    return {_id: TextDict(hadm, store) for _id, hadm in hadm_info.items()}
+
+
+def load_text_store(filename, base):
+    return TextStore(join(base, filename + ".txtstore"))
+
+
+def text_store_writer(filename, base, level=3):
+    return TextStoreWriter(join(base, filename + ".txtstore"), level)
@@ -1,7 +1,15 @@
 from os.path import join
+import ast
+import gzip
+import json
+import mmap
+import os
 import pickle
 import re
 
+import numpy as np
+import pandas as pd
+
 
 def regex_extracter(text, regex):
     """
@@ -21,32 +29,359 @@ def regex_extracter(text, regex):
         return text, False
 
 
-def last_substring_index(larger_string, substring):
-    last_index = -1
-    while True:
-        index = larger_string.find(substring, last_index + 1)
-        if index == -1:
-            break
-        last_index = index
-    return last_index
+BUFFERS_MAGIC = b"HADMBUF2"
+BUFFERS_ALIGNMENT = 64
+BUFFERS_TOKEN_SIZE = 16
+
+
+class OutOfBandPickler(pickle.Pickler):
+    """
+    Pickler that moves large payloads out of the pickle stream into out-of-band buffers (pickle protocol 5). Arrays
+    supporting protocol 5, such as numpy arrays, provide their buffers directly. Strings are not buffers, so large
+    strings are replaced by a persistent id holding their UTF-8 encoding as buffer. A string referenced several times is
+    only stored once, later references are persistent ids with the number of the string.
+
+    Args:
+        file (file): File the pickle stream is written to
+        buffer_callback (callable): Called with every pickle.PickleBuffer, see pickle.Pickler
+        min_size (int): Minimum length of strings that are moved out of band
+    """
+
+    def __init__(self, file, buffer_callback, min_size):
+        super().__init__(file, protocol=5, buffer_callback=buffer_callback)
+        self.min_size = min_size
+        # id of the string to its number and the string itself, which keeps it alive so that its id is not reused
+        self.strings = {}
+
+    def persistent_id(self, obj):
+        if type(obj) is str and len(obj) >= self.min_size:
+            seen = self.strings.get(id(obj))
+            if seen is not None:
+                return seen[0]
+            self.strings[id(obj)] = (len(self.strings), obj)
+            return pickle.PickleBuffer(obj.encode("utf-8", "surrogatepass"))
+        return None
+
+
+class OutOfBandUnpickler(pickle.Unpickler):
+    def __init__(self, file, buffers):
+        super().__init__(file, buffers=buffers)
+        # Strings in the order in which they were stored, persistent ids are loaded in the order they were written
+        self.strings = []
+
+    def persistent_load(self, pid):
+        if isinstance(pid, int):
+            return self.strings[pid]
+        string = str(pid, "utf-8", "surrogatepass")
+        self.strings.append(string)
+        return string
+
+
+def buffers_path(filename, base):
+    return join(base, filename + ".pkl.buffers")
+
+
+# Write pickle for easy loading. With out_of_band large strings and arrays are written to a sidecar .buffers file
+def write_hadm_to_file(hadm_info, filename, base, out_of_band=False, min_size=1024):
+    path = join(base, filename + ".pkl")
+    sidecar_path = buffers_path(filename, base)
+    if not out_of_band:
+        # A sidecar of a previous out of band write would not belong to the new pickle
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
+        with open(path, "wb") as f:
+            pickle.dump(hadm_info, f)
+        return
+
+    # The pickle and the sidecar are moved into place one after another. Both store the same random token, so that a
+    # pickle is never loaded with the sidecar of another write
+    token = os.urandom(BUFFERS_TOKEN_SIZE)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    tmp_sidecar_path = "{}.{}.tmp".format(sidecar_path, os.getpid())
+    index = []
+    with open(tmp_path, "wb") as f, open(tmp_sidecar_path, "wb") as sidecar:
+
+        # Buffers are appended to the sidecar as they are produced, aligned so that arrays can be used in place
+        def write_buffer(buffer):
+            data = buffer.raw()
+            if data.nbytes < min_size:
+                return True
+            padding = -sidecar.tell() % BUFFERS_ALIGNMENT
+            sidecar.write(b"\0" * padding)
+            index.append((sidecar.tell(), data.nbytes))
+            sidecar.write(data)
+            return False
+
+        pickle.dump(token, f)
+        OutOfBandPickler(f, write_buffer, min_size).dump(hadm_info)
+
+        # Index of (offset, length), the number of buffers and the token follow the data
+        sidecar.write(np.array(index, dtype="<u8").reshape(-1, 2).tobytes())
+        sidecar.write(np.array([len(index)], dtype="<u8").tobytes())
+        sidecar.write(token + BUFFERS_MAGIC)
+    os.replace(tmp_sidecar_path, sidecar_path)
+    os.replace(tmp_path, path)
 
 
-# Write pickle for easy loading
-def write_hadm_to_file(hadm_info, filename, base):
-    with open(join(base, filename + ".pkl"), "wb") as f:
-        pickle.dump(hadm_info, f)
+def load_buffers(sidecar_path, token=None):
+    # Memory map the sidecar and return views of its buffers without copying them. If token is given, the sidecar must
+    # have been written together with the pickle storing it
+    with open(sidecar_path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    if view[-len(BUFFERS_MAGIC) :] != BUFFERS_MAGIC:
+        raise ValueError("{} is not a buffers file".format(sidecar_path))
+    trailer = len(BUFFERS_MAGIC) + BUFFERS_TOKEN_SIZE
+    if token is not None and view[-trailer : -len(BUFFERS_MAGIC)] != token:
+        raise ValueError(
+            "{} was not written together with its pickle".format(sidecar_path)
+        )
+    count = int(np.frombuffer(view[-trailer - 8 : -trailer], dtype="<u8")[0])
+    index = np.frombuffer(
+        view[-trailer - 8 - 16 * count : -trailer - 8], dtype="<u8"
+    ).reshape(-1, 2)
+    return [view[offset : offset + length] for offset, length in index.tolist()]
 
 
-# Load from pickle
+# Load from pickle, using the buffers of the sidecar file if there is one
 def load_hadm_from_file(filename, base):
+    sidecar_path = buffers_path(filename, base)
     with open(join(base, filename + ".pkl"), "rb") as f:
-        hadm_info = pickle.load(f)
+        if not os.path.exists(sidecar_path):
+            return pickle.load(f)
+        token = pickle.load(f)
+        if not isinstance(token, bytes):
+            raise ValueError(
+                "{} was not written together with its pickle".format(sidecar_path)
+            )
+        hadm_info = OutOfBandUnpickler(f, load_buffers(sidecar_path, token)).load()
     return hadm_info
 
 
+JSONL_EXTENSIONS = {None: ".jsonl", "gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+
+
+def nan_to_none(value):
+    # JSON has no NaN, missing values are written as null
+    if isinstance(value, (float, np.floating)):
+        return None if value != value else value
+    if isinstance(value, dict):
+        return {k: nan_to_none(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [nan_to_none(v) for v in value]
+    return value
+
+
+def json_default(obj):
+    # Convert numpy values that json can not serialize
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return nan_to_none(float(obj))
+    if isinstance(obj, np.ndarray):
+        return nan_to_none(obj.tolist())
+    raise TypeError(
+        "Object of type {} is not JSON serializable".format(type(obj).__name__)
+    )
+
+
+def open_jsonl(path, mode, compression=None):
+    # Open a (compressed) JSONL file as text
+    if compression is None:
+        return open(path, mode + "t", encoding="utf-8")
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.open(path, mode, encoding="utf-8")
+    raise ValueError("Unknown compression {}".format(compression))
+
+
+class HadmJSONLWriter:
+    """
+    Streaming writer of hadm_info as JSONL with one admission per line. Admissions are written as soon as write is
+    called, so the cohort never has to be held in memory. The file is written to a temporary file which is only moved
+    into place on close, so a crash never leaves a partial file behind. Use as context manager to discard the file if an
+    exception occurs.
+
+    Dicts with integer keys such as "Laboratory Tests" are stored with string keys, as required by JSON, and restored
+    by read_hadm_from_jsonl. NaN is stored as null, which is read back as None.
+
+    Args:
+        path (str): Path of the file
+        compression (str): None, "gzip" or "zstd"
+    """
+
+    def __init__(self, path, compression=None):
+        self.path = path
+        self.tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        self.f = open_jsonl(self.tmp_path, "w", compression)
+        self.count = 0
+
+    def write(self, hadm_id, hadm):
+        int_key_sections = []
+        case = {}
+        for key, value in hadm.items():
+            if (
+                isinstance(value, dict)
+                and value
+                and all(
+                    isinstance(k, (int, np.integer)) and not isinstance(k, bool)
+                    for k in value
+                )
+            ):
+                int_key_sections.append(key)
+                value = {int(k): v for k, v in value.items()}
+            case[key] = nan_to_none(value)
+        line = json.dumps(
+            {"hadm_id": hadm_id, "int_keys": int_key_sections, "case": case},
+            default=json_default,
+            allow_nan=False,
+        )
+        self.f.write(line + "\n")
+        self.count += 1
+
+    def close(self):
+        self.f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.f.close()
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def read_hadm_from_jsonl(path, compression=None):
+    """
+    Stream the admissions of a JSONL file written by HadmJSONLWriter.
+
+    Args:
+        path (str): Path of the file
+        compression (str): None, "gzip" or "zstd"
+
+    Yields:
+        hadm_id (int): hadm_id of the admission
+        hadm (dict): Admission dict
+    """
+    with open_jsonl(path, "r", compression) as f:
+        for line in f:
+            entry = json.loads(line)
+            case = entry["case"]
+            for key in entry["int_keys"]:
+                case[key] = {int(k): v for k, v in case[key].items()}
+            yield entry["hadm_id"], case
+
+
+# Write JSONL of all admissions, streaming from any iterable of (hadm_id, admission) pairs
+def write_hadm_to_jsonl(hadm_info, filename, base, compression=None):
+    items = hadm_info.items() if isinstance(hadm_info, dict) else hadm_info
+    path = join(base, filename + JSONL_EXTENSIONS[compression])
+    with HadmJSONLWriter(path, compression) as writer:
+        for _id, hadm in items:
+            writer.write(_id, hadm)
+
+
+# Load from JSONL
+def load_hadm_from_jsonl(filename, base, compression=None):
+    path = join(base, filename + JSONL_EXTENSIONS[compression])
+    return dict(read_hadm_from_jsonl(path, compression))
+
+
 # Create a function to nicely print the results
 def print_value_counts(value_counts, n):
     print(f"{'Value':<100} | Count")
     print("----------------------")
     for index, value in value_counts.head(n).items():
         print(f"{index:<100} | {value}")
+
+
+def parse_corresponding_ids(corresponding_ids):
+    """
+    Parse the corresponding_ids column of lab_test_mapping.csv, i.e. lists of itemids written as strings. All lists are
+    parsed with a single json.loads call. Falls back to ast.literal_eval per row if the column is not valid JSON.
+
+    Args:
+        corresponding_ids (pd.Series): Lists of itemids as strings, e.g. "[51221, 51222]"
+
+    Returns:
+        corresponding_ids (pd.Series): Lists of int itemids
+    """
+    try:
+        # parse_float=int rejects non integer ids so that they take the fallback
+        parsed = json.loads("[" + ",".join(corresponding_ids) + "]", parse_float=int)
+    except (TypeError, ValueError):
+        parsed = [ast.literal_eval(ids) for ids in corresponding_ids]
+    if not all(type(i) is int for ids in parsed for i in ids):
+        parsed = [[int(i) for i in ids] for ids in parsed]
+    return pd.Series(parsed, index=corresponding_ids.index, dtype=object)
+
+
+def write_lab_test_mapping(lab_test_mapping_df, path):
+    """
+    Write the lab test mapping to Parquet with corresponding_ids as a list<int32> column.
+
+    Args:
+        lab_test_mapping_df (pd.DataFrame): Lab test mapping
+        path (str): Path of the .parquet file
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(lab_test_mapping_df)
+    i = table.schema.get_field_index("corresponding_ids")
+    table = table.set_column(
+        i,
+        "corresponding_ids",
+        table.column(i).cast(pa.list_(pa.int32())),
+    )
+    pq.write_table(table, path)
+
+
+def load_lab_test_mapping(path):
+    """
+    Load the lab test mapping from Parquet, csv or pickle. Parquet and csv are hydrated directly into lists of int
+    itemids, so no pickle is needed.
+
+    Args:
+        path (str): Path of lab_test_mapping.parquet, lab_test_mapping.csv or lab_test_mapping.pkl
+
+    Returns:
+        lab_test_mapping_df (pd.DataFrame): Lab test mapping
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path)
+        lab_test_mapping_df = table.to_pandas()
+        for column in lab_test_mapping_df.columns:
+            # Missing strings come back as None, restore the NaNs of pandas
+            if (
+                lab_test_mapping_df[column].dtype == object
+                and column != "corresponding_ids"
+            ):
+                lab_test_mapping_df[column] = lab_test_mapping_df[column].where(
+                    lab_test_mapping_df[column].notna(), np.nan
+                )
+        lab_test_mapping_df["corresponding_ids"] = pd.Series(
+            table.column("corresponding_ids").to_pylist(),
+            index=lab_test_mapping_df.index,
+            dtype=object,
+        )
+        return lab_test_mapping_df
+    if path.endswith(".csv"):
+        lab_test_mapping_df = pd.read_csv(path)
+        lab_test_mapping_df["corresponding_ids"] = parse_corresponding_ids(
+            lab_test_mapping_df["corresponding_ids"]
+        )
+        return lab_test_mapping_df
+    with open(path, "rb") as f:
+        return pickle.load(f)
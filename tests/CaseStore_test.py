@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from os.path import join
+
+from dataset.case_store import load_case_store, write_case_store
+
+
+class TestCaseStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.hadm_info = {
+            20000003: {
+                "Patient History": "RLQ pain",
+                "Laboratory Tests": {51301: "14"},
+            },
+            20000001: {"Patient History": "Epigastric pain", "Radiology": []},
+            20000002: {"Patient History": "LLQ pain"},
+        }
+        write_case_store(self.hadm_info, "hadm_info", self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_random_access(self):
+        with load_case_store("hadm_info", self.tmp_dir.name) as store:
+            self.assertEqual(len(store), 3)
+            for _id, hadm in self.hadm_info.items():
+                self.assertEqual(store[_id], hadm)
+            self.assertIn(20000002, store)
+            self.assertNotIn(20000004, store)
+            self.assertNotIn("20000002", store)
+            with self.assertRaises(KeyError):
+                store[20000004]
+
+    def test_iteration_order(self):
+        with load_case_store("hadm_info", self.tmp_dir.name) as store:
+            self.assertEqual(list(store), list(self.hadm_info))
+            self.assertEqual(dict(store), self.hadm_info)
+
+    def test_empty_store(self):
+        write_case_store({}, "empty", self.tmp_dir.name)
+        with load_case_store("empty", self.tmp_dir.name) as store:
+            self.assertEqual(len(store), 0)
+            self.assertNotIn(1, store)
+
+    def test_not_a_store(self):
+        path = join(self.tmp_dir.name, "other.store")
+        with open(path, "wb") as f:
+            f.write(b"\0" * 64)
+        with self.assertRaises(ValueError):
+            load_case_store("other", self.tmp_dir.name)
+
+    def test_failed_write_keeps_store(self):
+        # A failed write leaves the previous store and no temporary file behind
+        with self.assertRaises(TypeError):
+            write_case_store(
+                {20000004: {}, "20000004": {}}, "hadm_info", self.tmp_dir.name
+            )
+        with self.assertRaises(AttributeError):
+            write_case_store(
+                {20000004: {"Patient History": lambda: None}},
+                "hadm_info",
+                self.tmp_dir.name,
+            )
+        self.assertEqual(os.listdir(self.tmp_dir.name), ["hadm_info.store"])
+        with load_case_store("hadm_info", self.tmp_dir.name) as store:
+            self.assertEqual(dict(store), self.hadm_info)
+
+
+if __name__ == "__main__":
+    unittest.main()
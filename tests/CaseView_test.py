@@ -0,0 +1,50 @@
+import tempfile
+import unittest
+
+from dataset.case_store import load_case_store, write_case_store
+from dataset.case_view import CaseView, dump_case
+
+
+class TestCaseView(unittest.TestCase):
+    def setUp(self):
+        self.hadm = {
+            "Patient History": "RLQ pain",
+            "Laboratory Tests": {51301: "14", 50912: "1.1 mg/dL"},
+            "Reference Range Lower": {51301: 4.0, 50912: float("nan")},
+            "Radiology": [{"Modality": "CT", "Report": "Dilated appendix"}],
+        }
+
+    def test_lazy_sections(self):
+        view = CaseView(dump_case(self.hadm))
+        self.assertEqual(list(view), list(self.hadm))
+        self.assertEqual(view.loaded(), [])
+        self.assertEqual(view["Laboratory Tests"].get(51301, "N/A"), "14")
+        self.assertEqual(view.loaded(), ["Laboratory Tests"])
+        # Sections are cached after the first access
+        self.assertIs(view["Laboratory Tests"], view["Laboratory Tests"])
+        self.assertNotIn("Discharge", view)
+        with self.assertRaises(KeyError):
+            view["Discharge"]
+
+    def test_offset(self):
+        blob = b"\0" * 7 + dump_case(self.hadm)
+        view = CaseView(blob, 7)
+        self.assertEqual(view["Radiology"], self.hadm["Radiology"])
+        self.assertEqual(view.to_dict().keys(), self.hadm.keys())
+
+    def test_sectioned_case_store(self):
+        hadm_info = {20000002: self.hadm, 20000001: {"Patient History": "Fever"}}
+        with tempfile.TemporaryDirectory() as base:
+            write_case_store(hadm_info, "hadm_info", base, sectioned=True)
+            with load_case_store("hadm_info", base) as store:
+                self.assertTrue(store.sectioned)
+                self.assertEqual(list(store), list(hadm_info))
+                hadm = store[20000002]
+                self.assertIsInstance(hadm, CaseView)
+                self.assertEqual(hadm["Patient History"], "RLQ pain")
+                self.assertEqual(hadm.loaded(), ["Patient History"])
+                self.assertEqual(store[20000001], hadm_info[20000001])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,225 @@
+import math
+import tempfile
+import unittest
+
+from dataset.columnar import load_hadm_from_parquet, write_hadm_to_parquet
+from dataset.utils import load_hadm_from_file, write_hadm_to_file
+from tests.helpers import nan_equal
+
+HADM_INFO = {
+    20000001: {
+        "Discharge": "Discharge summary",
+        "Patient History": "RLQ pain for 2 days",
+        "Physical Examination": "Tender in RLQ",
+        "Laboratory Tests": {51301: "14.2 K/uL", 50912: "1.1 mg/dL"},
+        "Microbiology": {90201: "NEGATIVE"},
+        "Microbiology Spec": {90201: 70012},
+        "Reference Range Lower": {51301: 4.0, 50912: float("nan")},
+        "Reference Range Upper": {51301: 11.0, 50912: float("nan")},
+        "Radiology": [
+            {
+                "Report": "Dilated appendix.",
+                "Modality": "CT",
+                "Region": "Abdomen",
+                "Exam Name": "CT ABD & PELVIS WITH CONTRAST",
+                "Note ID": "1-RR-1",
+            },
+            {
+                "Report": "Normal.",
+                "Modality": None,
+                "Region": None,
+                "Exam Name": "UNKNOWN",
+                "Note ID": "1-RR-2",
+            },
+        ],
+        "Discharge Diagnosis": "Acute appendicitis",
+        "ICD Diagnosis": ["Other appendicitis", "Hypertension"],
+        "Procedures Discharge": ["Laparoscopic appendectomy"],
+        "Procedures ICD9": [4701],
+        "Procedures ICD9 Title": ["Laparoscopic appendectomy"],
+        "Procedures ICD10": [],
+        "Procedures ICD10 Title": [],
+    },
+    20000002: {
+        "Discharge": "Second summary",
+        "Patient History": "Epigastric pain",
+        "Physical Examination": "",
+        "Laboratory Tests": {},
+        "Microbiology": {},
+        "Microbiology Spec": {},
+        "Reference Range Lower": {},
+        "Reference Range Upper": {},
+        "Radiology": [],
+        "Discharge Diagnosis": "",
+        "ICD Diagnosis": [],
+        "Procedures Discharge": [],
+        "Procedures ICD9": [],
+        "Procedures ICD9 Title": [],
+        "Procedures ICD10": ["0DTJ4ZZ"],
+        "Procedures ICD10 Title": ["Resection of Appendix"],
+    },
+}
+
+# Missing values as they come out of the pandas groupbys and non-str values of the lab and microbiology maps
+HADM_INFO_NAN = {
+    20000003: {
+        "Patient History": "RUQ pain",
+        "Discharge Diagnosis": float("nan"),
+        "Laboratory Tests": {
+            51301: "9.1 K/uL",
+            50912: float("nan"),
+            50931: 7.25,
+            50971: 4,
+            51006: None,
+        },
+        # No reference range for 51006
+        "Reference Range Lower": {
+            51301: 4.0,
+            50912: float("nan"),
+            50931: 7.35,
+            50971: 3.3,
+        },
+        "Reference Range Upper": {
+            51301: 11.0,
+            50912: float("nan"),
+            50931: 7.45,
+            50971: 5.1,
+        },
+        "Microbiology": {90201: float("nan"), 90202: "E. COLI", 90203: None},
+        "Microbiology Spec": {90201: 70012.0, 90202: 70079, 90203: float("nan")},
+        "Radiology": [],
+        "ICD Diagnosis": ["Acute cholecystitis", float("nan")],
+        "Procedures Discharge": [],
+        "Procedures ICD9": [5123, 5110],
+        "Procedures ICD9 Title": [float("nan"), "ERCP"],
+        "Procedures ICD10": ["0FT44ZZ"],
+        "Procedures ICD10 Title": [float("nan")],
+    },
+    # Radiology rows of ConvertPhysionet with empty CSV cells and codes without titles
+    20000005: {
+        "Patient History": "LLQ pain",
+        "Radiology": [
+            {
+                "Note ID": "1-RR-3",
+                "Modality": float("nan"),
+                "Region": float("nan"),
+                "Exam Name": float("nan"),
+                "Report": "Diverticulitis.",
+            },
+            {"Note ID": "1-RR-4", "Modality": "CT", "Report": float("nan")},
+            {"Report": "Only a report", "Region": None},
+        ],
+        "Procedures ICD9": [4573, 4601],
+        "Procedures ICD10": ["0DTN0ZZ"],
+        "Procedures ICD10 Title": [],
+    },
+    20000004: {
+        "Patient History": "Fever",
+        "Discharge Diagnosis": "Cholangitis",
+        "Laboratory Tests": {},
+        "ICD Diagnosis": [float("nan")],
+        "Procedures ICD9": [],
+        "Procedures ICD9 Title": [],
+    },
+}
+
+
+class TestColumnar(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.base = self.tmp_dir.name
+        write_hadm_to_file(HADM_INFO, "hadm_info", self.base)
+        write_hadm_to_parquet(HADM_INFO, "hadm_info", self.base)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip_matches_pickle(self):
+        expected = load_hadm_from_file("hadm_info", self.base)
+        self.assertTrue(
+            nan_equal(expected, load_hadm_from_parquet("hadm_info", self.base))
+        )
+
+    def test_load_admissions(self):
+        hadm_info = load_hadm_from_parquet("hadm_info", self.base, hadm_ids=[20000002])
+        self.assertEqual(list(hadm_info.keys()), [20000002])
+        self.assertTrue(nan_equal(HADM_INFO[20000002], hadm_info[20000002]))
+
+    def test_load_columns(self):
+        hadm_info = load_hadm_from_parquet(
+            "hadm_info",
+            self.base,
+            columns=["Patient History", "Laboratory Tests", "Procedures ICD9"],
+        )
+        self.assertEqual(
+            list(hadm_info[20000001].keys()),
+            ["Patient History", "Laboratory Tests", "Procedures ICD9"],
+        )
+        self.assertEqual(
+            hadm_info[20000001]["Laboratory Tests"],
+            HADM_INFO[20000001]["Laboratory Tests"],
+        )
+        self.assertEqual(hadm_info[20000001]["Procedures ICD9"], [4701])
+
+
+class TestColumnarMissingValues(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.base = self.tmp_dir.name
+        write_hadm_to_file(HADM_INFO_NAN, "hadm_info", self.base)
+        write_hadm_to_parquet(HADM_INFO_NAN, "hadm_info", self.base)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip_matches_pickle(self):
+        expected = load_hadm_from_file("hadm_info", self.base)
+        self.assertTrue(
+            nan_equal(expected, load_hadm_from_parquet("hadm_info", self.base))
+        )
+
+    def test_values_keep_their_type(self):
+        hadm = load_hadm_from_parquet("hadm_info", self.base)[20000003]
+        labs = hadm["Laboratory Tests"]
+        self.assertTrue(math.isnan(labs[50912]))
+        self.assertEqual((labs[50931], type(labs[50931])), (7.25, float))
+        self.assertEqual((labs[50971], type(labs[50971])), (4, int))
+        self.assertIsNone(labs[51006])
+        spec = hadm["Microbiology Spec"]
+        self.assertEqual((spec[90201], type(spec[90201])), (70012.0, float))
+        self.assertEqual((spec[90202], type(spec[90202])), (70079, int))
+        self.assertTrue(math.isnan(spec[90203]))
+        self.assertIsNone(hadm["Microbiology"][90203])
+
+    def test_radiology_and_codes_without_titles(self):
+        hadm = load_hadm_from_parquet("hadm_info", self.base, hadm_ids=[20000005])[
+            20000005
+        ]
+        self.assertTrue(nan_equal(hadm, HADM_INFO_NAN[20000005]))
+        self.assertEqual(list(hadm["Radiology"][2]), ["Report", "Region"])
+        self.assertIsNone(hadm["Radiology"][2]["Region"])
+        self.assertTrue(math.isnan(hadm["Radiology"][0]["Modality"]))
+        self.assertEqual(hadm["Procedures ICD9"], [4573, 4601])
+        self.assertNotIn("Procedures ICD9 Title", hadm)
+        self.assertEqual(hadm["Procedures ICD10 Title"], [])
+
+    def test_nan_in_lists(self):
+        hadm_info = load_hadm_from_parquet(
+            "hadm_info",
+            self.base,
+            hadm_ids=[20000003],
+            columns=["ICD Diagnosis", "Procedures ICD9 Title"],
+        )
+        self.assertTrue(
+            nan_equal(
+                hadm_info[20000003],
+                {
+                    "ICD Diagnosis": ["Acute cholecystitis", float("nan")],
+                    "Procedures ICD9 Title": [float("nan"), "ERCP"],
+                },
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,12 @@
 import unittest
-from dataset.discharge import extract_diagnosis_from_discharge
+
+import pandas as pd
+
+from dataset.discharge import (
+    extract_diagnosis_from_discharge,
+    extract_diagnoses_from_discharge,
+    extract_chief_complaints,
+)
 
 
 class TestDataset(unittest.TestCase):
@@ -144,6 +151,43 @@ Acute Pancreatitis
 Gastroesophageal Reflux Disease"""
         self.assertEqual(output, expected)
 
+    def test_extract_diagnoses_from_discharge(self):
+        discharges = pd.Series(
+            {
+                7: "Discharge Diagnosis:\nAppendicitis\n \nDischarge Condition:\ngood",
+                3: "Discharge Diagnosis:\nCholecystitis\n",
+                5: "No diagnosis",
+            }
+        )
+        diagnoses, failures = extract_diagnoses_from_discharge(discharges)
+        self.assertEqual(diagnoses.to_dict(), {7: "Appendicitis", 3: "", 5: ""})
+        self.assertEqual(
+            failures.to_dict("records"),
+            [
+                {"hadm_id": 3, "error": "No end header found"},
+                {"hadm_id": 5, "error": "No start header found"},
+            ],
+        )
+
+    def test_extract_chief_complaints(self):
+        discharge_df = pd.DataFrame(
+            {
+                "hadm_id": [3, 1, 1, 2],
+                "text": [
+                    "Chief Complaint:\nAbdominal pain\n \nMajor Surgical or Invasive Procedure:\nNone",
+                    "___ Complaint:\nFever\n \nMajor ___ or Invasive Procedure:\nNone",
+                    "Chief Complaint:\nSecond note\n \nMajor Surgical or Invasive Procedure:\nNone",
+                    "No complaint section",
+                ],
+            }
+        )
+        ccs, cc_ids, discharge_cntr = extract_chief_complaints(
+            [1, 2, 3, 4], discharge_df
+        )
+        self.assertEqual(ccs, ["Fever", "Abdominal pain"])
+        self.assertEqual(cc_ids, [1, 3])
+        self.assertEqual(discharge_cntr, 3)
+
 
 if __name__ == "__main__":
     unittest.main()
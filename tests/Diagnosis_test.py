@@ -0,0 +1,164 @@
+import unittest
+
+import pandas as pd
+
+from dataset.diagnosis import ICDTitleIndex, extract_diagnosis_from_diag_df
+from tests.helpers import without_nan
+
+# dataset.dataset imports utils.nlp, which loads the scispacy model
+try:
+    from dataset.dataset import extract_hadm_ids
+except (ImportError, OSError):
+    extract_hadm_ids = None
+
+
+# Previous selection which scans all diagnosis rows once per pathology
+def legacy_select(pathology, diag_icd):
+    mask = diag_icd["long_title"].str.contains(pathology, case=False, na=False)
+    hadm_ids = diag_icd[mask][["hadm_id"]].drop_duplicates()["hadm_id"].values
+    return hadm_ids, diag_icd[mask]["long_title"].value_counts()
+
+
+# Previous per admission filter of the diagnosis titles
+def legacy_diagnoses(hadm_info, diag_df):
+    return {
+        _id: diag_df[diag_df["hadm_id"] == _id]["long_title"].values.tolist()
+        for _id in hadm_info
+    }
+
+
+class TestICDTitleIndex(unittest.TestCase):
+    def setUp(self):
+        self.diag_icd = pd.DataFrame(
+            [
+                (3, "5409", 9, "Acute appendicitis without mention of peritonitis"),
+                (1, "K3580", 10, "Unspecified acute appendicitis"),
+                (2, "5750", 9, "Acute cholecystitis"),
+                (1, "5409", 9, "Acute appendicitis without mention of peritonitis"),
+                (4, "K37", 10, "Unspecified APPENDICITIS"),
+                (5, "5770", 9, "Acute pancreatitis"),
+                (2, "4019", 9, "Unspecified essential hypertension"),
+                (6, "5409", 10, "Other code with the same name in ICD10"),
+                (7, "R69", 10, None),
+                (4, "5750", 9, "Acute cholecystitis"),
+                (3, "K3580", 10, "Unspecified acute appendicitis"),
+            ],
+            columns=["hadm_id", "icd_code", "icd_version", "long_title"],
+        )
+        self.pathologies = [
+            "acute appendicitis",
+            "appendicitis",
+            "ACUTE CHOLECYSTITIS",
+            "pancreatitis",
+            "diverticulitis",
+        ]
+
+    def assert_same_as_legacy(self, index, pathology):
+        hadm_ids, v_counts = index.lookup(pathology)
+        legacy_ids, legacy_counts = legacy_select(pathology, self.diag_icd)
+        self.assertEqual(hadm_ids.tolist(), legacy_ids.tolist())
+        pd.testing.assert_series_equal(
+            v_counts.sort_index(), legacy_counts.sort_index(), check_names=False
+        )
+
+    def test_match_all_pathologies(self):
+        index = ICDTitleIndex(self.diag_icd)
+        index.match(self.pathologies)
+        for pathology in self.pathologies:
+            with self.subTest(pathology=pathology):
+                self.assert_same_as_legacy(index, pathology)
+
+    def test_lookup_one_by_one(self):
+        index = ICDTitleIndex(self.diag_icd)
+        for pathology in self.pathologies:
+            with self.subTest(pathology=pathology):
+                self.assert_same_as_legacy(index, pathology)
+        # Overlapping terms select overlapping cohorts
+        self.assertEqual(index.lookup("acute appendicitis")[0].tolist(), [3, 1])
+        self.assertEqual(index.lookup("appendicitis")[0].tolist(), [3, 1, 4])
+        self.assertEqual(len(index.lookup("diverticulitis")[0]), 0)
+
+    @unittest.skipIf(
+        extract_hadm_ids is None, "scispacy model en_core_sci_lg is not installed"
+    )
+    def test_extract_hadm_ids(self):
+        discharge_df = pd.DataFrame(
+            {
+                "hadm_id": [1, 3, 4],
+                "text": [
+                    "Chief Complaint: abdominal pain\nMajor Surgical",
+                    "Chief Complaint: RLQ pain\nMajor Surgical",
+                    "no complaint",
+                ],
+            }
+        )
+        index = ICDTitleIndex(self.diag_icd)
+        index.match(self.pathologies)
+        for pathology in self.pathologies:
+            with self.subTest(pathology=pathology):
+                hadm_ids = extract_hadm_ids(
+                    pathology, self.diag_icd, discharge_df, icd_index=index
+                )
+                self.assertEqual(
+                    hadm_ids.tolist(),
+                    legacy_select(pathology, self.diag_icd)[0].tolist(),
+                )
+
+
+class TestExtractDiagnosis(unittest.TestCase):
+    def setUp(self):
+        # ICD9 and ICD10 rows are concatenated like in load_data
+        self.diag_df = pd.DataFrame(
+            [
+                (3, "5409", 9, "Acute appendicitis without mention of peritonitis"),
+                (1, "5750", 9, "Acute cholecystitis"),
+                (5, "5770", 9, "Acute pancreatitis"),
+                (1, "4019", 9, "Unspecified essential hypertension"),
+                (3, "V4986", 9, float("nan")),
+                (1, "K8000", 10, "Calculus of gallbladder with acute cholecystitis"),
+                (3, "K3580", 10, "Unspecified acute appendicitis"),
+                (1, "R69", 10, None),
+            ],
+            columns=["hadm_id", "icd_code", "icd_version", "long_title"],
+        )
+        self.hadm_info = {3: {}, 1: {}, 2: {}}
+
+    def test_parity_with_legacy(self):
+        legacy = legacy_diagnoses(self.hadm_info, self.diag_df)
+        hadm_info = extract_diagnosis_from_diag_df(self.hadm_info, self.diag_df)
+        self.assertEqual(list(hadm_info), [3, 1, 2])
+        for _id, diagnoses in legacy.items():
+            with self.subTest(hadm_id=_id):
+                self.assertEqual(
+                    without_nan(hadm_info[_id]["ICD Diagnosis"]),
+                    without_nan(diagnoses),
+                )
+
+    def test_diagnoses(self):
+        hadm_info = extract_diagnosis_from_diag_df(self.hadm_info, self.diag_df)
+        # Row order is kept across the ICD9 and ICD10 rows of an admission
+        self.assertEqual(
+            without_nan(hadm_info[1]["ICD Diagnosis"]),
+            [
+                "Acute cholecystitis",
+                "Unspecified essential hypertension",
+                "Calculus of gallbladder with acute cholecystitis",
+                None,
+            ],
+        )
+        self.assertTrue(pd.isna(hadm_info[3]["ICD Diagnosis"][1]))
+        self.assertEqual(len(hadm_info[3]["ICD Diagnosis"]), 3)
+        # Admissions without diagnosis rows get an empty list
+        self.assertEqual(hadm_info[2]["ICD Diagnosis"], [])
+        self.assertNotIn(5, hadm_info)
+
+    def test_no_diagnosis_rows(self):
+        hadm_info = extract_diagnosis_from_diag_df(
+            self.hadm_info, self.diag_df.iloc[:0]
+        )
+        for hadm in hadm_info.values():
+            self.assertEqual(hadm["ICD Diagnosis"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
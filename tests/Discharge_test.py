@@ -0,0 +1,188 @@
+import contextlib
+import io
+import os
+import random
+import re
+import unittest
+
+import pandas as pd
+
+from dataset.discharge import extract_history, extract_physical_examination
+from dataset.utils import regex_extracter
+
+###
+# Golden tests of the section extractors against the original implementations. Set MIMIC_DISCHARGE_CSV to the path of
+# MIMIC-IV note/discharge.csv to additionally compare on a sample of real discharge notes
+###
+
+REAL_NOTES_SAMPLE = 2000
+
+
+def reference_extract_history(text):
+    text = text.replace("\n", " ")
+
+    success = False
+    i = 0
+    pe_strings = [
+        "physical exam:",
+        "physical examination:",
+        "physical ___:",
+        "pe:",
+        "pe ___:",
+        "(?:pertinent|___) results:",
+        "hospital course:",
+    ]
+    while not success and i < len(pe_strings):
+        regex = re.compile(
+            f"(?:history|___) of present(?:ing)? illness:.*?{pe_strings[i]}",
+            re.IGNORECASE | re.DOTALL,
+        )
+        text, success = regex_extracter(text, regex)
+        i += 1
+    if not success:
+        print(text)
+        return ""
+
+    text = re.sub(
+        re.compile("history of present(?:ing)? illness:", re.IGNORECASE), "", text
+    )
+    for pe_str in pe_strings:
+        text = re.sub(re.compile(pe_str, re.IGNORECASE), "", text)
+    return text
+
+
+def reference_extract_physical_examination(text):
+    text = text.replace("\n", " ")
+    success = False
+    i = 0
+    pe_strings = [
+        "physical exam:",
+        "physical examination:",
+        "physical ___:",
+        "pe:",
+        "pe ___:",
+        "pertinent results:",
+    ]
+    while not success and i < len(pe_strings):
+        terminal_str = "pertinent results:"
+        if terminal_str not in text.lower():
+            terminal_str = "brief hospital course:"
+        regex = re.compile(
+            f"{pe_strings[i]}.*?{terminal_str}", re.IGNORECASE | re.DOTALL
+        )
+        text, success = regex_extracter(text, regex)
+        i += 1
+    if not success:
+        return ""
+
+    for pe_str in pe_strings:
+        text = re.sub(re.compile(pe_str, re.IGNORECASE), "", text)
+    text = re.sub(re.compile("pertinent results:", re.IGNORECASE), "", text)
+    text = re.sub(re.compile("brief hospital course:", re.IGNORECASE), "", text)
+    text = re.sub(re.compile("at discharge.*", re.IGNORECASE), "", text)
+    text = re.sub(re.compile("upon discharge.*", re.IGNORECASE), "", text)
+    text = re.sub(re.compile("on discharge.*", re.IGNORECASE), "", text)
+    text = re.sub(re.compile("discharge.*", re.IGNORECASE), "", text)
+    return text
+
+
+NOTE_FRAGMENTS = [
+    "History of Present Illness:",
+    "HISTORY OF PRESENTING ILLNESS:",
+    "___ of Present Illness:",
+    "Physical Exam:",
+    "PHYSICAL EXAMINATION:",
+    "Physical ___:",
+    "PE:",
+    "pe ___:",
+    "Pertinent Results:",
+    "___ Results:",
+    "Brief Hospital Course:",
+    "Hospital Course:",
+    "ADMISSION EXAM",
+    "At discharge:",
+    "Upon Discharge",
+    "on discharge",
+    "Discharge Condition:",
+    "Patient is a ___ year old female with RLQ pain.",
+    "Abdomen: soft, tender, no rebound",
+    "VS: T 98.6 HR 88 BP 120/80",
+    "\n",
+    "\n\n",
+    " ",
+]
+
+
+def synthetic_notes(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choice(NOTE_FRAGMENTS) for _ in range(rng.randint(0, 25)))
+        for _ in range(n)
+    ]
+
+
+class TestDischarge(unittest.TestCase):
+    def assertGolden(self, notes):
+        for note in notes:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(extract_history(note), reference_extract_history(note))
+            self.assertEqual(
+                extract_physical_examination(note),
+                reference_extract_physical_examination(note),
+            )
+
+    def test_extract_history(self):
+        discharge = """Chief Complaint:
+RLQ pain
+
+History of Present Illness:
+Ms. ___ is a ___ with 2 days of abdominal pain.
+
+Physical Exam:
+Abdomen: tender in RLQ"""
+        self.assertEqual(
+            extract_history(discharge),
+            " Ms. ___ is a ___ with 2 days of abdominal pain.  ",
+        )
+
+    def test_extract_physical_examination(self):
+        discharge = """Physical Exam:
+ADMISSION EXAM
+Abdomen: tender in RLQ
+DISCHARGE EXAM
+Abdomen: soft
+
+Pertinent Results:
+WBC 14"""
+        self.assertEqual(
+            extract_physical_examination(discharge),
+            " ADMISSION EXAM Abdomen: tender in RLQ ",
+        )
+
+    def test_history_end_header_priority(self):
+        # The first occurrence of the end header with highest priority ends the history, not the first end header
+        discharge = (
+            "History of Present Illness: RLQ pain. Pertinent Results: WBC 14. "
+            "PE: tender. Physical Exam: soft. Physical Exam: again"
+        )
+        self.assertEqual(
+            extract_history(discharge), reference_extract_history(discharge)
+        )
+        self.assertEqual(extract_history(discharge), " RLQ pain.  WBC 14.  tender. ")
+
+    def test_golden_synthetic_notes(self):
+        self.assertGolden(synthetic_notes(2000))
+
+    @unittest.skipUnless(
+        os.environ.get("MIMIC_DISCHARGE_CSV"), "MIMIC_DISCHARGE_CSV not set"
+    )
+    def test_golden_real_notes(self):
+        discharge = pd.read_csv(os.environ["MIMIC_DISCHARGE_CSV"], usecols=["text"])
+        sample = discharge["text"].sample(
+            min(REAL_NOTES_SAMPLE, len(discharge)), random_state=0
+        )
+        self.assertGolden(sample.tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import tempfile
+import unittest
+
+import spacy
+
+from utils.doc_cache import DocCache, model_cache_key
+
+
+class TestDocCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.nlp = spacy.blank("en")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_hits_and_misses(self):
+        cache = DocCache(self.tmp_dir.name, self.nlp)
+        doc = cache.get("No appendicitis")
+        self.assertEqual([t.text for t in doc], ["No", "appendicitis"])
+        self.assertIs(cache.get("No appendicitis"), doc)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        docs = cache.pipe(["Fever", "No appendicitis", "Fever"])
+        self.assertEqual([d.text for d in docs], ["Fever", "No appendicitis", "Fever"])
+        self.assertIs(docs[0], docs[2])
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_persistent(self):
+        DocCache(self.tmp_dir.name, self.nlp).pipe(["Fever", "RLQ pain"])
+        cache = DocCache(self.tmp_dir.name, self.nlp)
+        self.assertEqual(cache.get("RLQ pain").text, "RLQ pain")
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_pipeline_change_invalidates(self):
+        DocCache(self.tmp_dir.name, self.nlp).get("Fever")
+        self.nlp.add_pipe("sentencizer")
+        cache = DocCache(self.tmp_dir.name, self.nlp)
+        cache.get("Fever")
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_pipe_config_change_invalidates(self):
+        self.nlp.add_pipe("sentencizer")
+        DocCache(self.tmp_dir.name, self.nlp).get("Fever")
+        nlp = spacy.blank("en")
+        nlp.add_pipe("sentencizer", config={"punct_chars": [";"]})
+        cache = DocCache(self.tmp_dir.name, nlp)
+        cache.get("Fever")
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_negex_termset_changes_key(self):
+        try:
+            import negspacy.negation  # noqa: F401
+        except ImportError:
+            self.skipTest("negspacy is not installed")
+        keys = []
+        for chunk_prefix in [["no"], ["without"]]:
+            nlp = spacy.blank("en")
+            nlp.add_pipe("negex", config={"chunk_prefix": chunk_prefix})
+            keys.append(model_cache_key(nlp))
+        nlp = spacy.blank("en")
+        nlp.add_pipe(
+            "negex",
+            config={
+                "neg_termset": {
+                    "pseudo_negations": [],
+                    "preceding_negations": ["denies"],
+                    "following_negations": [],
+                    "termination": [],
+                }
+            },
+        )
+        keys.append(model_cache_key(nlp))
+        self.assertEqual(len(set(keys)), 3)
+
+    def test_memory_is_bounded(self):
+        cache = DocCache(self.tmp_dir.name, self.nlp, max_memory=2)
+        cache.pipe(["a", "b", "c"])
+        self.assertEqual(len(cache.memory), 2)
+        cache.get("b")
+        cache.get("d")
+        # "c" was used least recently, evicted docs are reloaded from disk
+        self.assertEqual(len(cache.memory), 2)
+        self.assertNotIn("c", [doc.text for doc, _ in cache.memory.values()])
+        self.assertEqual(cache.get("a").text, "a")
+        self.assertEqual(cache.misses, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
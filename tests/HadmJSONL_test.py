@@ -0,0 +1,123 @@
+import json
+import os
+import tempfile
+import unittest
+from os.path import join
+
+import numpy as np
+
+from dataset.utils import (
+    HadmJSONLWriter,
+    load_hadm_from_jsonl,
+    read_hadm_from_jsonl,
+    write_hadm_to_jsonl,
+)
+
+# dataset.dataset imports utils.nlp, which loads the scispacy model
+try:
+    from dataset.dataset import write_hadm_info_jsonl
+except (ImportError, OSError):
+    write_hadm_info_jsonl = None
+
+HADM_INFO = {
+    20000001: {
+        "Patient History": "RLQ pain",
+        "Laboratory Tests": {51301: "14.2 K/uL", 50912: "1.1 mg/dL"},
+        "Reference Range Lower": {51301: 4.0, 50912: float("nan")},
+        "Reference Range Upper": {51301: np.float32(11.0), 50912: np.float32("nan")},
+        "Microbiology": {},
+        "Radiology": [{"Modality": "CT", "Region": None, "Report": "Dilated"}],
+        "ICD Diagnosis": ["Acute appendicitis", float("nan")],
+        "Procedures ICD9": [np.int64(4701)],
+        "Procedures ICD9 Title": np.array([np.nan, 1.5]),
+    },
+    20000002: {"Patient History": "Epigastric pain", "ICD Diagnosis": []},
+}
+
+
+class TestHadmJSONL(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.base = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        for compression in [None, "gzip", "zstd"]:
+            with self.subTest(compression=compression):
+                write_hadm_to_jsonl(HADM_INFO, "hadm_info", self.base, compression)
+                hadm_info = load_hadm_from_jsonl("hadm_info", self.base, compression)
+                self.assertEqual(list(hadm_info), list(HADM_INFO))
+                case = hadm_info[20000001]
+                self.assertEqual(
+                    case["Laboratory Tests"], {51301: "14.2 K/uL", 50912: "1.1 mg/dL"}
+                )
+                # NaN is written as null
+                self.assertEqual(
+                    case["Reference Range Lower"], {51301: 4.0, 50912: None}
+                )
+                self.assertEqual(
+                    case["Reference Range Upper"], {51301: 11.0, 50912: None}
+                )
+                self.assertEqual(case["ICD Diagnosis"], ["Acute appendicitis", None])
+                self.assertEqual(case["Procedures ICD9 Title"], [None, 1.5])
+                self.assertEqual(case["Microbiology"], {})
+                self.assertEqual(case["Radiology"], HADM_INFO[20000001]["Radiology"])
+                self.assertEqual(case["Procedures ICD9"], [4701])
+                self.assertEqual(hadm_info[20000002], HADM_INFO[20000002])
+
+    def test_streaming(self):
+        path = join(self.base, "hadm_info.jsonl")
+        with HadmJSONLWriter(path) as writer:
+            for _id, hadm in HADM_INFO.items():
+                writer.write(_id, hadm)
+                # Nothing is visible under the final name until the writer is closed
+                self.assertFalse(os.path.exists(path))
+        reader = read_hadm_from_jsonl(path)
+        self.assertEqual(next(reader)[0], 20000001)
+        self.assertEqual(next(reader)[0], 20000002)
+
+    def test_valid_json(self):
+        path = join(self.base, "hadm_info.jsonl")
+        with HadmJSONLWriter(path) as writer:
+            writer.write(20000001, HADM_INFO[20000001])
+        with open(path) as f:
+            line = f.read()
+        self.assertNotIn("NaN", line)
+        json.loads(line, parse_constant=self.fail)
+
+    def test_failed_write_leaves_no_file(self):
+        path = join(self.base, "hadm_info.jsonl")
+        with self.assertRaises(RuntimeError):
+            with HadmJSONLWriter(path) as writer:
+                writer.write(20000001, HADM_INFO[20000001])
+                raise RuntimeError("Extraction failed")
+        self.assertEqual(os.listdir(self.base), [])
+
+    @unittest.skipIf(
+        write_hadm_info_jsonl is None, "scispacy model en_core_sci_lg is not installed"
+    )
+    def test_write_pathology_files(self):
+        cwd = os.getcwd()
+        os.chdir(self.base)
+        try:
+            write_hadm_info_jsonl(
+                HADM_INFO, {20000002: HADM_INFO[20000002]}, "acute appendicitis", "gzip"
+            )
+        finally:
+            os.chdir(cwd)
+        hadm_info = load_hadm_from_jsonl(
+            "acute_appendicitis_hadm_info", self.base, "gzip"
+        )
+        self.assertEqual(list(hadm_info), [20000001, 20000002])
+        self.assertEqual(
+            load_hadm_from_jsonl(
+                "acute_appendicitis_hadm_info_clean", self.base, "gzip"
+            ),
+            {20000002: HADM_INFO[20000002]},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import ast
+import tempfile
+import unittest
+from os.path import join
+
+import pandas as pd
+
+from dataset.utils import (
+    load_lab_test_mapping,
+    parse_corresponding_ids,
+    write_lab_test_mapping,
+)
+
+
+class TestLabTestMapping(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.csv_path = join(self.tmp_dir.name, "lab_test_mapping.csv")
+        pd.DataFrame(
+            {
+                "itemid": [51221, None, 50912],
+                "label": ["Hematocrit", "Hct", "Creatinine"],
+                "fluid": ["Blood", None, "Blood"],
+                "corresponding_ids": [[51221, 51638], [51221], [50912]],
+            }
+        ).to_csv(self.csv_path, index=False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_parse_matches_literal_eval(self):
+        corresponding_ids = pd.read_csv(self.csv_path)["corresponding_ids"]
+        expected = corresponding_ids.apply(ast.literal_eval).apply(
+            lambda x: [int(i) for i in x]
+        )
+        self.assertEqual(
+            parse_corresponding_ids(corresponding_ids).tolist(), expected.tolist()
+        )
+
+    def test_parse_fallback(self):
+        corresponding_ids = pd.Series(["['51221', '51638']", "[50912.0]"])
+        self.assertEqual(
+            parse_corresponding_ids(corresponding_ids).tolist(),
+            [[51221, 51638], [50912]],
+        )
+
+    def test_parquet_round_trip(self):
+        lab_test_mapping_df = load_lab_test_mapping(self.csv_path)
+        parquet_path = join(self.tmp_dir.name, "lab_test_mapping.parquet")
+        write_lab_test_mapping(lab_test_mapping_df, parquet_path)
+        loaded = load_lab_test_mapping(parquet_path)
+        pd.testing.assert_frame_equal(loaded, lab_test_mapping_df)
+        self.assertIs(type(loaded["corresponding_ids"].iloc[0][0]), int)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+# utils.nlp loads the scispacy model on import
+try:
+    from utils import nlp
+except (ImportError, OSError):
+    nlp = None
+
+
+@unittest.skipIf(nlp is None, "scispacy model en_core_sci_lg is not installed")
+class TestParseMany(unittest.TestCase):
+    def test_same_as_single_parses(self):
+        texts = [
+            "Acute appendicitis",
+            "No evidence of cholecystitis",
+            "Acute appendicitis",
+        ]
+        docs = nlp.parse_many(texts)
+        self.assertEqual([doc.text for doc in docs], texts)
+        for doc, text in zip(docs, texts):
+            single = nlp.parse(text)
+            self.assertEqual(
+                [(e.text, e._.negex) for e in doc.ents],
+                [(e.text, e._.negex) for e in single.ents],
+            )
+
+    def test_empty(self):
+        self.assertEqual(nlp.parse_many([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
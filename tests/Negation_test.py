@@ -0,0 +1,44 @@
+import unittest
+from utils.negation import keyword_positive_negex
+from utils.negation_cases import NEGATION_REGRESSION_CASES
+
+# utils.nlp loads the scispacy model on import
+try:
+    from utils.nlp import keyword_positive
+except (ImportError, OSError):
+    keyword_positive = None
+
+
+class TestNegation(unittest.TestCase):
+    def test_regression_cases(self):
+        for text, keyword, expected in NEGATION_REGRESSION_CASES:
+            with self.subTest(text=text, keyword=keyword):
+                self.assertEqual(keyword_positive_negex(text, keyword), expected)
+
+    def test_keyword_matches_within_words(self):
+        # Same substring semantics as the spacy path, i.e. "append" is found in "appendectomy"
+        self.assertTrue(keyword_positive_negex("Appendectomy", "append"))
+
+    def test_termination_closes_following_scope(self):
+        self.assertTrue(
+            keyword_positive_negex(
+                "Appendicitis, however the abscess was not", "appendicitis"
+            )
+        )
+
+
+@unittest.skipIf(
+    keyword_positive is None, "scispacy model en_core_sci_lg is not installed"
+)
+class TestNegationEngineAgreement(unittest.TestCase):
+    def test_regression_cases(self):
+        for text, keyword, _ in NEGATION_REGRESSION_CASES:
+            with self.subTest(text=text, keyword=keyword):
+                self.assertEqual(
+                    keyword_positive(text, keyword, "negex"),
+                    keyword_positive(text, keyword, "spacy"),
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import pickle
+import tempfile
+import unittest
+from os.path import join
+
+import numpy as np
+
+from dataset.utils import load_hadm_from_file, write_hadm_to_file
+
+
+class TestOutOfBandPickle(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.base = self.tmp.name
+        self.hadm_info = {
+            1: {
+                "Patient History": "Abdominal pain. " * 200,
+                "Physical Examination": "Soft abdomen",
+                "Laboratory Tests": {51221: "35.0 %"},
+                "Radiology": [{"Modality": "CT", "Report": "Appendix é \ud800" * 100}],
+            },
+            2: {
+                "Patient History": "Fever",
+                "Scores": np.arange(10000, dtype=np.float32),
+            },
+        }
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        write_hadm_to_file(self.hadm_info, "cohort", self.base, out_of_band=True)
+        self.assertTrue(os.path.exists(join(self.base, "cohort.pkl.buffers")))
+        # Only the small payloads stay in the pickle stream
+        self.assertLess(os.path.getsize(join(self.base, "cohort.pkl")), 1024)
+
+        hadm_info = load_hadm_from_file("cohort", self.base)
+        self.assertEqual(hadm_info[1], self.hadm_info[1])
+        self.assertIs(type(hadm_info[1]["Patient History"]), str)
+        scores = hadm_info[2]["Scores"]
+        np.testing.assert_array_equal(scores, self.hadm_info[2]["Scores"])
+        # Arrays are read-only views of the memory mapped sidecar
+        self.assertFalse(scores.flags.writeable)
+
+    def test_plain_write_removes_sidecar(self):
+        write_hadm_to_file(self.hadm_info, "cohort", self.base, out_of_band=True)
+        write_hadm_to_file({3: {"Patient History": "Cough"}}, "cohort", self.base)
+        self.assertFalse(os.path.exists(join(self.base, "cohort.pkl.buffers")))
+        with open(join(self.base, "cohort.pkl"), "rb") as f:
+            self.assertEqual(pickle.load(f), {3: {"Patient History": "Cough"}})
+        self.assertEqual(
+            load_hadm_from_file("cohort", self.base), {3: {"Patient History": "Cough"}}
+        )
+
+    def test_shared_strings_stored_once(self):
+        report = "Dilated appendix. " * 200
+        hadm_info = {
+            _id: {"Patient History": report, "Radiology": [{"Report": report}]}
+            for _id in range(5)
+        }
+        write_hadm_to_file(hadm_info, "cohort", self.base, out_of_band=True)
+        self.assertLess(
+            os.path.getsize(join(self.base, "cohort.pkl.buffers")), 2 * len(report)
+        )
+        loaded = load_hadm_from_file("cohort", self.base)
+        self.assertEqual(loaded, hadm_info)
+        # References to the shared string are restored as one object
+        self.assertIs(loaded[4]["Radiology"][0]["Report"], loaded[0]["Patient History"])
+
+    def test_sidecar_of_other_write(self):
+        write_hadm_to_file(self.hadm_info, "cohort", self.base, out_of_band=True)
+        sidecar_path = join(self.base, "cohort.pkl.buffers")
+        with open(sidecar_path, "rb") as f:
+            sidecar = f.read()
+        write_hadm_to_file(self.hadm_info, "cohort", self.base, out_of_band=True)
+        # E.g. a crash between moving the new sidecar and the new pickle into place
+        with open(sidecar_path, "wb") as f:
+            f.write(sidecar)
+        with self.assertRaises(ValueError):
+            load_hadm_from_file("cohort", self.base)
+
+        # Plain pickle next to a sidecar it does not belong to
+        with open(join(self.base, "cohort.pkl"), "wb") as f:
+            pickle.dump({3: {"Patient History": "Cough"}}, f)
+        with self.assertRaises(ValueError):
+            load_hadm_from_file("cohort", self.base)
+
+
+if __name__ == "__main__":
+    unittest.main()
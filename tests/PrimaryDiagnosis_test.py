@@ -0,0 +1,74 @@
+import re
+import unittest
+from types import SimpleNamespace
+
+from utils.primary_diagnosis import (
+    extract_primary_diagnosis,
+    extract_primary_diagnosis_batch,
+)
+
+# Stand-in for the scispacy pipeline: known terms are returned as entities and noun chunks
+ENTITY_TERMS = ["appendicitis", "cholecystitis", "pancreatitis", "primary diagnosis"]
+NOUN_CHUNK_TERMS = ["acute pancreatitis", "gallstones", "primary"]
+
+
+def stub_parse(text):
+    ents = [
+        SimpleNamespace(text=match.group(0))
+        for match in re.finditer("|".join(ENTITY_TERMS), text, re.IGNORECASE)
+    ]
+    noun_chunks = [
+        SimpleNamespace(text=match.group(0))
+        for match in re.finditer("|".join(NOUN_CHUNK_TERMS), text)
+    ]
+    return SimpleNamespace(text=text, ents=ents, noun_chunks=noun_chunks)
+
+
+class TestPrimaryDiagnosisBatch(unittest.TestCase):
+    def setUp(self):
+        self.texts = [
+            "Primary diagnosis:\nAcute appendicitis, perforated",
+            "primary:\nCholecystitis and choledocholithiasis",
+            "PRIMARY DIAGNOSIS\n- pancreatitis vs. cholecystitis\nSecondary: HTN",
+            "Primary diagnosis:\nAcute appendicitis, perforated",
+            "primary:\nacute pancreatitis or gallstones",
+            "",
+            "no entities here",
+        ]
+        self.parsed = []
+
+    def parse_many(self, texts, n_process=1, batch_size=256):
+        self.parsed.extend(texts)
+        return [stub_parse(text) for text in texts]
+
+    def test_parity_with_single(self):
+        batch = extract_primary_diagnosis_batch(self.texts, self.parse_many)
+        single = [extract_primary_diagnosis(text, stub_parse) for text in self.texts]
+        self.assertEqual(batch, single)
+        self.assertEqual(
+            batch,
+            [
+                "appendicitis",
+                "Cholecystitis",
+                "pancreatitis",
+                "appendicitis",
+                "acute pancreatitis",
+                "",
+                "",
+            ],
+        )
+
+    def test_unique_parses(self):
+        extract_primary_diagnosis_batch(self.texts, self.parse_many)
+        self.assertEqual(len(self.parsed), len(set(self.parsed)))
+        for text in self.texts:
+            self.assertIn(text, self.parsed)
+            for line in text.split("\n"):
+                self.assertIn(line, self.parsed)
+
+    def test_empty(self):
+        self.assertEqual(extract_primary_diagnosis_batch([], self.parse_many), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+import contextlib
+import io
+import re
+import unittest
+
+import pandas as pd
+
+from dataset.procedures import (
+    PROCEDURE_SUBSTRINGS,
+    extract_procedure_from_discharge_summary,
+    extract_procedures,
+    extract_procedures_from_discharge_summaries,
+)
+from tests.helpers import without_nan
+
+
+# Previous search which tries one regex per section header
+def legacy_discharge_procedures(discharge_summary):
+    for substring in PROCEDURE_SUBSTRINGS:
+        pattern = rf"{re.escape(substring)}.*?\n\s*\n"
+        match = re.search(pattern, discharge_summary, re.DOTALL)
+        if match:
+            procedures_string = match.group(0).replace(substring, "")
+            procedures_string = procedures_string.replace("\n", " ")
+            procedures = re.split(r"\: |, |\. | - ", procedures_string)
+            return [proc.strip() for proc in procedures if proc.strip() != ""]
+    return []
+
+
+DISCHARGE_SUMMARIES = [
+    "Major Surgical or Invasive Procedure:\nLaparoscopic appendectomy\n\nHistory",
+    "PROCEDURE: ERCP, sphincterotomy\n\n",
+    # Header with lower priority first in the text
+    "PROCEDURES: CT guided drainage\n\nMajor Surgical or Invasive Procedure:\nNone\n\n",
+    # Header of higher priority without an empty line after it
+    "PROCEDURE: ERCP\n\nMajor Surgical or Invasive Procedure: none",
+    # Overlapping headers
+    "Major Surgical ___ Invasive Procedure: Cholecystectomy - open\n \n",
+    "MAJOR SURGICAL AND INVASIVE PROCEDURES PERFORMED THIS DURING\nADMISSION:\n"
+    "Appendectomy. Drain placement\n\n",
+    "No procedures in this summary",
+    "",
+]
+
+
+# Previous per admission filter of the ICD procedures
+def legacy_icd_procedures(hadm_info, procedures_df):
+    procedures_df_icd9 = procedures_df[procedures_df["icd_version"] == 9]
+    procedures_df_icd10 = procedures_df[procedures_df["icd_version"] == 10]
+    legacy = {}
+    for _id in hadm_info:
+        icd9 = procedures_df_icd9[procedures_df_icd9["hadm_id"] == _id]
+        icd10 = procedures_df_icd10[procedures_df_icd10["hadm_id"] == _id]
+        legacy[_id] = {
+            "Procedures ICD9": [int(p) for p in icd9["icd_code"].values],
+            "Procedures ICD9 Title": icd9["long_title"].values.tolist(),
+            "Procedures ICD10": [str(p) for p in icd10["icd_code"].values],
+            "Procedures ICD10 Title": icd10["long_title"].values.tolist(),
+        }
+    return legacy
+
+
+class TestExtractProcedures(unittest.TestCase):
+    def setUp(self):
+        self.hadm_info = {
+            1: {
+                "Discharge": "Major Surgical or Invasive Procedure:\n"
+                "Laparoscopic appendectomy\n\nHistory: RLQ pain"
+            },
+            2: {"Discharge": "PROCEDURE: ERCP, sphincterotomy\n\n"},
+            3: {"Discharge": "No procedures in this summary"},
+            4: {"Discharge": ""},
+        }
+        self.procedures_df = pd.DataFrame(
+            [
+                (2, "5110", 9, "Endoscopic retrograde cholangiopancreatography"),
+                (1, "4701", 9, "Laparoscopic appendectomy"),
+                (5, "4709", 9, "Other appendectomy"),
+                (2, "0FT44ZZ", 10, "Resection of Gallbladder"),
+                (1, "0DTJ4ZZ", 10, "Resection of Appendix"),
+                (2, "5122", 9, None),
+                (1, "0DJ08ZZ", 10, float("nan")),
+                (2, "5187", 9, "Endoscopic insertion of stent into bile duct"),
+            ],
+            columns=["hadm_id", "icd_code", "icd_version", "long_title"],
+        )
+
+    def extract(self, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return extract_procedures(self.hadm_info, self.procedures_df, **kwargs)
+
+    def test_icd_procedures(self):
+        legacy = legacy_icd_procedures(self.hadm_info, self.procedures_df)
+        hadm_info = self.extract()
+        for _id, expected in legacy.items():
+            for key, values in expected.items():
+                with self.subTest(hadm_id=_id, key=key):
+                    self.assertEqual(
+                        without_nan(hadm_info[_id][key]), without_nan(values)
+                    )
+
+        # ICD9 and ICD10 codes of one admission are split and keep their order
+        self.assertEqual(hadm_info[1]["Procedures ICD9"], [4701])
+        self.assertEqual(hadm_info[1]["Procedures ICD10"], ["0DTJ4ZZ", "0DJ08ZZ"])
+        self.assertEqual(hadm_info[2]["Procedures ICD9"], [5110, 5122, 5187])
+        self.assertEqual(
+            without_nan(hadm_info[2]["Procedures ICD9 Title"]),
+            [
+                "Endoscopic retrograde cholangiopancreatography",
+                None,
+                "Endoscopic insertion of stent into bile duct",
+            ],
+        )
+        self.assertTrue(pd.isna(hadm_info[1]["Procedures ICD10 Title"][1]))
+
+        # Admissions without procedure rows get empty lists
+        for _id in [3, 4]:
+            for key in legacy[_id]:
+                self.assertEqual(hadm_info[_id][key], [])
+
+    def test_discharge_procedures(self):
+        hadm_info = self.extract()
+        for _id, hadm in hadm_info.items():
+            self.assertEqual(
+                hadm["Procedures Discharge"],
+                extract_procedure_from_discharge_summary(hadm["Discharge"]),
+            )
+        self.assertEqual(
+            hadm_info[1]["Procedures Discharge"], ["Laparoscopic appendectomy"]
+        )
+        self.assertEqual(
+            hadm_info[2]["Procedures Discharge"], ["ERCP", "sphincterotomy"]
+        )
+        self.assertEqual(hadm_info[3]["Procedures Discharge"], [])
+
+    def test_no_procedure_rows(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            hadm_info = extract_procedures(self.hadm_info, self.procedures_df.iloc[:0])
+        for hadm in hadm_info.values():
+            self.assertEqual(hadm["Procedures ICD9"], [])
+            self.assertEqual(hadm["Procedures ICD10 Title"], [])
+
+
+class TestDischargeProcedures(unittest.TestCase):
+    def setUp(self):
+        self.discharge_summaries = pd.Series(
+            DISCHARGE_SUMMARIES * 3,
+            index=range(100, 100 + 3 * len(DISCHARGE_SUMMARIES)),
+        )
+
+    def test_parity_with_legacy(self):
+        for discharge_summary in DISCHARGE_SUMMARIES:
+            with self.subTest(discharge_summary=discharge_summary):
+                self.assertEqual(
+                    extract_procedure_from_discharge_summary(discharge_summary),
+                    legacy_discharge_procedures(discharge_summary),
+                )
+
+    def test_workers(self):
+        serial = extract_procedures_from_discharge_summaries(
+            self.discharge_summaries, n_workers=1
+        )
+        parallel = extract_procedures_from_discharge_summaries(
+            self.discharge_summaries, n_workers=2
+        )
+        self.assertEqual(serial.index.tolist(), self.discharge_summaries.index.tolist())
+        self.assertEqual(parallel.index.tolist(), serial.index.tolist())
+        self.assertEqual(parallel.tolist(), serial.tolist())
+        self.assertEqual(
+            serial.tolist(),
+            [legacy_discharge_procedures(d) for d in self.discharge_summaries],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
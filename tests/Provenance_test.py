@@ -0,0 +1,127 @@
+import os
+import tempfile
+import unittest
+from os.path import join
+
+import numpy as np
+import pandas as pd
+
+from dataset.provenance import Provenance, value_hash
+
+
+def upper_history(hadm_info):
+    for hadm in hadm_info.values():
+        hadm["Patient History"] = hadm["Patient History"].upper()
+    return hadm_info
+
+
+def lower_history(hadm_info):
+    for hadm in hadm_info.values():
+        hadm["Patient History"] = hadm["Patient History"].lower()
+    return hadm_info
+
+
+class TestProvenance(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.base = self.tmp_dir.name
+        self.calls = []
+        self.source = join(self.base, "discharge.csv")
+        with open(self.source, "w") as f:
+            f.write("hadm_id,text\n1,a\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def hadm_info(self):
+        return {
+            1: {"Patient History": "RLQ pain", "Laboratory Tests": {51301: "14"}},
+            2: {"Patient History": "Fever", "Laboratory Tests": {}},
+        }
+
+    def provenance(self):
+        provenance = Provenance(self.base)
+        provenance.record_sources([self.source])
+        return provenance
+
+    def run_stage(self, provenance, hadm_info, function=upper_history, params=None):
+        def stage(inputs):
+            self.calls.append(sorted(inputs))
+            return function(inputs)
+
+        return provenance.run_stage(
+            "appendicitis_sanitize", stage, hadm_info, [function], params
+        )
+
+    def test_reuse(self):
+        outputs = self.run_stage(self.provenance(), self.hadm_info())
+        self.assertEqual(outputs[1]["Patient History"], "RLQ PAIN")
+
+        # Only the changed admission is recomputed in a new build
+        hadm_info = self.hadm_info()
+        hadm_info[2]["Patient History"] = "Nausea"
+        provenance = self.provenance()
+        outputs = self.run_stage(provenance, hadm_info)
+        self.assertEqual(self.calls, [[1, 2], [2]])
+        self.assertEqual(list(outputs), [1, 2])
+        self.assertEqual(outputs[1]["Patient History"], "RLQ PAIN")
+        self.assertEqual(outputs[2]["Patient History"], "NAUSEA")
+        report = provenance.report()
+        self.assertEqual(report["reused"].tolist(), [1])
+        self.assertEqual(report["recomputed"].tolist(), [1])
+        self.assertEqual(report["changed outputs"].tolist(), [1])
+
+    def test_code_and_params_invalidate(self):
+        self.run_stage(self.provenance(), self.hadm_info())
+        self.run_stage(self.provenance(), self.hadm_info(), params=["appendix"])
+        outputs = self.run_stage(
+            self.provenance(), self.hadm_info(), lower_history, ["appendix"]
+        )
+        self.assertEqual(self.calls, [[1, 2], [1, 2], [1, 2]])
+        self.assertEqual(outputs[1]["Patient History"], "rlq pain")
+        self.run_stage(self.provenance(), self.hadm_info(), lower_history, ["appendix"])
+        self.assertEqual(len(self.calls), 3)
+
+    def test_sources_required(self):
+        with self.assertRaises(RuntimeError):
+            self.run_stage(Provenance(self.base), self.hadm_info())
+        self.assertEqual(self.calls, [])
+
+    def test_sources(self):
+        path = self.source
+        provenance = Provenance(self.base)
+        sources_hash = provenance.record_sources([path])
+        self.assertEqual(Provenance(self.base).sources_hash(), sources_hash)
+
+        with open(path, "a") as f:
+            f.write("2,b\n")
+        self.assertNotEqual(Provenance(self.base).record_sources([path]), sources_hash)
+        self.assertTrue(os.path.exists(join(self.base, "provenance.json")))
+
+
+class TestValueHash(unittest.TestCase):
+    def test_large_arrays(self):
+        # repr elides the middle of large arrays, the hash must not
+        a = np.zeros(10000)
+        b = a.copy()
+        b[5000] = 1
+        self.assertNotEqual(value_hash({"Scores": a}), value_hash({"Scores": b}))
+        self.assertEqual(value_hash({"Scores": a}), value_hash({"Scores": a.copy()}))
+        self.assertNotEqual(value_hash(a), value_hash(a.astype(np.float32)))
+        self.assertNotEqual(value_hash(a), value_hash(a.reshape(100, 100)))
+
+    def test_dataframes(self):
+        df = pd.DataFrame({"itemid": np.arange(1000), "value": ["1.0"] * 1000})
+        changed = df.copy()
+        changed.loc[500, "value"] = "2.0"
+        self.assertNotEqual(value_hash(df), value_hash(changed))
+        self.assertNotEqual(value_hash(df["value"]), value_hash(changed["value"]))
+        self.assertEqual(value_hash(df), value_hash(df.copy()))
+
+    def test_sets(self):
+        terms = ["appendicitis", "appendectomy", "acute appendicitis"]
+        self.assertEqual(value_hash(set(terms)), value_hash(set(reversed(terms))))
+
+
+if __name__ == "__main__":
+    unittest.main()
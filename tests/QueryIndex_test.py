@@ -0,0 +1,99 @@
+import tempfile
+import unittest
+
+from dataset.query_index import (
+    build_query_index,
+    case_attributes,
+    load_query_index,
+    write_query_index,
+)
+
+
+class TestQueryIndex(unittest.TestCase):
+    def setUp(self):
+        appendicitis = {
+            20000001: {
+                "Laboratory Tests": {50956: "60 IU/L", 51301: "14"},
+                "Radiology": [
+                    {"Modality": "CT", "Region": "Abdomen"},
+                    {"Modality": "Radiograph", "Region": "Chest"},
+                ],
+                "Procedures ICD9": [4701],
+                "Procedures ICD10": [],
+            },
+            20000002: {
+                "Laboratory Tests": {51301: "9"},
+                "Radiology": [{"Modality": "CT", "Region": "Chest"}],
+                "Procedures ICD10": ["0DTJ4ZZ"],
+            },
+        }
+        cholecystitis = {
+            20000003: {
+                "Laboratory Tests": {50956: "30 IU/L"},
+                "Radiology": [{"Modality": "Ultrasound", "Region": None}],
+                "Procedures ICD10": ["0FT44ZZ"],
+            },
+            20000002: appendicitis[20000002],
+        }
+        id_difficulty = {
+            "appendicitis": {"first_diag": [20000001], "dr_eval": [20000002]},
+            "cholecystitis": {"first_diag": [20000003], "dr_eval": [20000003]},
+        }
+        self.hadm_info = {**appendicitis, **cholecystitis}
+        self.index = build_query_index(
+            {"appendicitis": appendicitis, "cholecystitis": cholecystitis},
+            id_difficulty,
+        )
+
+    def test_queries(self):
+        index = self.index
+        self.assertEqual(len(index), 3)
+        # Abdominal CT requires modality and region in the same report
+        self.assertEqual(index.query([("imaging", ("CT", "Abdomen"))]), [20000001])
+        self.assertEqual(
+            index.query([("modality", "CT"), ("region", "Chest")]),
+            [20000001, 20000002],
+        )
+        self.assertEqual(index.query([("itemid", 50956)]), [20000001, 20000003])
+        self.assertEqual(
+            index.query(
+                any_of=[("icd9_procedure", 4701), ("icd10_procedure", "0FT44ZZ")]
+            ),
+            [20000001, 20000003],
+        )
+        self.assertEqual(
+            index.query(
+                [("pathology", "appendicitis")], none_of=[("difficulty", "dr_eval")]
+            ),
+            [20000001],
+        )
+        self.assertEqual(
+            index.query([("pathology", "cholecystitis")]), [20000002, 20000003]
+        )
+        self.assertEqual(index.query(), [20000001, 20000002, 20000003])
+        self.assertEqual(index.query([("itemid", 1)]), [])
+        self.assertEqual(index.count(none_of=[("region", "Abdomen")]), 2)
+
+    def test_scan(self):
+        # Every case attribute query matches a scan of hadm_info
+        for attribute in ["itemid", "modality", "region", "imaging", "icd10_procedure"]:
+            for value in self.index.values(attribute):
+                expected = [
+                    _id
+                    for _id, hadm in self.hadm_info.items()
+                    if (attribute, value) in case_attributes(hadm)
+                ]
+                self.assertEqual(
+                    sorted(self.index.query([(attribute, value)])), sorted(expected)
+                )
+
+    def test_write_and_load(self):
+        with tempfile.TemporaryDirectory() as base:
+            write_query_index(self.index, "query_index", base)
+            index = load_query_index("query_index", base)
+        self.assertEqual(index.bitmaps, self.index.bitmaps)
+        self.assertEqual(index.query([("modality", "Ultrasound")]), [20000003])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,251 @@
+import os
+import re
+import tempfile
+import unittest
+import warnings
+
+import pandas as pd
+
+from dataset.radiology import (
+    classify_exam_names,
+    extract_rad_events_batch,
+    load_radiology_detail_maps,
+    parse_report,
+    radiology_detail_maps,
+    resolve_exam_names,
+)
+from tools.utils import count_radiology_modality_and_organ_matches
+
+
+# Previous parser which splits the rejoined report with a lookahead regex
+def legacy_parse_report(report):
+    lines = report.strip().split("\n")
+    report_dict = {}
+    if lines[0].isupper() and lines[0].strip()[-1] != ":":
+        lines[0] = lines[0].strip() + ":"
+    for i, line in enumerate(lines):
+        if line.isupper() and ":" not in line:
+            lines[i] = line.strip() + ":"
+    report = "\n".join(lines)
+    pattern = r"(?m)^([A-Z \t,._-]+):((?:(?!^[A-Z \t,._-]+:).)*)"
+    sections = re.findall(pattern, report, re.DOTALL)
+    for section in sections:
+        report_dict[section[0].strip()] = section[1].strip()
+    return report_dict
+
+
+REPORTS = [
+    # Multi line sections and consecutive headers
+    "CT ABDOMEN AND PELVIS WITH CONTRAST\n"
+    "INDICATION: RLQ pain.\nEvaluate for appendicitis.\n"
+    "TECHNIQUE:\nCOMPARISON: None.\n"
+    "FINDINGS:\nThe appendix is dilated to 12 mm.\n\nNo free air.\n"
+    "IMPRESSION:\n1. Acute appendicitis.\n2. No abscess.",
+    # Capitalized lines without colon become headers, text before the first header is dropped
+    "Preliminary read\nUS ABDOMEN\nFINDINGS: Gallbladder wall thickening.\n"
+    "PELVIS\nNormal.\nIMPRESSION: Acute cholecystitis.",
+    # Headers with separators and repeated headers
+    "EXAMINATION: CHEST (PA, LAT)\nFINDINGS: Clear.\nFINDINGS: Repeated.\n"
+    "  NOTE_2. SEE BELOW: indented header\nlast line",
+    # Reports without headers
+    "No headers in this report.\nOnly lowercase text: with a colon.",
+    "",
+    "   \n\n",
+    "FINDINGS:",
+    "IMPRESSION:\n\n",
+    "Mixed Case: not a header\nIMPRESSION: header",
+]
+
+
+class TestParseReport(unittest.TestCase):
+    def test_parity_with_legacy_parser(self):
+        for report in REPORTS:
+            with self.subTest(report=report):
+                self.assertEqual(parse_report(report), legacy_parse_report(report))
+
+    def test_sections(self):
+        sections = parse_report(REPORTS[0])
+        self.assertEqual(
+            list(sections),
+            [
+                "CT ABDOMEN AND PELVIS WITH CONTRAST",
+                "INDICATION",
+                "TECHNIQUE",
+                "COMPARISON",
+                "FINDINGS",
+                "IMPRESSION",
+            ],
+        )
+        self.assertEqual(
+            sections["FINDINGS"], "The appendix is dilated to 12 mm.\n\nNo free air."
+        )
+        self.assertEqual(parse_report(REPORTS[3]), {})
+
+    def test_extract_rad_events_batch(self):
+        texts = pd.Series([REPORTS[0], REPORTS[3], REPORTS[0]], index=[5, 6, 7])
+        cleaned = extract_rad_events_batch(texts)
+        self.assertEqual(cleaned.index.tolist(), [5, 6, 7])
+        self.assertEqual(cleaned[5], cleaned[7])
+        self.assertIn("FINDINGS:\nThe appendix is dilated", cleaned[5])
+        self.assertNotIn("IMPRESSION", cleaned[5])
+        self.assertEqual(cleaned[6], "")
+
+
+# Previous per note lookup of the exam names and their classification
+def legacy_exam_name(note_id, exam_name_map, parent_note_map):
+    name = exam_name_map.get(note_id, None)
+    if name is None:
+        parent_note_id = parent_note_map.get(note_id, None)
+        if parent_note_id:
+            name = exam_name_map.get(parent_note_id, "Unknown")
+        else:
+            name = ""
+    return name
+
+
+def legacy_classify(exam_name):
+    modality, modality_count, region, region_count = (
+        count_radiology_modality_and_organ_matches(exam_name)
+    )
+    return (
+        modality if modality_count else None,
+        region if region_count else None,
+    )
+
+
+class TestExamNames(unittest.TestCase):
+    def setUp(self):
+        self.exam_name_map = {
+            "1-RR-1": "CT ABD & PELVIS WITH CONTRAST",
+            "1-RR-6": "US ABD LIMIT, SINGLE ORGAN",
+            "1-RR-9": "MYSTERY PROCEDURE",
+        }
+        self.parent_note_map = {
+            "1-RR-2": "1-RR-1",
+            # Parent without exam name
+            "1-RR-3": "9-RR-9",
+            # Own parent without and with exam name
+            "1-RR-5": "1-RR-5",
+            "1-RR-6": "1-RR-6",
+            "1-RR-7": "",
+            "1-RR-8": float("nan"),
+        }
+        self.note_ids = pd.Series(
+            ["1-RR-{}".format(i) for i in range(1, 10)], index=range(10, 19)
+        )
+
+    def test_resolve_exam_names(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            exam_names = resolve_exam_names(
+                self.note_ids, self.exam_name_map, self.parent_note_map
+            )
+        self.assertEqual(exam_names.index.tolist(), self.note_ids.index.tolist())
+        self.assertEqual(
+            exam_names.tolist(),
+            [
+                legacy_exam_name(note_id, self.exam_name_map, self.parent_note_map)
+                for note_id in self.note_ids
+            ],
+        )
+        self.assertEqual(
+            exam_names.tolist(),
+            [
+                "CT ABD & PELVIS WITH CONTRAST",
+                "CT ABD & PELVIS WITH CONTRAST",
+                "Unknown",
+                "",
+                "Unknown",
+                "US ABD LIMIT, SINGLE ORGAN",
+                "",
+                "Unknown",
+                "MYSTERY PROCEDURE",
+            ],
+        )
+        # Notes without exam name and parent are reported
+        self.assertEqual(
+            sorted(str(w.message) for w in caught),
+            [
+                "Note ID 1-RR-4 has no exam name and no parent_note_id",
+                "Note ID 1-RR-7 has no exam name and no parent_note_id",
+            ],
+        )
+
+    def test_classify_exam_names(self):
+        exam_names = pd.Series(
+            [
+                "CT ABD & PELVIS WITH CONTRAST",
+                "Unknown",
+                "",
+                "MYSTERY PROCEDURE",
+                "US ABD LIMIT, SINGLE ORGAN",
+                "CT ABD & PELVIS WITH CONTRAST",
+            ],
+            index=range(3, 9),
+        )
+        classification = classify_exam_names(exam_names)
+        self.assertEqual(classification.index.tolist(), exam_names.index.tolist())
+        self.assertEqual(
+            list(classification.itertuples(index=False, name=None)),
+            [legacy_classify(exam_name) for exam_name in exam_names],
+        )
+        self.assertEqual(classification.loc[3].tolist(), ["CT", "Abdomen"])
+        # Unknown exam names have neither modality nor region
+        for i in [4, 5, 6]:
+            self.assertEqual(classification.loc[i].tolist(), [None, None])
+
+
+class TestLoadRadiologyDetailMaps(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.details_df = pd.DataFrame(
+            [
+                ("1-RR-1", 1, "exam_name", 1, "CT ABD & PELVIS WITH CONTRAST"),
+                ("1-RR-1", 1, "cpt_code", 1, "74177"),
+                ("1-RR-2", 1, "parent_note_id", 1, "1-RR-1"),
+                ("1-RR-2", 1, "exam_name", 2, "SECOND EXAM NAME"),
+                ("1-RR-3", 2, "exam_name", 1, "US ABD LIMIT, SINGLE ORGAN"),
+                ("1-RR-3", 2, "parent_note_id", 1, "1-RR-1"),
+                ("1-RR-4", 2, "cpt_code", 1, "76705"),
+                # Later rows overwrite earlier ones
+                ("1-RR-3", 2, "exam_name", 1, "CHEST (PA & LAT)"),
+            ],
+            columns=[
+                "note_id",
+                "subject_id",
+                "field_name",
+                "field_ordinal",
+                "field_value",
+            ],
+        )
+        self.expected = (
+            {"1-RR-1": "CT ABD & PELVIS WITH CONTRAST", "1-RR-3": "CHEST (PA & LAT)"},
+            {"1-RR-2": "1-RR-1", "1-RR-3": "1-RR-1"},
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_in_memory(self):
+        self.assertEqual(radiology_detail_maps(self.details_df), self.expected)
+
+    def test_csv_chunks(self):
+        path = os.path.join(self.tmp_dir.name, "radiology_detail.csv")
+        self.details_df.to_csv(path, index=False)
+        # Chunks split the rows of a note and the overwritten exam name
+        for chunksize in [1, 3, 100]:
+            with self.subTest(chunksize=chunksize):
+                self.assertEqual(
+                    load_radiology_detail_maps(path, chunksize=chunksize),
+                    self.expected,
+                )
+
+    def test_parquet_filters(self):
+        path = os.path.join(self.tmp_dir.name, "radiology_detail.parquet")
+        # Row groups of two rows, so the filters apply across row groups
+        self.details_df.to_parquet(path, index=False, row_group_size=2)
+        self.assertEqual(load_radiology_detail_maps(path), self.expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import pickle
+import tempfile
+import unittest
+from os.path import join
+from unittest import mock
+
+from dataset.text_store import (
+    TextRef,
+    externalize_texts,
+    load_text_store,
+    resolve_texts,
+    text_store_writer,
+)
+
+
+class TestTextStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        discharge = "Name: ___\nChief Complaint: abdominal pain\n" * 50
+        self.hadm_info = {
+            20000001: {
+                "Patient History": "RLQ pain",
+                "Discharge": discharge,
+                "Laboratory Tests": {51301: "14"},
+                "Radiology": [
+                    {"Modality": "CT", "Report": "Dilated appendix \ud800"},
+                    {"Modality": "US", "Report": "Normal"},
+                ],
+            },
+            20000002: {
+                "Patient History": "LLQ pain",
+                "Discharge": discharge,
+                "Radiology": [{"Modality": "CT", "Report": "Normal"}],
+            },
+            20000003: {"Patient History": "Fever", "Discharge": float("nan")},
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        with text_store_writer("texts", self.tmp_dir.name) as writer:
+            hadm_info_refs = externalize_texts(self.hadm_info, writer)
+        self.assertIsInstance(hadm_info_refs[20000001]["Discharge"], TextRef)
+        self.assertIsInstance(self.hadm_info[20000001]["Discharge"], str)
+        hadm_info_refs = pickle.loads(pickle.dumps(hadm_info_refs))
+
+        with load_text_store("texts", self.tmp_dir.name) as store:
+            # The discharge note and "Normal" report are only stored once
+            self.assertEqual(len(store), 3)
+            hadm_info = resolve_texts(hadm_info_refs, store)
+            self.assertEqual(
+                hadm_info[20000002]["Discharge"],
+                self.hadm_info[20000002]["Discharge"],
+            )
+            self.assertEqual(
+                hadm_info[20000001]["Radiology"][0]["Report"],
+                "Dilated appendix \ud800",
+            )
+            self.assertEqual(hadm_info[20000001]["Laboratory Tests"], {51301: "14"})
+            self.assertEqual(hadm_info[20000002].to_dict(), self.hadm_info[20000002])
+            self.assertNotIn(TextRef(1), store)
+            with self.assertRaises(KeyError):
+                store[TextRef(1)]
+
+    def test_key_collision(self):
+        # Digests which only differ after the 64 bit key
+        def colliding_digest(text):
+            return bytes(8) + text.encode("utf-8", "surrogatepass")[:8].ljust(8)
+
+        texts = ["Appendicitis", "Cholecystitis", "Pancreatitis"]
+        with mock.patch("dataset.text_store.text_digest", colliding_digest):
+            with text_store_writer("texts", self.tmp_dir.name) as writer:
+                refs = [writer.add(text) for text in texts]
+                self.assertEqual(writer.add("Cholecystitis"), refs[1])
+        self.assertEqual(len(set(refs)), 3)
+        with load_text_store("texts", self.tmp_dir.name) as store:
+            self.assertEqual([store[ref] for ref in refs], texts)
+
+    def test_compression(self):
+        with text_store_writer("texts", self.tmp_dir.name) as writer:
+            externalize_texts(self.hadm_info, writer)
+        self.assertLess(
+            os.path.getsize(join(self.tmp_dir.name, "texts.txtstore")),
+            len(self.hadm_info[20000001]["Discharge"]) // 5,
+        )
+
+    def test_abort_on_exception(self):
+        with self.assertRaises(RuntimeError):
+            with text_store_writer("texts", self.tmp_dir.name) as writer:
+                writer.add("Report")
+                raise RuntimeError()
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import math
+
+import pandas as pd
+
+###
+# Comparison helpers shared by the tests
+###
+
+
+def without_nan(values):
+    # NaN is not equal to itself, compare it as None
+    return [None if pd.isna(v) else v for v in values]
+
+
+def nan_equal(a, b):
+    # NaN aware equality of nested hadm_info values
+    if isinstance(a, float) and math.isnan(a):
+        return isinstance(b, float) and math.isnan(b)
+    if isinstance(a, dict):
+        return (
+            isinstance(b, dict)
+            and list(a.keys()) == list(b.keys())
+            and all(nan_equal(a[k], b[k]) for k in a)
+        )
+    if isinstance(a, list):
+        return (
+            isinstance(b, list)
+            and len(a) == len(b)
+            and all(nan_equal(x, y) for x, y in zip(a, b))
+        )
+    return type(a) is type(b) and a == b
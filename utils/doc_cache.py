@@ -0,0 +1,203 @@
+from collections import OrderedDict
+import hashlib
+import os
+import time
+from os.path import join
+
+import spacy
+import srsly
+from spacy.tokens import DocBin
+
+###
+# Content-addressed on-disk cache of parsed spaCy Docs
+###
+
+
+class DocCache:
+    """
+    Persistent cache of spaCy Docs serialized as DocBins. Entries are keyed by the hash of the text and live in a directory
+    named after the model (name, version, pipeline and pipe configs), so that a change of model never returns stale parses.
+
+    Args:
+        cache_dir (str): Directory in which the cache is stored. Created if it does not exist
+        nlp (spacy.Language): Pipeline used to parse texts that are not yet cached
+        max_memory (int): Maximum number of docs kept in memory. The least recently used docs are evicted first and
+            reloaded from disk when needed again
+    """
+
+    def __init__(self, cache_dir, nlp, max_memory=10000):
+        self.nlp = nlp
+        self.model_key = model_cache_key(nlp)
+        self.cache_dir = join(cache_dir, self.model_key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Recently used docs, so repeated texts do not even hit the disk
+        self.memory = OrderedDict()
+        self.max_memory = max_memory
+
+        self.hits = 0
+        self.misses = 0
+        self.parse_time = 0.0
+        self.parse_time_saved = 0.0
+        self.load_time = 0.0
+
+    def __call__(self, text):
+        return self.get(text)
+
+    def get(self, text):
+        key = text_key(text)
+        doc = self._from_memory(key)
+        if doc is not None:
+            return doc
+
+        doc = self._load(key)
+        if doc is not None:
+            return doc
+
+        start = time.perf_counter()
+        doc = self.nlp(text)
+        parse_time = time.perf_counter() - start
+        self.misses += 1
+        self.parse_time += parse_time
+        self._store(key, doc, parse_time)
+        return doc
+
+    def pipe(self, texts, n_process=1, batch_size=256):
+        """
+        Parse a list of texts, only running the pipeline on texts that are not cached. Misses are parsed in a single
+        nlp.pipe stream.
+
+        Args:
+            texts (list): Texts to parse
+            n_process (int): Number of processes used by nlp.pipe for the cache misses
+            batch_size (int): Batch size used by nlp.pipe for the cache misses
+
+        Returns:
+            docs (list): Parsed docs in the order of texts
+        """
+        docs = [None] * len(texts)
+        missing = {}
+        for i, text in enumerate(texts):
+            key = text_key(text)
+            if key in missing:
+                missing[key][1].append(i)
+                continue
+            doc = self._from_memory(key)
+            if doc is not None:
+                docs[i] = doc
+                continue
+            doc = self._load(key)
+            if doc is not None:
+                docs[i] = doc
+            else:
+                missing[key] = (text, [i])
+
+        if missing:
+            keys = list(missing.keys())
+            start = time.perf_counter()
+            parsed = list(
+                self.nlp.pipe(
+                    [missing[key][0] for key in keys],
+                    n_process=n_process,
+                    batch_size=batch_size,
+                )
+            )
+            # Time per text is only known for the whole stream, so spread it evenly
+            parse_time = (time.perf_counter() - start) / len(keys)
+            for key, doc in zip(keys, parsed):
+                self.misses += 1
+                self.parse_time += parse_time
+                self._store(key, doc, parse_time)
+                for i in missing[key][1]:
+                    docs[i] = doc
+        return docs
+
+    def _from_memory(self, key):
+        if key not in self.memory:
+            return None
+        self.memory.move_to_end(key)
+        doc, parse_time = self.memory[key]
+        self.hits += 1
+        self.parse_time_saved += parse_time
+        return doc
+
+    def _remember(self, key, doc, parse_time):
+        self.memory[key] = (doc, parse_time)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory:
+            self.memory.popitem(last=False)
+
+    def _path(self, key):
+        return join(self.cache_dir, key[:2], key + ".spacy")
+
+    def _load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            entry = srsly.msgpack_loads(f.read())
+        doc_bin = DocBin(store_user_data=True).from_bytes(entry["doc"])
+        doc = list(doc_bin.get_docs(self.nlp.vocab))[0]
+        self.load_time += time.perf_counter() - start
+        self.hits += 1
+        self.parse_time_saved += entry["parse_time"]
+        self._remember(key, doc, entry["parse_time"])
+        return doc
+
+    def _store(self, key, doc, parse_time):
+        self._remember(key, doc, parse_time)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Store user data so that extension attributes such as negex survive the round trip
+        doc_bin = DocBin(store_user_data=True, docs=[doc])
+        entry = {"parse_time": parse_time, "doc": doc_bin.to_bytes()}
+
+        # Write to temporary file first so that concurrent runs never see half written entries
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(srsly.msgpack_dumps(entry))
+        os.replace(tmp_path, path)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def report(self):
+        print("DocCache ({})".format(self.model_key))
+        print(
+            "Hits: {}, Misses: {}, Hit rate: {:.1%}".format(
+                self.hits, self.misses, self.hit_rate()
+            )
+        )
+        print(
+            "Parse time: {:.1f}s, Parse time saved: {:.1f}s (spent {:.1f}s loading cached docs)".format(
+                self.parse_time, self.parse_time_saved, self.load_time
+            )
+        )
+
+
+def text_key(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def model_cache_key(nlp):
+    # Include the pipeline components and their configs since added pipes like negex and their settings (e.g. the
+    # negex termset) change the stored annotations
+    meta = nlp.meta
+    pipeline = hashlib.sha256(
+        srsly.json_dumps(
+            [(name, nlp.get_pipe_config(name)) for name in nlp.pipe_names],
+            sort_keys=True,
+        ).encode("utf-8")
+    ).hexdigest()
+    return "{}_{}-{}_spacy-{}_{}".format(
+        meta.get("lang", ""),
+        meta.get("name", ""),
+        meta.get("version", ""),
+        spacy.__version__,
+        pipeline[:8],
+    )
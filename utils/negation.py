@@ -0,0 +1,256 @@
+import re
+
+###
+# Lightweight rule based negation detection. Implements the NegEx algorithm with the clinical termset used by negspacy,
+# but matches trigger terms with a single compiled regex over tokenized text instead of running the full spacy pipeline.
+###
+
+PSEUDO_NEGATIONS = [
+    "gram negative",
+    "no further",
+    "not able to be",
+    "not certain if",
+    "not certain whether",
+    "not necessarily",
+    "without any further",
+    "without difficulty",
+    "without further",
+    "might not",
+    "not only",
+    "no increase",
+    "no significant change",
+    "no change",
+    "no definite change",
+    "not extend",
+    "not cause",
+    "not drain",
+    "not significant interval change",
+    "no significant interval change",
+    "no interval change",
+    "no suspicious change",
+]
+
+PRECEDING_NEGATIONS = [
+    "absence of",
+    "declined",
+    "denied",
+    "denies",
+    "denying",
+    "no sign of",
+    "no signs of",
+    "not",
+    "not demonstrate",
+    "symptoms atypical",
+    "doubt",
+    "negative for",
+    "no",
+    "versus",
+    "without",
+    "doesn't",
+    "doesnt",
+    "don't",
+    "dont",
+    "didn't",
+    "didnt",
+    "wasn't",
+    "wasnt",
+    "weren't",
+    "werent",
+    "isn't",
+    "isnt",
+    "aren't",
+    "arent",
+    "cannot",
+    "can't",
+    "cant",
+    "couldn't",
+    "couldnt",
+    "never",
+    "free of",
+    "no evidence of",
+    "no evidence to suggest",
+    "no history of",
+    "no findings of",
+    "no findings to indicate",
+    "no mammographic evidence of",
+    "no new evidence",
+    "no radiographic evidence of",
+    "no suspicious",
+    "no complaints of",
+    "fails to reveal",
+    "rules out",
+    "ruled out",
+    "rule out",
+    "rule him out",
+    "rule her out",
+    "rule patient out",
+    "rule the patient out",
+    "r / o",
+    "ro",
+    "excluded",
+    "without any evidence of",
+    "without evidence",
+    "without indication of",
+    "without sign of",
+    "patient was not",
+    "unremarkable for",
+    "with no",
+]
+
+FOLLOWING_NEGATIONS = [
+    "declined",
+    "unlikely",
+    "was not",
+    "were not",
+    "wasn't",
+    "wasnt",
+    "weren't",
+    "werent",
+    "was ruled out",
+    "were ruled out",
+    "free",
+    "is ruled out",
+    "are ruled out",
+    "have been ruled out",
+    "has been ruled out",
+    "being ruled out",
+    "should be ruled out",
+    "is negative",
+    "are negative",
+]
+
+TERMINATIONS = [
+    "although",
+    "apart from",
+    "as there are",
+    "aside from",
+    "but",
+    "except",
+    "however",
+    "involving",
+    "nevertheless",
+    "still",
+    "though",
+    "which",
+    "yet",
+    "cause for",
+    "cause of",
+    "causes for",
+    "causes of",
+    "etiology for",
+    "etiology of",
+    "origin for",
+    "origin of",
+    "origins for",
+    "origins of",
+    "other possibilities of",
+    "reason for",
+    "reason of",
+    "reasons for",
+    "reasons of",
+    "secondary to",
+    "source for",
+    "source of",
+    "sources for",
+    "sources of",
+    "trigger event for",
+]
+
+TOKEN_REGEX = re.compile(r"\w+|[^\w\s]")
+
+
+def normalize(text):
+    # Lowercase and tokenize so that trigger terms match on token boundaries independent of spacing and punctuation
+    return " ".join(TOKEN_REGEX.findall(text.lower()))
+
+
+class NegexMatcher:
+    """
+    Rule based negation detection with compiled NegEx trigger terms. All terms are combined into one regex which is
+    matched over tokenized text, preferring the longest term at each position so that pseudo negations such as
+    "no change" shadow the negation "no".
+
+    Args:
+        pseudo_negations (list): Terms that look like negations but are not
+        preceding_negations (list): Terms that negate a keyword following them
+        following_negations (list): Terms that negate a keyword preceding them
+        terminations (list): Terms that end the scope of a negation
+    """
+
+    def __init__(
+        self,
+        pseudo_negations=PSEUDO_NEGATIONS,
+        preceding_negations=PRECEDING_NEGATIONS,
+        following_negations=FOLLOWING_NEGATIONS,
+        terminations=TERMINATIONS,
+    ):
+        self.categories = {}
+        for category, terms in [
+            ("pseudo", pseudo_negations),
+            ("preceding", preceding_negations),
+            ("following", following_negations),
+            ("termination", terminations),
+        ]:
+            for term in terms:
+                self.categories.setdefault(normalize(term), set()).add(category)
+
+        terms = sorted(self.categories, key=len, reverse=True)
+        self.regex = re.compile(
+            r"(?<!\S)(?:{})(?!\S)".format("|".join(re.escape(t) for t in terms))
+        )
+
+    def triggers(self, normalized_text):
+        return [
+            (m.start(), m.end(), self.categories[m.group(0)])
+            for m in self.regex.finditer(normalized_text)
+        ]
+
+    def negated(self, text, keyword):
+        """
+        Check if the first mention of keyword in text is negated.
+
+        Args:
+            text (str): Text to search, typically a single sentence
+            keyword (str): Keyword to look for
+
+        Returns:
+            negated (bool): True if the keyword is negated, False if it is affirmed and None if it is not mentioned
+        """
+        normalized_text = normalize(text)
+        normalized_keyword = normalize(keyword)
+        keyword_start = normalized_text.find(normalized_keyword)
+        if keyword_start == -1:
+            return None
+        keyword_end = keyword_start + len(normalized_keyword)
+
+        triggers = self.triggers(normalized_text)
+
+        # Closest preceding trigger decides, unless a termination closes the scope first
+        for start, end, categories in reversed(triggers):
+            if end > keyword_start:
+                continue
+            if "termination" in categories:
+                break
+            if "preceding" in categories:
+                return True
+
+        for start, end, categories in triggers:
+            if start < keyword_end:
+                continue
+            if "termination" in categories:
+                break
+            if "following" in categories:
+                return True
+
+        return False
+
+
+negex_matcher = NegexMatcher()
+
+
+# Makes check if a keyword is positive i.e. occurs and is not negated, using only the rule based matcher
+def keyword_positive_negex(sentence, keyword):
+    negated = negex_matcher.negated(sentence, keyword)
+    if negated is None:
+        return False
+    return not negated
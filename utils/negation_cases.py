@@ -0,0 +1,30 @@
+# Labeled regression set of (text, keyword, keyword is positive). Used by tests/Negation_test.py and by
+# benchmarks/negation_benchmark.py which checks the agreement of the rule based and the spacy negation engines on it
+NEGATION_REGRESSION_CASES = [
+    ("Acute appendicitis", "appendicitis", True),
+    ("Laparoscopic appendectomy", "appendectomy", True),
+    ("No appendicitis", "appendicitis", False),
+    ("No signs of appendicitis", "appendicitis", False),
+    ("No evidence of acute cholecystitis", "cholecystitis", False),
+    ("Absence of typical indications of appendicitis", "appendicitis", False),
+    ("Patient denies abdominal pain", "abdominal pain", False),
+    ("Pancreatitis was ruled out", "pancreatitis", False),
+    ("Cholecystitis unlikely", "cholecystitis", False),
+    ("Negative for diverticulitis", "diverticulitis", False),
+    ("Without perforation", "perforation", False),
+    ("No fever but acute pancreatitis", "pancreatitis", True),
+    ("No change in the diverticulitis", "diverticulitis", True),
+    ("Gram negative bacteremia", "bacteremia", True),
+    ("Percutaneous cholecystostomy", "cholecystostomy", True),
+    ("Open cholecystectomy", "cholecystectomy", True),
+    ("Sigmoid colectomy with end colostomy", "colectomy", True),
+    ("ERCP with sphincterotomy", "ercp", True),
+    ("Acute pancreatitis", "cholecystitis", False),
+    ("Drainage of abscess", "drainage", True),
+    ("Perforated appendicitis with abscess", "appendicitis", True),
+    ("Diverticulitis of colon without perforation or abscess", "diverticulitis", True),
+    ("Diverticulitis of colon without perforation or abscess", "abscess", False),
+    ("Calculus of gallbladder with acute cholecystitis", "cholecystitis", True),
+    ("Acute cholecystitis, not gangrenous", "cholecystitis", True),
+    ("Cholangitis is negative", "cholangitis", False),
+]
@@ -15,6 +15,9 @@ from transformers import LlamaTokenizer
 import tiktoken
 
 from tools.utils import FLUID_MAPPING, itemid_to_field
+from utils.doc_cache import DocCache
+from utils.negation import keyword_positive_negex
+from utils import primary_diagnosis
 
 nlp = spacy.load("en_core_sci_lg")
 nlp.add_pipe(
@@ -26,26 +29,54 @@ nlp.add_pipe(
 )
 # nltk.download("stopwords")
 
+# Optional persistent cache of parsed docs. Enable with enable_doc_cache
+doc_cache = None
+
 ###
 # Collection of functions for natural language processing utility
 ###
 
 
-def treatment_alternative_procedure_checker(operation_keywords, text):
+# Cache parsed docs on disk so repeated runs over the same texts skip the spacy pipeline
+def enable_doc_cache(cache_dir):
+    global doc_cache
+    doc_cache = DocCache(cache_dir, nlp)
+    return doc_cache
+
+
+# Parse text with the clinical pipeline, going through the doc cache if enabled
+def parse(text):
+    if doc_cache is None:
+        return nlp(text)
+    return doc_cache.get(text)
+
+
+def treatment_alternative_procedure_checker(
+    operation_keywords, text, negation_engine="spacy"
+):
     for alternative_operations in operation_keywords:
         op_loc = alternative_operations["location"]
         for op_mod in alternative_operations["modifiers"]:
             for sentence in text.split("."):
-                if keyword_positive(sentence, op_loc) and keyword_positive(
-                    sentence, op_mod
-                ):
+                if keyword_positive(
+                    sentence, op_loc, negation_engine
+                ) and keyword_positive(sentence, op_mod, negation_engine):
                     return True
     return False
 
 
 # Makes check if a keyword is positive i.e. occurs and is not negated. For negation check uses the negex algorithm i.e. "No appendicitis" or "No signs of appendicitis" or "Abscence of typical indications of appendicitis"
-def keyword_positive(sentence, keyword):
-    doc = nlp(sentence)
+# negation_engine "spacy" runs negex on the entities of the full scispacy pipeline, "negex" only runs the rule based trigger matcher which is much faster for short strings.
+# The engines differ in what is negated: "spacy" decides on the first scispacy entity containing the keyword and only falls back to a plain substring check if no entity contains it,
+# "negex" (utils.negation.keyword_positive_negex) matches the keyword as substring of the sentence and negates it if it is in the scope of a trigger. They can thus disagree if
+# the entity spans differ from the negation scope, e.g. when the keyword is part of a longer entity
+def keyword_positive(sentence, keyword, negation_engine="spacy"):
+    if negation_engine == "negex":
+        return keyword_positive_negex(sentence, keyword)
+    if negation_engine != "spacy":
+        raise ValueError("Negation engine not supported")
+
+    doc = parse(sentence)
 
     for e in doc.ents:
         if keyword.lower() in e.text.lower():
@@ -62,20 +93,26 @@ def remove_punctuation(input_string):
     return input_string.translate(translator)
 
 
-def contains(keyword: str, strings: List[str]):
-    return any(keyword_positive(string, keyword) for string in strings)
+def contains(keyword: str, strings: List[str], negation_engine: str = "spacy"):
+    return any(keyword_positive(string, keyword, negation_engine) for string in strings)
 
 
 # Check if diagnosis is in list of diagnoses. Combines discharge text diagnosis with all recorded ICD diagnoses
-def diagnosis_checker(discharge_diagnosis: str, icd_diagnoses: List[str], keyword: str):
+def diagnosis_checker(
+    discharge_diagnosis: str,
+    icd_diagnoses: List[str],
+    keyword: str,
+    negation_engine: str = "spacy",
+):
     diags = copy.deepcopy(icd_diagnoses)
     diags.append(discharge_diagnosis)
-    return contains(keyword, diags)
+    return contains(keyword, diags, negation_engine)
 
 
 def procedure_checker(
     valid_procedures: List,
     done_procedures: List,
+    negation_engine: str = "spacy",
 ):
     for valid_procedure in valid_procedures:
         if type(valid_procedure) == int:
@@ -83,7 +120,7 @@ def procedure_checker(
                 return True
         else:
             for done_procedure in done_procedures:
-                if keyword_positive(done_procedure, valid_procedure):
+                if keyword_positive(done_procedure, valid_procedure, negation_engine):
                     return True
 
 
@@ -262,70 +299,21 @@ def extract_sections(text, tags_list):
 
 # Text parses differently if done line by line and as a whole. This function extracts the first diagnosis from the text by checking both
 def extract_primary_diagnosis(text):
-    earliest_keyword_index = len(text)
+    return primary_diagnosis.extract_primary_diagnosis(text, parse)
 
-    # Do parsing of entire text and check for earliest possible diagnosis
-    doc = nlp(text)
-    diag = check_ents_for_diagnosis_noun_chunks(doc)
-    if diag:
-        earliest_keyword_index = min(earliest_keyword_index, text.find(diag))
-    diag = check_ents_for_diagnosis_entities(doc)
-    if diag:
-        earliest_keyword_index = min(earliest_keyword_index, text.find(diag))
-
-    # Do parsing of each line and check for earliest possible diagnosis
-    for line in text.split("\n"):
-        doc = nlp(line)
-        diag = check_ents_for_diagnosis_noun_chunks(doc)
-        if diag:
-            earliest_keyword_index = min(earliest_keyword_index, text.find(diag))
-            break
-        diag = check_ents_for_diagnosis_entities(doc)
-        if diag:
-            earliest_keyword_index = min(earliest_keyword_index, text.find(diag))
-            break
-
-    # Extract line with diagnosis and make sure we only return the first diagnosis if multiple given on one line
-    prim_diag = text[earliest_keyword_index:]
-    prim_diag = prim_diag.split("\n")[0]
-    prim_diag = prim_diag.split(",")[0]
-    # We can split on 'and' here because we are just looking for the general pathology, not a specific subtype i.e. "diverticulitis with perforation and stricture and abscess"
-    prim_diag = re.split(r"\band\b", prim_diag)[0]
-    prim_diag = re.split(r"\bor\b", prim_diag)[0]
-    prim_diag = re.split(r"\bvs[.]?\b", prim_diag)[0]
-    return prim_diag.strip()
-
-
-def check_ents_for_diagnosis_entities(doc):
-    for e in doc.ents:
-        d = e.text.lower()
-        if (
-            "primary" not in d
-            and "diagnosis" not in d
-            and "diagnoses" not in d
-            and "dx" not in d
-            and d != "active"
-            and d != "acute"
-        ):
-            return e.text
-    return None
-
-
-def check_ents_for_diagnosis_noun_chunks(doc):
-    for chunk in doc.noun_chunks:
-        d = chunk.text.lower()
-        # Remove initial characters to first letter
-        d = re.sub(r"^[^a-zA-Z]+", "", d)
-        if (
-            "primary" not in d
-            and "diagnosis" not in d
-            and "diagnoses" not in d
-            and "dx" not in d
-            and d != "active"
-            and d != "acute"
-        ):
-            return d.strip()
-    return None
+
+# Batched version of extract_primary_diagnosis. All texts and their lines are parsed in one nlp.pipe stream
+def extract_primary_diagnosis_batch(texts: List[str], n_process=1, batch_size=256):
+    return primary_diagnosis.extract_primary_diagnosis_batch(
+        texts, parse_many, n_process=n_process, batch_size=batch_size
+    )
+
+
+# Parse many texts in one nlp.pipe stream, going through the doc cache if enabled
+def parse_many(texts: List[str], n_process=1, batch_size=256):
+    if doc_cache is None:
+        return list(nlp.pipe(texts, n_process=n_process, batch_size=batch_size))
+    return doc_cache.pipe(texts, n_process=n_process, batch_size=batch_size)
 
 
 def calculate_num_tokens(tokenizer, inputs):
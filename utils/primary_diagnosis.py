@@ -0,0 +1,105 @@
+import re
+from typing import List
+
+###
+# Extraction of the primary diagnosis from the discharge diagnosis. The texts are parsed by the functions passed in,
+# so that this module does not load the scispacy model itself
+###
+
+
+# Text parses differently if done line by line and as a whole. This function extracts the first diagnosis from the text by checking both
+# parse maps a text to its spacy Doc, e.g. utils.nlp.parse
+def extract_primary_diagnosis(text, parse):
+    # Lines are parsed lazily so that parsing stops at the first line with a diagnosis
+    line_docs = (parse(line) for line in text.split("\n"))
+    return primary_diagnosis_from_docs(text, parse(text), line_docs)
+
+
+# Batched version of extract_primary_diagnosis. All texts and their lines are parsed in one nlp.pipe stream by
+# parse_many, e.g. utils.nlp.parse_many
+def extract_primary_diagnosis_batch(
+    texts: List[str], parse_many, n_process=1, batch_size=256
+):
+    text_lines = [text.split("\n") for text in texts]
+
+    # Lines such as "primary:" repeat across cases, so only parse each unique string once
+    unique_texts = list(dict.fromkeys(texts))
+    for lines in text_lines:
+        unique_texts.extend(lines)
+    unique_texts = list(dict.fromkeys(unique_texts))
+    docs = dict(
+        zip(
+            unique_texts,
+            parse_many(unique_texts, n_process=n_process, batch_size=batch_size),
+        )
+    )
+
+    return [
+        primary_diagnosis_from_docs(text, docs[text], (docs[line] for line in lines))
+        for text, lines in zip(texts, text_lines)
+    ]
+
+
+def primary_diagnosis_from_docs(text, doc, line_docs):
+    earliest_keyword_index = len(text)
+
+    # Check parse of entire text for earliest possible diagnosis
+    diag = check_ents_for_diagnosis_noun_chunks(doc)
+    if diag:
+        earliest_keyword_index = min(earliest_keyword_index, text.find(diag))
+    diag = check_ents_for_diagnosis_entities(doc)
+    if diag:
+        earliest_keyword_index = min(earliest_keyword_index, text.find(diag))
+
+    # Check parse of each line for earliest possible diagnosis
+    for doc in line_docs:
+        diag = check_ents_for_diagnosis_noun_chunks(doc)
+        if diag:
+            earliest_keyword_index = min(earliest_keyword_index, text.find(diag))
+            break
+        diag = check_ents_for_diagnosis_entities(doc)
+        if diag:
+            earliest_keyword_index = min(earliest_keyword_index, text.find(diag))
+            break
+
+    # Extract line with diagnosis and make sure we only return the first diagnosis if multiple given on one line
+    prim_diag = text[earliest_keyword_index:]
+    prim_diag = prim_diag.split("\n")[0]
+    prim_diag = prim_diag.split(",")[0]
+    # We can split on 'and' here because we are just looking for the general pathology, not a specific subtype i.e. "diverticulitis with perforation and stricture and abscess"
+    prim_diag = re.split(r"\band\b", prim_diag)[0]
+    prim_diag = re.split(r"\bor\b", prim_diag)[0]
+    prim_diag = re.split(r"\bvs[.]?\b", prim_diag)[0]
+    return prim_diag.strip()
+
+
+def check_ents_for_diagnosis_entities(doc):
+    for e in doc.ents:
+        d = e.text.lower()
+        if (
+            "primary" not in d
+            and "diagnosis" not in d
+            and "diagnoses" not in d
+            and "dx" not in d
+            and d != "active"
+            and d != "acute"
+        ):
+            return e.text
+    return None
+
+
+def check_ents_for_diagnosis_noun_chunks(doc):
+    for chunk in doc.noun_chunks:
+        d = chunk.text.lower()
+        # Remove initial characters to first letter
+        d = re.sub(r"^[^a-zA-Z]+", "", d)
+        if (
+            "primary" not in d
+            and "diagnosis" not in d
+            and "diagnoses" not in d
+            and "dx" not in d
+            and d != "active"
+            and d != "acute"
+        ):
+            return d.strip()
+    return None